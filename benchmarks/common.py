@@ -0,0 +1,124 @@
+"""Helpers shared by the benchmarks - fixture services, statistics and results
+"""
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Mapping, Any, Optional, Sequence
+
+import yaml
+
+from pylunch import config, lunch, __version__
+
+from .server import FIXTURES
+
+log = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def fixture_restaurants(base: str, file: Path = FIXTURES / 'restaurants.yaml') -> dict:
+    content = file.read_text(encoding='utf-8').replace('{base}', base)
+    restaurants = yaml.safe_load(content)['restaurants']
+    for (name, restaurant) in restaurants.items():
+        restaurant['name'] = name
+    return restaurants
+
+
+def make_service(base: str, cache_dir: Path, skip: Sequence[str] = (), **kwargs) -> lunch.LunchService:
+    """Creates the lunch service for the fixture restaurants served at the base url
+    """
+    restaurants = fixture_restaurants(base)
+    for name in list(restaurants.keys()):
+        if any(name.startswith(prefix) for prefix in skip):
+            del restaurants[name]
+    # Zomato responses are replayed through the fixture server as well
+    cfg = config.AppConfig(cache_dir=str(cache_dir), zomato_key='benchmark', zomato_url=f"{base}/zomato", **kwargs)
+    return lunch.LunchService(cfg, lunch.Entities(restaurants))
+
+
+def default_skip() -> List[str]:
+    skip = []
+    if shutil.which('tesseract') is None:
+        log.warning("[BENCH] Tesseract is not available - skipping the OCR fixtures")
+        skip.append('bench-ocr')
+    return skip
+
+
+def percentiles(values: Sequence[float], points=(50, 95, 99)) -> Mapping[str, float]:
+    if not values:
+        return {f"p{point}": None for point in points}
+    ordered = sorted(values)
+    result = {}
+    for point in points:
+        idx = max(0, min(len(ordered) - 1, math.ceil(point / 100 * len(ordered)) - 1))
+        result[f"p{point}"] = ordered[idx]
+    return result
+
+
+def stats(values: Sequence[float]) -> Mapping[str, Any]:
+    if not values:
+        return dict(count=0)
+    return dict(count=len(values), mean=sum(values) / len(values), min=min(values), max=max(values),
+                **percentiles(values))
+
+
+def metadata() -> Mapping[str, Any]:
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(ROOT), stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        rev = None
+    return dict(
+        version=__version__,
+        revision=rev or None,
+        timestamp=datetime.datetime.now().isoformat(),
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+    )
+
+
+def save_results(file: Optional[str], results: Mapping[str, Any]):
+    if not file:
+        return
+    Path(file).write_text(json.dumps(results, indent=2, sort_keys=True), encoding='utf-8')
+    print(f"Results saved to: {file}")
+
+
+def _flatten(prefix: str, value: Any, result: dict):
+    if isinstance(value, Mapping):
+        for (key, item) in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else str(key), item, result)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        result[prefix] = value
+
+
+def compare_results(baseline_file: str, results: Mapping[str, Any], threshold: float = 0.1,
+                    higher_is_better=('rps', 'throughput')) -> List[str]:
+    """Compares the numbers in the results with the baseline, returns the list of regressions
+    bigger than the threshold (relative change)
+    """
+    baseline = json.loads(Path(baseline_file).read_text(encoding='utf-8'))
+    old = {}
+    new = {}
+    _flatten('', baseline.get('scenarios', {}), old)
+    _flatten('', results.get('scenarios', {}), new)
+    regressions = []
+    print(f"\n{'METRIC':<60} {'BASELINE':>12} {'CURRENT':>12} {'CHANGE':>8}")
+    for (key, value) in sorted(new.items()):
+        if key not in old or key.endswith('.count') or not old[key]:
+            continue
+        change = (value - old[key]) / old[key]
+        worse = -change if any(part in key for part in higher_is_better) else change
+        mark = ' !' if worse > threshold else ''
+        print(f"{key:<60} {old[key]:>12.4f} {value:>12.4f} {change * 100:>7.1f}%{mark}")
+        if worse > threshold:
+            regressions.append(key)
+    return regressions
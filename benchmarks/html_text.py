@@ -0,0 +1,117 @@
+"""HTML to text conversion benchmark
+
+Converts the recorded restaurant pages (benchmarks/fixtures) - the whole pages and the parts selected
+by the fixture restaurants selectors - by each text engine and measures:
+
+ - convert - conversion time per page and engine (the memo is bypassed)
+ - memo    - ``text_engine.to_text`` with the memoized result
+ - diff    - number of the lines of the engine output different from the html2text output
+
+    $ python -m benchmarks.html_text -n 50 -o results.json
+    $ python -m benchmarks.html_text -n 50 --compare results.json
+    $ python -m benchmarks.html_text --page ~/.cache/pylunch/2024-01-15/u-drevaka-html.html
+"""
+import difflib
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import List, Mapping, Any, Tuple
+
+import click
+import yaml
+
+from pylunch import log_config, text_engine
+
+from . import common
+from .server import FIXTURES
+
+log = logging.getLogger(__name__)
+
+
+def fixture_pages() -> List[Tuple[str, str]]:
+    """The fixture pages - whole and the parts selected by the restaurants selectors
+    """
+    from bs4 import BeautifulSoup
+    restaurants = yaml.safe_load((FIXTURES / 'restaurants.yaml').read_text(encoding='utf-8'))['restaurants']
+    pages = []
+    for file in sorted(FIXTURES.glob('*.html')):
+        html = file.read_text(encoding='utf-8')
+        pages.append((file.name, html))
+        url = f"{{base}}/{file.name}"
+        for (name, restaurant) in restaurants.items():
+            selector = restaurant.get('selector')
+            if restaurant.get('url') != url or not selector:
+                continue
+            selected = "".join(str(item) for item in BeautifulSoup(html, 'lxml').select(selector))
+            pages.append((f"{file.name}:{name}", selected))
+    return pages
+
+
+def bench_convert(pages: List[Tuple[str, str]], engines: List[str], repeat: int) -> Mapping[str, Any]:
+    result = {}
+    for (name, html) in pages:
+        expected = text_engine.Html2TextEngine().to_text(html)
+        result[name] = dict(size=len(html))
+        for engine_name in engines:
+            engine = text_engine.ENGINES[engine_name]()
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                text = engine.to_text(html)
+                samples.append(time.perf_counter() - start)
+            diff = [line for line in difflib.unified_diff(expected.splitlines(), text.splitlines(), lineterm='', n=0)
+                    if line[:1] in '+-' and not line.startswith(('+++', '---'))]
+            result[name][engine_name] = dict(convert=common.stats(samples), diff_lines=len(diff))
+    return result
+
+
+def bench_memo(pages: List[Tuple[str, str]], repeat: int) -> Mapping[str, Any]:
+    samples = []
+    for (_, html) in pages:
+        text_engine.to_text(html)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            text_engine.to_text(html)
+            samples.append(time.perf_counter() - start)
+    return common.stats(samples)
+
+
+@click.command(help='Benchmark of the HTML to text conversion engines')
+@click.option('-n', '--repeat', help='Number of conversions per page', default=20)
+@click.option('-p', '--page', help='Additional HTML page to convert (file)', multiple=True)
+@click.option('-e', '--engine', help='Engines to compare', multiple=True,
+              type=click.Choice(list(text_engine.ENGINES.keys())))
+@click.option('-o', '--output', help='Save the results as JSON', default=None)
+@click.option('-c', '--compare', help='Compare with the results saved in the JSON file', default=None)
+@click.option('--threshold', help='Relative regression threshold for the comparison', default=0.1)
+@click.option('-L', '--log-level', help='Set log level (d|i|w|e)', default='e')
+def main(repeat: int, page=(), engine=(), output=None, compare=None, threshold=0.1, log_level='e'):
+    log_config.load(log_level)
+    engines = list(engine or text_engine.ENGINES.keys())
+    pages = fixture_pages() + [(Path(file).name, Path(file).read_text(encoding='utf-8')) for file in page]
+    results = dict(meta=dict(**common.metadata(), repeat=repeat), scenarios={})
+    results['scenarios']['pages'] = bench_convert(pages, engines, repeat=repeat)
+    results['scenarios']['memo'] = bench_memo(pages, repeat=repeat)
+    _print_results(results, engines)
+    common.save_results(output, results)
+    if compare:
+        regressions = common.compare_results(compare, results, threshold=threshold)
+        if regressions:
+            print(f"\nRegressions over {threshold * 100:.0f}%: {len(regressions)}")
+            sys.exit(1)
+
+
+def _print_results(results: Mapping[str, Any], engines: List[str]):
+    header = " ".join(f"{name + ' ms':>14} {'diff':>5}" for name in engines)
+    print(f"{'PAGE':<40} {'SIZE':>8} {header}")
+    for (name, result) in results['scenarios']['pages'].items():
+        row = " ".join(f"{result[engine]['convert']['p50'] * 1000:>14.3f} {result[engine]['diff_lines']:>5}"
+                       for engine in engines)
+        print(f"{name:<40} {result['size']:>8} {row}")
+    memo = results['scenarios']['memo']
+    print(f"\nMemoized conversion: p50 {memo['p50'] * 1e6:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
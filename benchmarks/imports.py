@@ -0,0 +1,114 @@
+"""Import time benchmark for the CLI
+
+Measures the import time of the ``pylunch.cli`` module using ``python -X importtime``
+and the wall time of the light CLI commands (``ls``, ``version``, ``config``).
+Exits with non-zero code when any of the measurements exceeds its budget.
+
+    $ python -m benchmarks.imports --budget-import 150 --budget-command 400
+"""
+import json
+import logging
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Mapping, Tuple
+
+import click
+
+log = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parents[1]
+COMMANDS = ['ls', 'version', 'config']
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+# Modules that are expected to be imported lazily - only on the first use
+LAZY_MODULES = ['requests', 'bs4', 'html2text', 'lxml', 'fuzzywuzzy', 'unidecode', 'pyzomato', 'pdfminer',
+                'pytesseract', 'PIL']
+
+
+def import_times(module: str = 'pylunch.cli') -> List[Tuple[str, int, int]]:
+    """Returns list of tuples (module, self_us, cumulative_us) for the import of the module
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=str(ROOT), stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                          universal_newlines=True, check=True)
+    result = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            result.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return result
+
+
+def command_times(config_dir: Path, repeat: int) -> Mapping[str, List[float]]:
+    result = {}
+    for cmd in COMMANDS:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-m', 'pylunch.cli', '-c', str(config_dir), cmd], cwd=str(ROOT),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            times.append((time.perf_counter() - start) * 1000)
+        result[cmd] = times
+    return result
+
+
+def _prepare_config(config_dir: Path, restaurants: Path):
+    config_dir.mkdir(parents=True, exist_ok=True)
+    (config_dir / 'config.yaml').write_text(
+        f"restaurants: ./restaurants.yaml\ncache_dir: {config_dir / 'cache'}\n", encoding='utf-8')
+    (config_dir / 'restaurants.yaml').write_text(restaurants.read_text(encoding='utf-8'), encoding='utf-8')
+
+
+@click.command(help='Import time benchmark for the pylunch CLI')
+@click.option('--budget-import', help='Budget for the "pylunch.cli" import (ms)', default=150.0)
+@click.option('--budget-command', help='Budget for the median of the command wall time (ms)', default=400.0)
+@click.option('-r', '--repeat', help='Number of the command executions', default=5)
+@click.option('--restaurants', help='Restaurants file used for the commands',
+              default=str(ROOT / 'resources' / 'restaurants.yml'))
+@click.option('-o', '--output', help='Save the results as JSON', default=None)
+def main(budget_import: float, budget_command: float, repeat: int, restaurants: str, output: str = None):
+    failed = []
+    imports = import_times()
+    cumulative = {name: cum for (name, _, cum) in imports}
+    cli_ms = cumulative.get('pylunch.cli', 0) / 1000
+    print(f"Import 'pylunch.cli': {cli_ms:.1f} ms (budget {budget_import:.1f} ms)")
+    if cli_ms > budget_import:
+        failed.append('import')
+
+    eager = [name for name in LAZY_MODULES if name in cumulative]
+    if eager:
+        print(f"Eagerly imported modules: {eager}")
+        failed.append('lazy')
+
+    print("Slowest imports:")
+    for (name, _, cum) in sorted(imports, key=lambda x: x[2], reverse=True)[:10]:
+        print(f"  {cum / 1000:8.1f} ms  {name}")
+
+    with tempfile.TemporaryDirectory(prefix='pylunch-bench-') as tmp:
+        config_dir = Path(tmp) / 'config'
+        _prepare_config(config_dir, Path(restaurants))
+        commands = command_times(config_dir, repeat=repeat)
+
+    medians = {}
+    for (cmd, times) in commands.items():
+        medians[cmd] = statistics.median(times)
+        print(f"Command '{cmd}': median {medians[cmd]:.1f} ms, min {min(times):.1f} ms (budget {budget_command:.1f} ms)")
+        if medians[cmd] > budget_command:
+            failed.append(cmd)
+
+    if output:
+        result = dict(import_ms=cli_ms, eager=eager, commands=medians, failed=failed,
+                      budget=dict(command=budget_command, imports=budget_import))
+        Path(output).write_text(json.dumps(result, indent=2), encoding='utf-8')
+
+    if failed:
+        print(f"Over the budget: {failed}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
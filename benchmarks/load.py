@@ -0,0 +1,301 @@
+"""Load test of the web application
+
+Boots the web app against the fixture restaurants (served by the local fixture server)
+and drives the lunchtime traffic - the menu page, restaurants list and the per-restaurant
+menu fan-out (as the menu page does), tag queries and the admin cache invalidation.
+Reports the latency percentiles and requests/sec per route for the cold and warm cache.
+
+    # in-process threaded werkzeug server
+    $ python -m benchmarks.load --visitors 20 --duration 20
+    # gunicorn with the selected worker model
+    $ python -m benchmarks.load --server gunicorn --workers 3 --worker-class gthread --threads 4 -o gthread.json
+"""
+import collections
+import concurrent.futures
+import contextlib
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Mapping, Any, List, Optional, Iterator
+
+import click
+import requests
+import yaml
+
+from pylunch import log_config
+
+from . import common
+from .server import FixtureServer
+
+log = logging.getLogger(__name__)
+
+ADMIN_USER = 'admin'
+ADMIN_PASSWORD = 'benchmark'
+
+
+class RouteStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = collections.defaultdict(list)
+        self._errors = collections.Counter()
+
+    def record(self, route: str, duration: float, ok: bool):
+        with self._lock:
+            self._latencies[route].append(duration)
+            if not ok:
+                self._errors[route] += 1
+
+    def result(self, wall: float) -> Mapping[str, Any]:
+        with self._lock:
+            routes = {}
+            for (route, values) in self._latencies.items():
+                routes[route] = dict(**common.stats(values), errors=self._errors[route],
+                                     rps=len(values) / wall if wall else None)
+            total = sum(len(values) for values in self._latencies.values())
+        return dict(wall_seconds=wall, requests=total, rps=total / wall if wall else None, routes=routes)
+
+
+class Visitor:
+    """Simulates one visitor of the menu page - loads the page, the restaurants
+    and then the menus for all restaurants in parallel (as the browser does)
+    """
+
+    def __init__(self, base: str, stats: RouteStats, fanout: int = 6, tags: List[str] = None,
+                 tag_ratio: float = 0.3):
+        self.base = base
+        self.stats = stats
+        self.fanout = fanout
+        self.tags = tags or []
+        self.tag_ratio = tag_ratio
+        self.session = requests.Session()
+
+    def get(self, path: str, route: str = None, **kwargs) -> Optional[requests.Response]:
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.base + path, timeout=120, **kwargs)
+            ok = response.status_code < 500
+        except requests.RequestException as ex:
+            log.warning(f"[LOAD] Request failed {path}: {ex}")
+            response = None
+            ok = False
+        self.stats.record(route or path, time.perf_counter() - start, ok)
+        return response
+
+    def visit(self):
+        params = {}
+        if self.tags and random.random() < self.tag_ratio:
+            params['t'] = random.choice(self.tags)
+        self.get('/menu', route='/menu?t' if params else '/menu', params=params)
+        response = self.get('/api/restaurants', route='/api/restaurants?t' if params else '/api/restaurants',
+                            params=params)
+        if response is None or not response.ok:
+            return
+        names = [name for (name, item) in response.json().items() if not item.get('disabled')]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.fanout) as executor:
+            list(executor.map(lambda name: self.get(f'/api/restaurants/{name}/menu',
+                                                    route='/api/restaurants/<name>/menu'), names))
+
+
+class Admin:
+    def __init__(self, base: str, stats: RouteStats):
+        self.base = base
+        self.stats = stats
+        self.session = requests.Session()
+
+    def login(self):
+        response = self.session.post(self.base + '/site-admin/token/auth',
+                                     data=dict(username=ADMIN_USER, password=ADMIN_PASSWORD), timeout=30)
+        if response.ok:
+            token = response.json()['access_token']
+            self.session.headers['Authorization'] = f"Bearer {token}"
+        else:
+            log.warning(f"[LOAD] Admin login failed: {response.status_code}")
+
+    def invalidate(self):
+        start = time.perf_counter()
+        try:
+            ok = self.session.post(self.base + '/site-admin/cache-invalidate', timeout=60).ok
+        except requests.RequestException:
+            ok = False
+        self.stats.record('/site-admin/cache-invalidate', time.perf_counter() - start, ok)
+
+
+def run_phase(base: str, visitors: int, duration: Optional[float], think: float, fanout: int,
+              tags: List[str], admin: Admin = None, invalidate_every: float = 0) -> Mapping[str, Any]:
+    """Runs the visitors concurrently - either each visitor once (duration is None) or repeatedly
+    for the duration in seconds
+    """
+    stats = RouteStats()
+    stop = threading.Event()
+    if admin is not None:
+        admin.stats = stats
+
+    def _visitor():
+        visitor = Visitor(base, stats, fanout=fanout, tags=tags)
+        visitor.visit()
+        while duration is not None and not stop.is_set():
+            time.sleep(random.uniform(0, think * 2))
+            visitor.visit()
+
+    def _admin():
+        while not stop.wait(invalidate_every):
+            admin.invalidate()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_visitor, daemon=True) for _ in range(visitors)]
+    if admin is not None and invalidate_every and duration is not None:
+        threads.append(threading.Thread(target=_admin, daemon=True))
+    for thread in threads:
+        thread.start()
+    if duration is not None:
+        stop.wait(duration)
+        stop.set()
+    for thread in threads:
+        thread.join()
+    return stats.result(time.perf_counter() - start)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(base: str, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base + '/api/tags', timeout=5).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Application has not started: {base}")
+
+
+def prepare_config(config_dir: Path, upstream: str) -> Mapping[str, str]:
+    """Creates the config dir with the fixture restaurants and the admin user,
+    returns the environment for the web application
+    """
+    from werkzeug.security import generate_password_hash
+
+    config_dir.mkdir(parents=True, exist_ok=True)
+    restaurants = common.fixture_restaurants(upstream)
+    for name in common.default_skip():
+        restaurants.pop(name, None)
+    (config_dir / 'config.yaml').write_text(yaml.safe_dump(dict(
+        restaurants='./restaurants.yaml', cache_dir=str(config_dir / 'cache'), visitors=str(config_dir),
+        zomato_key='benchmark', zomato_url=f"{upstream}/zomato")), encoding='utf-8')
+    (config_dir / 'restaurants.yaml').write_text(yaml.safe_dump(dict(restaurants=restaurants)), encoding='utf-8')
+    users = config_dir / 'users.yml'
+    users.write_text(yaml.safe_dump({ADMIN_USER: generate_password_hash(ADMIN_PASSWORD)}), encoding='utf-8')
+    return dict(PYLUNCH_CONFIG_DIR=str(config_dir), PYLUNCH_USERS=str(users), PYLUNCH_SECRET='benchmark')
+
+
+@contextlib.contextmanager
+def boot_app(server: str, env: Mapping[str, str], app: str, workers: int, worker_class: str,
+             threads: int, log_level: str = 'e', preload: bool = False) -> Iterator[str]:
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    if server == 'inprocess':
+        from werkzeug.serving import make_server
+        os.environ.update(env)
+        (module, _, attr) = app.partition(':')
+        __import__(module)
+        wsgi = getattr(sys.modules[module], attr)
+        httpd = make_server('127.0.0.1', port, wsgi, threaded=True)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        try:
+            _wait_ready(base)
+            # the web application configures the logging on the first request
+            logging.getLogger('pylunch').setLevel(log_config.LVL_MAP.get(log_level, 'ERROR'))
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            yield base
+        finally:
+            httpd.shutdown()
+        return
+
+    cmd = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--worker-class', worker_class,
+           '--threads', str(threads), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', app]
+    if preload:
+        # The application preloaded by the master process (pylunch/gunicorn_conf.py)
+        cmd[3:3] = ['--config', 'python:pylunch.gunicorn_conf']
+    log.info(f"[LOAD] Starting: {' '.join(cmd)}")
+    proc = subprocess.Popen(cmd, env={**os.environ, **env}, cwd=str(common.ROOT))
+    try:
+        _wait_ready(base)
+        yield base
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+@click.command(help='Load test of the web application using the fixture restaurants')
+@click.option('--server', help='How to run the application', default='inprocess',
+              type=click.Choice(['inprocess', 'gunicorn']))
+@click.option('--app', help='Application to run (module:attribute)', default='pylunch.web:app')
+@click.option('--workers', help='Number of gunicorn workers', default=3)
+@click.option('--worker-class', help='Gunicorn worker class (sync, gthread, gevent, ...)', default='sync')
+@click.option('--threads', help='Number of threads per gunicorn worker', default=1)
+@click.option('--preload', help='Preload the application in the gunicorn master', is_flag=True, default=False)
+@click.option('-v', '--visitors', help='Number of concurrent visitors', default=10)
+@click.option('-d', '--duration', help='Duration of the warm phase (seconds)', default=15.0)
+@click.option('--think', help='Mean think time of a visitor between visits (seconds)', default=1.0)
+@click.option('--fanout', help='Parallel menu requests per visitor', default=6)
+@click.option('--invalidate-every', help='Admin cache invalidation period in the warm phase (seconds, 0=never)',
+              default=0.0)
+@click.option('--latency', help='Artificial latency of the fixture server (ms)', default=50.0)
+@click.option('-o', '--output', help='Save the results as JSON', default=None)
+@click.option('-c', '--compare', help='Compare with the results saved in the JSON file', default=None)
+@click.option('-L', '--log-level', help='Set log level (d|i|w|e)', default='e')
+def main(server: str, app: str, workers: int, worker_class: str, threads: int, visitors: int, duration: float,
+         think: float, fanout: int, invalidate_every: float, latency: float, output=None, compare=None,
+         log_level='e', preload=False):
+    log_config.load(log_level)
+    results = dict(meta=dict(**common.metadata(), server=server, app=app, workers=workers,
+                             worker_class=worker_class, threads=threads, preload=preload, visitors=visitors,
+                             latency_ms=latency), scenarios={})
+
+    with FixtureServer(latency=latency / 1000) as upstream, tempfile.TemporaryDirectory(prefix='pylunch-') as tmp:
+        env = prepare_config(Path(tmp) / 'config', upstream.base)
+        with boot_app(server, env, app=app, workers=workers, worker_class=worker_class, threads=threads,
+                      log_level=log_level, preload=preload) as base:
+            tags = requests.get(base + '/api/tags', timeout=30).json()
+            admin = Admin(base, RouteStats())
+            admin.login()
+            admin.invalidate()
+            print("Running the cold phase")
+            results['scenarios']['cold'] = run_phase(base, visitors, duration=None, think=think, fanout=fanout,
+                                                     tags=tags)
+            print("Running the warm phase")
+            results['scenarios']['warm'] = run_phase(base, visitors, duration=duration, think=think,
+                                                     fanout=fanout, tags=tags, admin=admin,
+                                                     invalidate_every=invalidate_every)
+        results['meta']['upstream_hits'] = dict(upstream.hits)
+
+    _print_results(results)
+    common.save_results(output, results)
+    if compare:
+        common.compare_results(compare, results)
+
+
+def _print_results(results: Mapping[str, Any]):
+    for (phase, result) in results['scenarios'].items():
+        print(f"\n== {phase}: {result['requests']} requests in {result['wall_seconds']:.1f}s "
+              f"({result['rps']:.1f} req/s)")
+        print(f"{'ROUTE':<36} {'COUNT':>6} {'ERR':>4} {'REQ/S':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for (route, values) in sorted(result['routes'].items()):
+            print(f"{route:<36} {values['count']:>6} {values['errors']:>4} {values['rps']:>7.1f} "
+                  f"{values['p50'] * 1000:>9.1f} {values['p95'] * 1000:>9.1f} {values['p99'] * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
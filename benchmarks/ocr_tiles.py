@@ -0,0 +1,119 @@
+"""Tiled OCR benchmark
+
+Recognizes the sample images - the fixture menu image and the weekly scan made of the menu image
+repeated (``--pages``) - as the whole image and as the bands recognized in parallel, and measures
+the wall time per number of the workers (1, 2, 4, ... up to the number of the cores):
+
+ - whole - one tesseract call for the whole image
+ - tiled - the bands recognized by the workers, the speedup is relative to the whole image
+
+    $ python -m benchmarks.ocr_tiles -n 3 -o results.json
+    $ python -m benchmarks.ocr_tiles --image ~/scans/weekly-menu.png --engine pytesseract
+"""
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Mapping, Any, Tuple
+
+import click
+
+from pylunch import log_config, ocr
+
+from . import common
+from .server import FIXTURES
+
+log = logging.getLogger(__name__)
+
+
+def sample_images(pages: int) -> List[Tuple[str, 'Image.Image']]:
+    from PIL import Image
+    menu = Image.open(FIXTURES / 'menu.png')
+    menu.load()
+    scan = Image.new(menu.mode, (menu.width, menu.height * pages), 'white')
+    for page in range(pages):
+        scan.paste(menu, (0, page * menu.height))
+    return [('menu.png', menu), (f"menu.png x{pages}", scan)]
+
+
+def worker_counts() -> List[int]:
+    cores = os.cpu_count() or 1
+    counts = []
+    count = 1
+    while count < cores:
+        counts.append(count)
+        count *= 2
+    return counts + [cores]
+
+
+def bench_image(image: 'Image.Image', engine: str, lang: str, workers: List[int], repeat: int,
+                band_height: int) -> Mapping[str, Any]:
+    result = dict(size=list(image.size), bands=len(ocr.split_bands(image, band_height=band_height)))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ocr.image_to_string(image, lang=lang, engine=engine, pool_size=max(workers))
+        samples.append(time.perf_counter() - start)
+    result['whole'] = common.stats(samples)
+    for count in workers:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ocr.image_to_string_tiled(image, lang=lang, engine=engine, pool_size=max(workers), workers=count,
+                                      band_height=band_height)
+            samples.append(time.perf_counter() - start)
+        result[f"tiled_{count}"] = common.stats(samples)
+    return result
+
+
+@click.command(help='Benchmark of the tiled parallel OCR')
+@click.option('-n', '--repeat', help='Number of recognitions per image and workers', default=3)
+@click.option('-i', '--image', help='Additional image to recognize (file)', multiple=True)
+@click.option('-p', '--pages', help='Number of the menu pages of the sample weekly scan', default=4)
+@click.option('-e', '--engine', help='OCR engine', default=ocr.DEFAULT_ENGINE,
+              type=click.Choice(list(ocr.ENGINES.keys())))
+@click.option('-l', '--lang', help='Language of the images', default='ces')
+@click.option('-b', '--band-height', help='Height of the bands', default=ocr.BAND_HEIGHT)
+@click.option('-o', '--output', help='Save the results as JSON', default=None)
+@click.option('-c', '--compare', help='Compare with the results saved in the JSON file', default=None)
+@click.option('--threshold', help='Relative regression threshold for the comparison', default=0.1)
+@click.option('-L', '--log-level', help='Set log level (d|i|w|e)', default='e')
+def main(repeat: int, image=(), pages=4, engine=ocr.DEFAULT_ENGINE, lang='ces', band_height=ocr.BAND_HEIGHT,
+         output=None, compare=None, threshold=0.1, log_level='e'):
+    from PIL import Image
+    log_config.load(log_level)
+    workers = worker_counts()
+    images = sample_images(pages) + [(Path(file).name, Image.open(file)) for file in image]
+    try:
+        ocr.image_to_string(images[0][1], lang=lang, engine=engine)
+    except Exception as ex:
+        print(f"OCR engine {engine} is not usable: {ex}")
+        sys.exit(2)
+    results = dict(meta=dict(**common.metadata(), repeat=repeat, engine=ocr.get_engine(engine).name,
+                             band_height=band_height, workers=workers), scenarios={})
+    for (name, img) in images:
+        results['scenarios'][name] = bench_image(img, engine, lang, workers=workers, repeat=repeat,
+                                                 band_height=band_height)
+    _print_results(results, workers)
+    common.save_results(output, results)
+    if compare:
+        regressions = common.compare_results(compare, results, threshold=threshold)
+        if regressions:
+            print(f"\nRegressions over {threshold * 100:.0f}%: {len(regressions)}")
+            sys.exit(1)
+
+
+def _print_results(results: Mapping[str, Any], workers: List[int]):
+    header = " ".join(f"{f'{count} workers':>16}" for count in workers)
+    print(f"{'IMAGE':<24} {'SIZE':>12} {'BANDS':>6} {'whole ms':>10} {header}")
+    for (name, result) in results['scenarios'].items():
+        whole = result['whole']['p50']
+        row = " ".join(f"{result[f'tiled_{count}']['p50'] * 1000:>8.0f} ({whole / result[f'tiled_{count}']['p50']:>4.1f}x)"
+                       for count in workers)
+        size = 'x'.join(str(value) for value in result['size'])
+        print(f"{name:<24} {size:>12} {result['bands']:>6} {whole * 1000:>10.0f} {row}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""PDF extraction engines benchmark
+
+Extracts the text of the PDF corpus - the fixture menu and the documents given by ``--pdf``
+(files or directories) - by each available engine and measures:
+
+ - extract    - extraction time per document and engine
+ - pages/s    - extracted pages per second over the corpus
+ - similarity - similarity of the engine output to the pdfminer output (words in the same order)
+
+    $ python -m benchmarks.pdf_engines -n 10 -o results.json
+    $ python -m benchmarks.pdf_engines -n 10 --pdf ~/menus --compare results.json
+"""
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import List, Mapping, Any, Tuple
+
+import click
+
+from pylunch import log_config, pdf
+
+from . import common
+
+log = logging.getLogger(__name__)
+
+
+def corpus(paths=()) -> List[Tuple[str, bytes]]:
+    files = [pdf.SAMPLE]
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob('**/*.pdf')) if path.is_dir() else [path])
+    return [(file.name, file.read_bytes()) for file in files]
+
+
+def bench_engines(documents: List[Tuple[str, bytes]], engines: List[str], repeat: int) -> Mapping[str, Any]:
+    result = dict(documents={}, engines={})
+    totals = {name: dict(pages=0, duration=0.0, similarity=[]) for name in engines}
+    for (name, data) in documents:
+        reference = pdf.get_engine(pdf.REFERENCE_ENGINE).extract(data)
+        result['documents'][name] = dict(size=len(data))
+        for engine_name in engines:
+            engine = pdf.get_engine(engine_name, fallback=False)
+            samples = []
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    pages = engine.extract_pages(data)
+                    samples.append(time.perf_counter() - start)
+            except Exception as ex:
+                log.warning(f"[BENCH] Engine {engine_name} failed on {name}: {ex}")
+                continue
+            text = "".join(page + pdf.PAGE_BREAK for page in pages)
+            ratio = pdf.similarity(text, reference)
+            result['documents'][name][engine_name] = dict(extract=common.stats(samples), pages=len(pages),
+                                                          similarity=ratio)
+            totals[engine_name]['pages'] += len(pages) * len(samples)
+            totals[engine_name]['duration'] += sum(samples)
+            totals[engine_name]['similarity'].append(ratio)
+    for (engine_name, total) in totals.items():
+        ratios = total['similarity']
+        result['engines'][engine_name] = dict(
+            pages_per_second=total['pages'] / total['duration'] if total['duration'] else None,
+            similarity=min(ratios) if ratios else None,
+        )
+    return result
+
+
+@click.command(help='Benchmark of the PDF text extraction engines')
+@click.option('-n', '--repeat', help='Number of extractions per document', default=10)
+@click.option('-p', '--pdf', 'paths', help='Additional PDF document or directory of them', multiple=True)
+@click.option('-e', '--engine', help='Engines to compare', multiple=True, type=click.Choice(list(pdf.ENGINES.keys())))
+@click.option('-o', '--output', help='Save the results as JSON', default=None)
+@click.option('-c', '--compare', help='Compare with the results saved in the JSON file', default=None)
+@click.option('--threshold', help='Relative regression threshold for the comparison', default=0.1)
+@click.option('-L', '--log-level', help='Set log level (d|i|w|e)', default='e')
+def main(repeat: int, paths=(), engine=(), output=None, compare=None, threshold=0.1, log_level='e'):
+    log_config.load(log_level)
+    engines = [name for name in (engine or pdf.ENGINES.keys()) if pdf.get_engine(name, fallback=False) is not None]
+    documents = corpus(paths)
+    results = dict(meta=dict(**common.metadata(), repeat=repeat, engines=engines), scenarios={})
+    results['scenarios'] = bench_engines(documents, engines, repeat=repeat)
+    results['meta']['selected'] = pdf.select_engine(documents[0][1])
+    _print_results(results, engines)
+    common.save_results(output, results)
+    if compare:
+        regressions = common.compare_results(compare, results, threshold=threshold,
+                                             higher_is_better=('pages_per_second', 'similarity'))
+        if regressions:
+            print(f"\nRegressions over {threshold * 100:.0f}%: {len(regressions)}")
+            sys.exit(1)
+
+
+def _print_results(results: Mapping[str, Any], engines: List[str]):
+    header = " ".join(f"{name + ' ms':>14} {'sim':>5}" for name in engines)
+    print(f"{'DOCUMENT':<32} {'SIZE':>8} {header}")
+    for (name, result) in results['scenarios']['documents'].items():
+        row = " ".join(f"{result[engine]['extract']['p50'] * 1000:>14.2f} {result[engine]['similarity']:>5.2f}"
+                       if engine in result else f"{'-':>14} {'-':>5}" for engine in engines)
+        print(f"{name:<32} {result['size']:>8} {row}")
+    print()
+    for (name, result) in results['scenarios']['engines'].items():
+        pages = result['pages_per_second']
+        print(f"{name:<12} {pages or 0:>10.1f} pages/s  min similarity {result['similarity'] or 0:.2f}")
+    print(f"\nAutomatically selected engine: {results['meta']['selected']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Resolve pipeline benchmark
+
+Replays the recorded upstream responses (HTML pages, PDF, menu image, Zomato payload)
+through the local fixture server and measures:
+
+ - cold   - end-to-end ``LunchService.resolve_text`` latency with empty cache
+ - raw    - resolve with the resolver (raw content) cache tier hit - parse, text conversion and filters
+ - warm   - resolve with the text cache tier hit
+ - concurrent - throughput of the concurrent resolves with empty cache
+ - stages - wall time of the resolve stages (fetch, parse, select, html2text, filters, ...)
+
+    $ python -m benchmarks.resolve -n 10 -o results.json
+    $ python -m benchmarks.resolve -n 10 --compare results.json
+"""
+import concurrent.futures
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Mapping, Any
+
+import click
+
+from pylunch import lunch, log_config
+
+from . import common
+from .server import FixtureServer
+
+log = logging.getLogger(__name__)
+
+
+def _clear_text_tier(service: lunch.LunchService):
+    day_dir = service.cache.cache_base / service.cache.for_day()
+    for entity in service.instances.values():
+        text_file = day_dir / f"{entity.name}.txt"
+        if text_file.exists():
+            text_file.unlink()
+
+
+def _timed(service: lunch.LunchService, entity: lunch.LunchEntity) -> float:
+    start = time.perf_counter()
+    content = service.resolve_text(entity)
+    duration = time.perf_counter() - start
+    if not content:
+        log.warning(f"[BENCH] No content for {entity.name}")
+    return duration
+
+
+def bench_latency(service: lunch.LunchService, repeat: int, mode: str) -> Mapping[str, Any]:
+    """Measures the resolve latency per entity, modes:
+    cold - cache is cleared before each resolve, raw - only text tier is cleared, warm - nothing is cleared
+    """
+    entities = list(service.instances.values())
+    samples = {entity.name: [] for entity in entities}
+    cpu_start = time.process_time()
+    for _ in range(repeat):
+        for entity in entities:
+            if mode == 'cold':
+                service.cache.clear()
+            elif mode == 'raw':
+                _clear_text_tier(service)
+            samples[entity.name].append(_timed(service, entity))
+    cpu = time.process_time() - cpu_start
+    return dict(
+        cpu_seconds=cpu,
+        entities={name: common.stats(values) for (name, values) in samples.items()},
+        total=common.stats([value for values in samples.values() for value in values]),
+    )
+
+
+def bench_concurrent(service: lunch.LunchService, repeat: int, workers: int) -> Mapping[str, Any]:
+    entities = list(service.instances.values())
+    latencies: List[float] = []
+    wall = 0.0
+    for _ in range(repeat):
+        service.cache.clear()
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            latencies.extend(executor.map(lambda ent: _timed(service, ent), entities))
+        wall += time.perf_counter() - start
+    resolves = len(entities) * repeat
+    return dict(workers=workers, resolves=resolves, wall_seconds=wall,
+                throughput=resolves / wall if wall else None, latency=common.stats(latencies))
+
+
+def bench_stages(service: lunch.LunchService, repeat: int) -> Mapping[str, Any]:
+    service.metrics.reset()
+    bench_latency(service, repeat=repeat, mode='cold')
+    result = {}
+    for row in service.metrics.summary():
+        stage = result.setdefault(row['stage'], dict(count=0, total=0.0))
+        stage['count'] += row['count']
+        stage['total'] += row['total']
+    for stage in result.values():
+        stage['mean'] = stage['total'] / stage['count'] if stage['count'] else None
+    return result
+
+
+@click.command(help='Benchmark of the resolve pipeline using the recorded fixtures')
+@click.option('-n', '--repeat', help='Number of iterations per scenario', default=5)
+@click.option('-w', '--workers', help='Number of workers for the concurrent scenario', default=8)
+@click.option('--latency', help='Artificial latency of the fixture server (ms)', default=0.0)
+@click.option('-s', '--scenario', help='Run only selected scenarios', multiple=True,
+              type=click.Choice(['cold', 'raw', 'warm', 'concurrent', 'stages']))
+@click.option('-o', '--output', help='Save the results as JSON', default=None)
+@click.option('-c', '--compare', help='Compare with the results saved in the JSON file', default=None)
+@click.option('--threshold', help='Relative regression threshold for the comparison', default=0.1)
+@click.option('-L', '--log-level', help='Set log level (d|i|w|e)', default='e')
+def main(repeat: int, workers: int, latency: float, scenario=(), output=None, compare=None, threshold=0.1,
+         log_level='e'):
+    log_config.load(log_level)
+    scenarios = scenario or ('cold', 'raw', 'warm', 'concurrent', 'stages')
+    results = dict(meta=dict(**common.metadata(), repeat=repeat, latency_ms=latency), scenarios={})
+
+    with FixtureServer(latency=latency / 1000) as server, tempfile.TemporaryDirectory(prefix='pylunch-') as tmp:
+        service = common.make_service(server.base, cache_dir=Path(tmp) / 'cache', skip=common.default_skip())
+        for name in scenarios:
+            print(f"Running scenario: {name}")
+            if name == 'concurrent':
+                result = bench_concurrent(service, repeat=repeat, workers=workers)
+            elif name == 'stages':
+                result = bench_stages(service, repeat=repeat)
+            else:
+                if name == 'warm':
+                    bench_latency(service, repeat=1, mode='cold')
+                result = bench_latency(service, repeat=repeat, mode=name)
+            results['scenarios'][name] = result
+        results['meta']['upstream_hits'] = dict(server.hits)
+
+    _print_results(results)
+    common.save_results(output, results)
+    if compare:
+        regressions = common.compare_results(compare, results, threshold=threshold)
+        if regressions:
+            print(f"\nRegressions over {threshold * 100:.0f}%: {len(regressions)}")
+            sys.exit(1)
+
+
+def _ms(value) -> str:
+    return f"{value * 1000:9.2f}" if value is not None else f"{'-':>9}"
+
+
+def _print_results(results: Mapping[str, Any]):
+    for (name, result) in results['scenarios'].items():
+        print(f"\n== {name}")
+        if 'entities' in result:
+            print(f"{'ENTITY':<28} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+            for (entity, values) in result['entities'].items():
+                print(f"{entity:<28} {_ms(values.get('p50'))} {_ms(values.get('p95'))} {_ms(values.get('p99'))}")
+            print(f"CPU time: {result['cpu_seconds']:.3f}s")
+        elif name == 'concurrent':
+            lat = result['latency']
+            print(f"Workers: {result['workers']}, resolves: {result['resolves']}, "
+                  f"throughput: {result['throughput']:.1f}/s, p50 {_ms(lat.get('p50'))} ms, p95 {_ms(lat.get('p95'))} ms")
+        else:
+            print(f"{'STAGE':<28} {'COUNT':>6} {'TOTAL ms':>10} {'MEAN ms':>9}")
+            for (stage, values) in sorted(result.items(), key=lambda x: x[1]['total'], reverse=True):
+                print(f"{stage:<28} {values['count']:>6} {values['total'] * 1000:>10.2f} {_ms(values['mean'])}")
+
+
+if __name__ == '__main__':
+    main()
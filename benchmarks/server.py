@@ -0,0 +1,95 @@
+"""Stand-in upstream HTTP server replaying the recorded fixtures
+"""
+import logging
+import mimetypes
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from pylunch import pdf
+
+log = logging.getLogger(__name__)
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+ROUTES = {
+    # Zomato API (Pyzomato uses "<host>/dailymenu?res_id=<id>")
+    '/zomato/dailymenu': 'zomato.json',
+}
+# The fixtures shipped with the package
+FILES = {
+    '/menu.pdf': pdf.SAMPLE,
+}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'FixtureServer'
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        self.server.hit(path)
+        name = ROUTES.get(path, path.lstrip('/'))
+        file = FILES.get(path) or (self.server.root / name).resolve()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if (path not in FILES and self.server.root not in file.parents) or not file.is_file():
+            self._send(404, b'Not found', 'text/plain')
+            return
+        ctype = mimetypes.guess_type(str(file))[0] or 'application/octet-stream'
+        if ctype.startswith('text/') or ctype == 'application/json':
+            ctype += '; charset=utf-8'
+        self._send(200, file.read_bytes(), ctype)
+
+    def _send(self, code: int, body: bytes, ctype: str):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug("[FIXTURE] " + fmt, *args)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """Serves the fixtures on the localhost, optionally with an artificial latency
+    to simulate slow upstreams. Use it as a context manager:
+
+        with FixtureServer(latency=0.05) as server:
+            requests.get(server.base + '/restaurant.html')
+    """
+    daemon_threads = True
+
+    def __init__(self, root: Path = FIXTURES, latency: float = 0.0, port: int = 0):
+        super().__init__(('127.0.0.1', port), FixtureHandler)
+        self.root = Path(root).resolve()
+        self.latency = latency
+        self.hits = {}
+        self._hits_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def hit(self, path: str):
+        with self._hits_lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+
+    def start(self) -> 'FixtureServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='fixture-server', daemon=True)
+        self._thread.start()
+        log.info(f"[FIXTURE] Serving {self.root} at {self.base}")
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'FixtureServer':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
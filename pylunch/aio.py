@@ -0,0 +1,71 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+from typing import Dict, Optional, Tuple
+
+from pylunch import lunch
+from pylunch.deadline import Deadline
+
+log = logging.getLogger(__name__)
+
+
+class AsyncResolver:
+    """Resolver engine for the event loop
+
+    The synchronous resolution runs in the bounded pool of threads, so the event loop can hold many
+    in-flight requests while only the pool size of them are fetched at once. The cached content is read
+    in the default executor, the event loop never waits for the disk.
+
+    Concurrent requests for the same entity share one resolution - the request with a longer deadline
+    than the in-flight resolution starts a new one (joined by the next requests), the request waiting
+    longer than its deadline gets the deadline fallback.
+    """
+
+    def __init__(self, max_workers: int = 32):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix='pylunch-resolve')
+        self._inflight: Dict[Tuple[int, str], Tuple[asyncio.Future, Deadline]] = {}
+
+    @property
+    def executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        return self._executor
+
+    async def resolve_text(self, service: lunch.LunchService, entity: lunch.LunchEntity,
+                           deadline: Deadline = None, **kwargs) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        if not kwargs and not entity.disabled and service.cache.enabled:
+            cached = await loop.run_in_executor(None, functools.partial(service.cache.get_entity, entity, ext='txt'))
+            if cached:
+                return cached
+
+        if kwargs:
+            return await loop.run_in_executor(self._executor, functools.partial(
+                service.resolve_text, entity, deadline=deadline, **kwargs))
+
+        deadline = deadline if deadline is not None else Deadline()
+        key = (id(service), entity.name)
+        (future, inflight_deadline) = self._inflight.get(key, (None, None))
+        if future is None or not inflight_deadline.outlasts(deadline):
+            log.debug(f"[ASYNC] Resolving {entity.name} ({deadline})")
+            future = loop.run_in_executor(self._executor, functools.partial(
+                service.resolve_text, entity, deadline=deadline))
+            self._inflight[key] = (future, deadline)
+            future.add_done_callback(functools.partial(self._done, key))
+        else:
+            log.debug(f"[ASYNC] Joining the in-flight resolution of {entity.name}")
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=deadline.remaining())
+        except asyncio.TimeoutError:
+            # The joined resolution has a longer deadline - the deadline fallback (the deadline is expired)
+            log.warning(f"[ASYNC] Deadline of {entity.name} exceeded waiting for the in-flight resolution")
+            return await loop.run_in_executor(None, functools.partial(
+                service.resolve_text, entity, deadline=deadline))
+
+    def _done(self, key: Tuple[int, str], future: asyncio.Future):
+        # The resolution started later (with a longer deadline) stays in-flight
+        if self._inflight.get(key, (None, None))[0] is future:
+            del self._inflight[key]
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait)
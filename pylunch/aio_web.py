@@ -0,0 +1,161 @@
+"""Async serving mode of the web application
+
+The menu API routes are served natively by aiohttp and await the resolution through
+the non-blocking resolver engine, all other routes (pages, templates, admin) are passed
+to the Flask application running in the thread pool.
+
+    $ gunicorn pylunch.aio_web:app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:8000
+"""
+import asyncio
+import concurrent.futures
+import functools
+import io
+import logging
+import sys
+from typing import Tuple, List, Optional
+
+import click
+from aiohttp import web as aioweb
+
+from pylunch import errors, lunch, web
+from pylunch.aio import AsyncResolver
+
+log = logging.getLogger(__name__)
+
+WSGI_WORKERS = 8
+
+
+class WsgiBridge:
+    """Runs the WSGI application in the thread pool
+    """
+
+    def __init__(self, wsgi_app, max_workers: int = WSGI_WORKERS):
+        self.wsgi_app = wsgi_app
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix='pylunch-wsgi')
+
+    async def __call__(self, request: aioweb.Request) -> aioweb.Response:
+        body = await request.read()
+        environ = self._environ(request, body)
+        loop = asyncio.get_running_loop()
+        (status, headers, content) = await loop.run_in_executor(self._executor, self._call, environ)
+        (code, _, reason) = status.partition(' ')
+        response = aioweb.Response(status=int(code), reason=reason or None, body=content)
+        for (name, value) in headers:
+            if name.lower() != 'content-length':
+                response.headers.add(name, value)
+        return response
+
+    def _call(self, environ: dict) -> Tuple[str, List[Tuple[str, str]], bytes]:
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = headers
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return started['status'], started['headers'], content
+
+    @staticmethod
+    def _environ(request: aioweb.Request, body: bytes) -> dict:
+        (host, _, port) = request.host.partition(':')
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': request.path,
+            'QUERY_STRING': request.query_string,
+            'SERVER_NAME': host,
+            'SERVER_PORT': port or ('443' if request.secure else '80'),
+            'SERVER_PROTOCOL': f"HTTP/{request.version.major}.{request.version.minor}",
+            'REMOTE_ADDR': request.remote or '',
+            'CONTENT_TYPE': request.headers.get('Content-Type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': request.scheme,
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for (name, value) in request.headers.items():
+            key = name.upper().replace('-', '_')
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                continue
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait)
+
+
+def _find_restaurant(name: str) -> Tuple[web.WebApplication, Optional[lunch.LunchEntity]]:
+    # Blocking - the registry reload, the fuzzy search and the popularity save (under the file lock)
+    web_app = web.WebApplication.get()
+    instance = web_app.service.instances.find_one(name)
+    if instance is not None:
+        web_app.service.popularity.hit(instance.name)
+    return web_app, instance
+
+
+async def route_api_restaurants_get_menu(request: aioweb.Request) -> aioweb.Response:
+    name = request.match_info['name']
+    resolver: AsyncResolver = request.app['resolver']
+    (web_app, instance) = await asyncio.get_running_loop().run_in_executor(None, _find_restaurant, name)
+    if instance is None:
+        return aioweb.json_response(errors.PyLunchApiError(f"Restaurant not found: {name}", code=404).to_json(),
+                                    status=404)
+    try:
+        day = web.request_weekday(request.query)
+    except errors.PyLunchApiError as ex:
+        return aioweb.json_response(ex.to_json(), status=ex.code)
+    deadline = web_app.request_deadline()
+    if day is not None:
+        content = await asyncio.get_running_loop().run_in_executor(
+            resolver.executor, functools.partial(web_app.service.resolve_day, instance, day, deadline=deadline))
+    else:
+        content = await resolver.resolve_text(web_app.service, instance, deadline=deadline)
+    if content:
+        return aioweb.json_response(web.menu_json(instance, content))
+    return aioweb.json_response(errors.UnableToLoadContent(name, url=instance.url).to_json(), status=400)
+
+
+async def _on_startup(app: aioweb.Application):
+    web_app = web.WebApplication.get()
+    app['resolver'] = AsyncResolver(max_workers=web_app.config.async_workers)
+
+
+async def _on_cleanup(app: aioweb.Application):
+    app['resolver'].shutdown()
+    app['wsgi'].shutdown()
+
+
+def create_app(wsgi_app=None) -> aioweb.Application:
+    bridge = WsgiBridge(wsgi_app or web.app)
+    app = aioweb.Application()
+    app['wsgi'] = bridge
+    app.router.add_get('/api/restaurants/{name}/menu', route_api_restaurants_get_menu)
+    app.router.add_route('*', '/{path:.*}', bridge)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+app = create_app()
+
+
+@click.command(help='Run the web application in the async serving mode')
+@click.option('-h', '--host', help='Host to bind', default='127.0.0.1')
+@click.option('-p', '--port', help='Port to bind', default=8000)
+def main(host: str, port: int):
+    aioweb.run_app(app, host=host, port=port)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,16 @@
 import datetime
+import json
 import logging
 import yaml
 import sys
+import tempfile
 from pathlib import Path
 from typing import List, Tuple, Mapping
-from shutil import copyfile
 
 import click
 
-from pylunch import log_config, lunch, __version__, config, utils
+from pylunch import log_config, lunch, __version__, config, utils, errors
+from pylunch.journal import RegistryJournal
 
 log = logging.getLogger(__name__)
 
@@ -27,6 +29,7 @@ class CliApplication:
         self.config_loader = config.YamlLoader(config_dir, 'config.yaml')
         self.restaurants_loader = config.YamlLoader(
             config_dir, 'restaurants.yaml')
+        self.restaurants_journal = RegistryJournal(self.restaurants_loader)
 
     def init(self, no_zomato=False, **kwargs) -> 'CliApplication':
         if not self.config_loader.base_dir.exists():
@@ -35,7 +38,7 @@ class CliApplication:
         if no_zomato and 'zomato_key' in cfg_dict:
             del cfg_dict['zomato_key']
         cfg = config.AppConfig(**cfg_dict)
-        loaded = self.restaurants_loader.load() or dict(restaurants={})
+        loaded = self.restaurants_journal.load(snapshot_dir=cfg.snapshot_dir) or dict(restaurants={})
         unwrapped = loaded.get('restaurants') or loaded
         upsdated_str = loaded.get('updated')
         updated = datetime.datetime.fromisoformat(
@@ -53,8 +56,9 @@ class CliApplication:
         self.restaurants_loader.save(data={})
 
     def save_restaurants(self):
-        log.info("Saving restaurants")
-        self.restaurants_loader.save(self.service.instances.to_dict())
+        changes = self.service.instances.pop_changes()
+        log.info(f"Saving restaurants changes: {len(changes)}")
+        self.restaurants_journal.append(changes)
 
     def select_instances(self, selectors, fuzzy=False, tags=False, with_disabled=True) -> List[lunch.LunchEntity]:
         return self.service.instances.select(selectors, fuzzy=fuzzy, tags=tags, with_disabled=with_disabled)
@@ -99,13 +103,23 @@ def cli_version(app: CliApplication):
 @click.option("--cut-after", help="Remove content after the substring", default=None)
 @click.option("--no-filters", help="Do not apply filters", default=False, is_flag=True)
 @click.option("-F", "--full", help="Show full output - do not apply day filter", default=False, is_flag=True)
+@click.option("-D", "--day", help="Show the menu for the day of the week (0-6 or name, e.g. 'fri')", default=None)
 @click.option("-Q", "--with-fails", help="Show also fails at the end", default=False, is_flag=True)
+@click.option("--timings", help="Show timings of the resolve stages at the end", default=False, is_flag=True)
 @pass_app
-def cli_menu(app: CliApplication, selectors: Tuple[str], tags=False, update_cache=False, **kwargs):
+def cli_menu(app: CliApplication, selectors: Tuple[str], tags=False, update_cache=False, timings=False, day=None,
+             **kwargs):
+    try:
+        kwargs['day'] = utils.parse_weekday(day)
+    except ValueError as ex:
+        raise click.BadParameter(str(ex), param_hint='--day')
     instances = app.select_instances(selectors, tags=tags, with_disabled=False)
     if update_cache:
         cleared = app.service.cache.clear(instances)
     print_instances(app.service, instances, **kwargs)
+    if timings:
+        print("\n~~~~~~~~~~~~~~~~  TIMINGS  ~~~~~~~~~~~~~~~\n")
+        print(app.service.metrics.to_text())
 
 
 @main_cli.command(name='roll', help='Get random menu for a restaurant')
@@ -153,17 +167,15 @@ def cli_import(app: CliApplication, restaurants=None, override=False):
 @click.option("-f", "--file", help="Export to file", default=None)
 @pass_app
 def cli_export(app: CliApplication, file=None):
+    if not app.restaurants_loader.full_path.exists() and not app.restaurants_journal.path.exists():
+        print(f"Error: Restaurants file not exists: {app.restaurants_loader.full_path}")
+        return
+    # The restaurants file with the journal replayed
+    content = app.restaurants_journal.dump()
     if file is None:
-        if app.restaurants_loader.full_path.exists():
-            content = app.restaurants_loader.full_path.read_text('utf-8')
-            print(content)
-        else:
-            print(
-                f"Error: Restaurants file not exists: {app.restaurants_loader.full_path}")
-
+        print(content)
     else:
-        # not a hack :-)
-        copyfile(src=str(app.restaurants_loader.full_path), dst=file)
+        Path(file).write_text(content, encoding='utf-8')
 
 
 @main_cli.command(name='add', help='Adds a new restaurant')
@@ -172,7 +184,7 @@ def cli_export(app: CliApplication, file=None):
 @click.option("-u", "--url", help="Restaurant url")
 @click.option("-s", "--selector", help="Restaurant css selector", default=None)
 @click.option("-t", "--tags", help="Restaurant tags", default=None, multiple=True)
-@click.option("-p", "--param", help="Additional param", default=None, multiple=True)
+@click.option("-p", "--param", "params", help="Additional param", default=None, multiple=True)
 @click.option("-O", "--override", help="Overide the restaurant if exists", default=False, is_flag=True)
 @pass_app
 def cli_add(app: CliApplication, name, display_name, url, selector, tags, params, override=False):
@@ -180,8 +192,8 @@ def cli_add(app: CliApplication, name, display_name, url, selector, tags, params
     config = dict(name=name, url=url, display_name=display_name,
                   tags=tags, selector=selector)
     if params:
-        config.update(**_params_dict(params), override=override)
-    app.service.instances.register(**config)
+        config.update(**_params_dict(params))
+    app.service.instances.register(**config, override=override)
     app.save_restaurants()
 
 
@@ -208,7 +220,7 @@ def cli_enable(app: CliApplication, selectors: Tuple[str], fuzzy=False, tags=Fal
     for instance in instances:
         if 'disabled' in instance.keys():
             print(f"Enabling instance {instance.name}: {instance}")
-            del app.service.instances[instance.name]['disabled']
+            app.service.instances.unset(instance.name, 'disabled')
     app.save_restaurants()
 
 
@@ -221,19 +233,25 @@ def cli_disable(app: CliApplication, selectors: Tuple[str], fuzzy=False, tags=Fa
     instances = app.select_instances(selectors, fuzzy=fuzzy, tags=tags)
     for instance in instances:
         print(f"Disabling instance {instance.name}: {instance}")
-        app.service.instances[instance.name]['disabled'] = True
+        app.service.instances.update(instance.name, disabled=True)
     app.save_restaurants()
 
 
 @main_cli.command(name='edit', help='Edits restaurants DB file')
 @pass_app
 def cli_edit_restaurants(app: CliApplication):
-    cfg = app.restaurants_loader.load()
+    (cfg, position) = app.restaurants_journal.checkout()
     content = yaml_edit(cfg)
     if content is None:
         print("No change - not saving")
-    else:
-        app.restaurants_loader.save(content)
+        return
+    try:
+        # The changes of the other processes made during the edit are kept
+        app.restaurants_journal.save(content, since=position)
+    except errors.RegistryChanged as ex:
+        with tempfile.NamedTemporaryFile('w', prefix='restaurants-', suffix='.yaml', delete=False) as fp:
+            yaml.safe_dump(content, fp)
+        print(f"Error: {ex.message} - not saving, the edited file is kept: {fp.name}")
 
 
 @main_cli.command(name='config', help='Shows the current configuration')
@@ -324,6 +342,100 @@ def cli_sources_add(app: CliApplication, url: bool = False, name: str = None, pa
     pass
 
 
+@main_cli.command(name='prefetch', help='Resolve the menus to the cache, the most popular restaurants first')
+@click.argument('selectors', nargs=-1)
+@click.option("-t", "--tags", help="Search by tags", default=False, is_flag=True)
+@click.option("-w", "--workers", help="Number of the concurrent resolves", default=4)
+@click.option("--week", help="Resolve the menus of the whole week", default=False, is_flag=True)
+@pass_app
+def cli_prefetch(app: CliApplication, selectors: Tuple[str], tags=False, workers=4, week=False):
+    import concurrent.futures
+    from pylunch.throttle import interleave_hosts
+    instances = app.service.rank(app.select_instances(selectors, tags=tags, with_disabled=False))
+    # The workers are spread over the hosts, the throttled host does not occupy all of them
+    instances = interleave_hosts(instances, url=lambda instance: instance.url)
+    resolve = app.service.resolve_week if week else app.service.resolve_text
+    # The executor takes the resolves in the submitted order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(instance, executor.submit(resolve, instance)) for instance in instances]
+        for (instance, future) in futures:
+            print(f"{instance.name}: {'ok' if future.result() else 'no content'}")
+
+
+@main_cli.command(name='build-static', help='Build the static site of the menus served by nginx')
+@click.option("-o", "--output", help="Site directory (default: the static_site config value)", default=None)
+@click.option("-w", "--workers", help="Number of the concurrent resolves", default=4)
+@click.option("--full", help="Build the whole site, not only the changed restaurants", default=False, is_flag=True)
+@click.option("--access-log", help="nginx access log of the site - the requests are counted to the popularity",
+              default=None)
+@pass_app
+def cli_build_static(app: CliApplication, output=None, workers=4, full=False, access_log=None):
+    from pylunch.static_site import StaticSite
+    site = StaticSite(app.service, root=output or app.service.config.static_site, workers=workers)
+    if access_log:
+        site.count_hits(access_log)
+    report = site.build(force=full)
+    if app.service.config.format == 'json':
+        print(json.dumps(report.to_dict(), indent=2))
+        return
+    print(f"Site: {site.root}")
+    print(f"Written files: {len(report.written)}, removed files: {len(report.removed)}")
+    print(f"Unchanged restaurants: {len(report.unchanged)}")
+    if report.failed:
+        print(f"Left to the server (no menu for today): {', '.join(report.failed)}")
+
+
+@main_cli.command(name='ranking', help='Show the restaurants ranked by the popularity')
+@click.option('-n', '--top', help='Number of the restaurants', default=None, type=int)
+@pass_app
+def cli_ranking(app: CliApplication, top=None):
+    ranking = app.service.popularity.ranking()[:top]
+    if app.service.config.format == 'json':
+        print(json.dumps([dict(name=name, score=score) for (name, score) in ranking], indent=2))
+        return
+    print(f"{'RESTAURANT':<32} {'SCORE':>10}")
+    for (name, score) in ranking:
+        print(f"{name:<32} {score:>10.2f}")
+
+
+@main_cli.group(name='visitors', help='Visitors analytics')
+def cli_visitors():
+    pass
+
+
+@cli_visitors.command(name='ingest', help='Ingest the new visitor records to the analytics database')
+@pass_app
+def cli_visitors_ingest(app: CliApplication):
+    from pylunch.visitor_stats import VisitorStats
+    stats = VisitorStats(app.service.config.visitors / 'visitors')
+    print(f"Ingested records: {stats.ingest()}")
+
+
+@cli_visitors.command(name='stats', help='Show the visitors statistics')
+@click.option('-d', '--days', help='Number of the last days (default: 30)', default=30)
+@click.option('--since', help='First day (YYYY-MM-DD), overrides the days', default=None)
+@click.option('--until', help='Last day (YYYY-MM-DD)', default=None)
+@click.option('-H', '--hours', help='Hours range, for example: 11-13', default=None)
+@click.option('-n', '--top', help='Number of the top restaurants, tags and peaks', default=20)
+@click.option('--no-ingest', help='Do not ingest the new records before', is_flag=True, default=False)
+@pass_app
+def cli_visitors_stats(app: CliApplication, days=30, since=None, until=None, hours=None, top=20, no_ingest=False):
+    from pylunch.visitor_stats import VisitorStats, stats_to_text
+    stats = VisitorStats(app.service.config.visitors / 'visitors')
+    if not no_ingest:
+        stats.ingest()
+    if since is None:
+        since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+    hours_range = tuple(int(hour) for hour in hours.split('-', 1)) if hours else None
+    if hours_range is not None and len(hours_range) == 1:
+        hours_range = (hours_range[0], hours_range[0])
+    result = stats.stats(since=since, until=until, hours=hours_range, top=top)
+    if app.service.config.format == 'json':
+        print(json.dumps(result, indent=2))
+    else:
+        print(stats_to_text(result))
+
+
 """
 " Helper tools
 """
@@ -341,6 +453,7 @@ def _params_dict(params: List[str]) -> Mapping:
     for param in params:
         (key, val) = param.split('=')
         result[key] = val
+    return result
 
 
 def print_instances(service: lunch.LunchService, instances, transform=None, with_fails=False, **kwargs):
@@ -354,9 +467,13 @@ def print_instances(service: lunch.LunchService, instances, transform=None, with
             print(fail)
 
 
-def resolve_menu(service: lunch.LunchService, instance: lunch.LunchEntity, fails: list = None, **kwargs):
+def resolve_menu(service: lunch.LunchService, instance: lunch.LunchEntity, fails: list = None, day: int = None,
+                 **kwargs):
     result = _generate_menu_header(instance)
-    content = service.resolve_text(instance, **kwargs)
+    if day is not None:
+        content = service.resolve_day(instance, day)
+    else:
+        content = service.resolve_text(instance, **kwargs)
     if not content:
         if fails is not None:
             fails.append(instance)
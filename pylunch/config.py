@@ -1,16 +1,19 @@
 import collections
-from typing import MutableMapping, Union, Any
+from typing import MutableMapping, Mapping, Union, Any, Optional, List
 from pathlib import Path
 import tempfile
 import logging
 import yaml
 import os
 import functools
+import hashlib
+import pickle
 
 from pylunch import utils
 
 log = logging.getLogger(__name__)
 CACHE_DIR = Path(tempfile.gettempdir()) / 'pylunch'
+SNAPSHOT_VERSION = 1
 
 
 def load_yaml(file: Union[Path, str]) -> MutableMapping[str, Any]:
@@ -20,7 +23,7 @@ def load_yaml(file: Union[Path, str]) -> MutableMapping[str, Any]:
         log.warning(f"[LOAD] Config file not exists: {file}")
         return {}
     with file.open("r") as fp:
-        return yaml.safe_load(fp)
+        return yaml.load(fp, Loader=utils.YamlSafeLoader)
 
 
 def save_yaml(file: Union[Path, str], content: MutableMapping):
@@ -29,8 +32,66 @@ def save_yaml(file: Union[Path, str], content: MutableMapping):
     if not file.parent.exists():
         log.warning(f"[SAFE] Unnable to safe config file (directory not exists): {file}")
         return
-    with file.open("w") as fp:
-        yaml.safe_dump(content, fp)
+    # Replaced atomically - the readers never see a partially written file
+    tmp = file.with_name(f".{file.name}.{os.getpid()}.tmp")
+    with tmp.open("w") as fp:
+        yaml.dump(content, fp, Dumper=utils.YamlSafeDumper)
+    os.replace(str(tmp), str(file))
+
+
+def snapshot_path(cache_dir: Union[Path, str], file: Union[Path, str]) -> Path:
+    file = Path(file).resolve()
+    digest = hashlib.sha1(str(file).encode('utf-8')).hexdigest()[:16]
+    return Path(cache_dir) / 'snapshots' / f"{file.stem}-{digest}.pickle"
+
+
+def load_yaml_snapshot(file: Union[Path, str], cache_dir: Union[Path, str]) -> MutableMapping[str, Any]:
+    """Loads the yaml file using the binary snapshot stored in the cache dir.
+    The snapshot is keyed by the file mtime and size, when it is stale the yaml is parsed again
+    and the snapshot is refreshed.
+    """
+    file = Path(file)
+    if not file.exists():
+        log.warning(f"[LOAD] Config file not exists: {file}")
+        return {}
+
+    stat = file.stat()
+    key = (SNAPSHOT_VERSION, stat.st_mtime_ns, stat.st_size)
+    snapshot = snapshot_path(cache_dir, file)
+    content = _read_snapshot(snapshot, key)
+    if content is not None:
+        log.debug(f"[LOAD] Using the snapshot for {file}: {snapshot}")
+        return content
+
+    content = load_yaml(file)
+    _write_snapshot(snapshot, key, content)
+    return content
+
+
+def _read_snapshot(snapshot: Path, key: tuple) -> Optional[MutableMapping[str, Any]]:
+    if not snapshot.exists():
+        return None
+    try:
+        with snapshot.open("rb") as fp:
+            (snap_key, content) = pickle.load(fp)
+    except Exception as ex:
+        log.warning(f"[LOAD] Unable to read the snapshot {snapshot}: {ex}")
+        return None
+    if snap_key != key:
+        log.debug(f"[LOAD] Snapshot is stale: {snapshot}")
+        return None
+    return content
+
+
+def _write_snapshot(snapshot: Path, key: tuple, content: MutableMapping[str, Any]):
+    try:
+        snapshot.parent.mkdir(parents=True, exist_ok=True)
+        tmp = snapshot.with_name(f"{snapshot.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as fp:
+            pickle.dump((key, content), fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str(tmp), str(snapshot))
+    except Exception as ex:
+        log.warning(f"[SAVE] Unable to write the snapshot {snapshot}: {ex}")
 
 
 class YamlLoader:
@@ -42,8 +103,10 @@ class YamlLoader:
     def full_path(self) -> Path:
         return self.real_path(self.file)
 
-    def load(self) -> MutableMapping:
+    def load(self, snapshot_dir: Union[str, Path] = None) -> MutableMapping:
         file = self.real_path(self.file)
+        if snapshot_dir is not None:
+            return load_yaml_snapshot(file, snapshot_dir)
         content = load_yaml(file)
         return content
 
@@ -94,10 +157,20 @@ class AppConfig(collections.abc.MutableMapping):
     def cache_dir(self) -> Path:
         return Path(self.config.get('cache_dir', os.getenv('PYLUNCH_CACHE_DIR', CACHE_DIR)))
 
+    @property
+    def snapshot_dir(self) -> Optional[Path]:
+        if not self.use_cache or self.config.get('no_snapshot', False):
+            return None
+        return self.cache_dir
+
     @property
     def visitors(self) -> Path:
         return Path(self.config.get('visitors', os.getenv('PYLUNCH_VISITORS', self.cache_dir)))
 
+    @property
+    def static_site(self) -> Path:
+        return Path(self.config.get('static_site', os.getenv('PYLUNCH_STATIC_SITE', self.cache_dir / 'site')))
+
     @property
     def format(self) -> str:
         return self.config.get('format', 'text')
@@ -106,6 +179,94 @@ class AppConfig(collections.abc.MutableMapping):
     def zomato_key(self) -> str:
         return self.config.get('zomato_key', None)
 
+    @property
+    def zomato_url(self) -> Optional[str]:
+        return self.config.get('zomato_url', None)
+
+    @property
+    def resolve_timeout(self) -> Optional[float]:
+        return parse_timeout(self.config.get('resolve_timeout', 30))
+
+    @property
+    def request_timeout(self) -> Optional[float]:
+        return parse_timeout(self.config.get('request_timeout', 10))
+
+    @property
+    def page_timeout(self) -> Optional[float]:
+        return parse_timeout(self.config.get('page_timeout', None))
+
+    @property
+    def stale_while_revalidate(self) -> bool:
+        return utils.to_bool(self.config.get('stale_while_revalidate', False))
+
+    @property
+    def stale_days(self) -> int:
+        return int(self.config.get('stale_days', 7))
+
+    @property
+    def popularity_half_life(self) -> float:
+        return float(self.config.get('popularity_half_life', 72))
+
+    @property
+    def text_engine(self) -> str:
+        return self.config.get('text_engine', 'lxml')
+
+    @property
+    def pdf_engine(self) -> str:
+        return self.config.get('pdf_engine', 'auto')
+
+    @property
+    def ocr_engine(self) -> str:
+        return self.config.get('ocr_engine', 'tesserocr')
+
+    @property
+    def ocr_workers(self) -> int:
+        return int(self.config.get('ocr_workers', 2))
+
+    @property
+    def ocr_tiles(self) -> bool:
+        return utils.to_bool(self.config.get('ocr_tiles', True))
+
+    @property
+    def ocr_band_height(self) -> int:
+        return int(self.config.get('ocr_band_height', 800))
+
+    @property
+    def fetch_cache(self) -> bool:
+        return utils.to_bool(self.config.get('fetch_cache', True))
+
+    @property
+    def hosts(self) -> Mapping[str, Mapping[str, Any]]:
+        return self.config.get('hosts') or {}
+
+    @property
+    def split_pages(self) -> bool:
+        return utils.to_bool(self.config.get('split_pages', True))
+
+    @property
+    def entity_log(self) -> bool:
+        return utils.to_bool(self.config.get('entity_log', True))
+
+    @property
+    def log_entities(self) -> Optional[List[str]]:
+        entities = self.config.get('log_entities')
+        if isinstance(entities, str):
+            entities = [name.strip() for name in entities.split(',') if name.strip()]
+        return entities or None
+
+    @property
+    def async_workers(self) -> int:
+        return int(self.config.get('async_workers', 32))
+
     @property
     def default_source(self) -> str:
         return self.get('default_source')
+
+
+def parse_timeout(value) -> Optional[float]:
+    """Parses the timeout value - empty, 'off' or non-positive value means no limit
+    """
+    if value is None or str(value).lower() in ('', 'none', 'off'):
+        return None
+    value = float(value)
+    return value if value > 0 else None
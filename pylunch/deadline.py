@@ -0,0 +1,63 @@
+import time
+from typing import Optional
+
+from pylunch.errors import DeadlineExceeded
+
+
+class Deadline:
+    """Time budget of the resolution - passed down to the resolvers, chain steps and filters,
+    budget None means no limit.
+    """
+    __slots__ = ('_expires',)
+
+    def __init__(self, budget: Optional[float] = None):
+        self._expires = None if budget is None else time.monotonic() + budget
+
+    @property
+    def unlimited(self) -> bool:
+        return self._expires is None
+
+    @property
+    def expired(self) -> bool:
+        return self._expires is not None and time.monotonic() >= self._expires
+
+    def remaining(self) -> Optional[float]:
+        if self._expires is None:
+            return None
+        return max(0.0, self._expires - time.monotonic())
+
+    def within(self, budget: Optional[float]) -> 'Deadline':
+        """Deadline expiring after the budget, but not later than this one
+        """
+        child = Deadline(budget)
+        if child._expires is None or (self._expires is not None and self._expires < child._expires):
+            child._expires = self._expires
+        return child
+
+    def outlasts(self, other: 'Deadline') -> bool:
+        """Whether the deadline expires not earlier than the other one
+        """
+        if self._expires is None:
+            return True
+        return other._expires is not None and self._expires >= other._expires
+
+    def cancel(self):
+        """Expires the deadline now - the resolution stops at the next check
+        """
+        self._expires = time.monotonic()
+
+    def timeout(self, cap: Optional[float] = None) -> Optional[float]:
+        """Timeout for a blocking call - the remaining time limited by the cap
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        return remaining if cap is None else min(remaining, cap)
+
+    def check(self, stage: str = None, partial=None):
+        if self.expired:
+            raise DeadlineExceeded(stage, partial=partial)
+
+    def __repr__(self) -> str:
+        remaining = self.remaining()
+        return f"Deadline({'unlimited' if remaining is None else f'{remaining:.3f}s'})"
@@ -20,4 +20,16 @@ class UnableToLoadContent(PyLunchApiError):
         self.name = name
 
     def to_json(self):
-        return dict(message=self.message, name=self.name, status=400)
\ No newline at end of file
+        return dict(message=self.message, name=self.name, status=400)
+
+
+class DeadlineExceeded(PyLunchError):
+    def __init__(self, stage: str = None, partial=None):
+        super().__init__("Deadline exceeded" + (f" in: {stage}" if stage else ''))
+        self.stage = stage
+        self.partial = partial
+
+
+class RegistryChanged(PyLunchError):
+    """The registry was changed by another process in the way the edit cannot be merged with
+    """
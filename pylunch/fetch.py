@@ -0,0 +1,166 @@
+"""URL-keyed fetch cache - one download of the upstream page feeds all the entities which need it
+
+The responses are keyed by the normalized URL and the request params, the successful ones are stored
+for the day beneath the entity cache (``cache_base/YYYY-MM-DD/_fetch``), concurrent fetches of the same
+page share one request. The parsed documents are memoized by the content hash, so the entities selecting
+different parts of one page share one parse.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import threading
+import urllib.parse
+from pathlib import Path
+from typing import Optional, Mapping, Any, Callable, Dict, Iterable, List
+
+log = logging.getLogger(__name__)
+
+FETCH_DIR = '_fetch'
+DOCUMENTS_SIZE = 16
+# Request params which do not change the response
+IGNORED_PARAMS = ('timeout',)
+IGNORED_HEADERS = ('user-agent',)
+
+
+class FetchedResponse:
+    """Response-like object of the fetched content
+    """
+    __slots__ = ('url', 'status_code', 'content')
+
+    def __init__(self, url: str, status_code: int, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    @classmethod
+    def from_response(cls, response) -> 'FetchedResponse':
+        return cls(url=response.url, status_code=response.status_code, content=response.content)
+
+
+def normalize_url(url: str) -> str:
+    """Lower-cased scheme and host, no default port and fragment, sorted query
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+def url_digest(url: str) -> str:
+    return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()[:16]
+
+
+def fetch_key(url: str, params: Mapping[str, Any] = None) -> str:
+    """Key of the request - the normalized URL and the request params which change the response
+    """
+    params = {key: value for (key, value) in (params or {}).items() if key not in IGNORED_PARAMS}
+    headers = params.pop('headers', None) or {}
+    params['headers'] = {key.lower(): value for (key, value) in headers.items()
+                         if key.lower() not in IGNORED_HEADERS}
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+    return f"{url_digest(url)}-{digest}"
+
+
+class FetchCache:
+    def __init__(self, root: Callable[..., Optional[Path]] = None):
+        # The directory of the day (today by default) - None if the cache is disabled
+        self._root = root if root is not None else (lambda day=None: None)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._documents: 'collections.OrderedDict[tuple, Any]' = collections.OrderedDict()
+
+    def root(self, day: str = None) -> Optional[Path]:
+        return self._root(day)
+
+    def _path(self, key: str) -> Optional[Path]:
+        root = self.root()
+        return root / FETCH_DIR / f"{key}.bin" if root is not None else None
+
+    def get(self, url: str, params: Mapping[str, Any], fetch: Callable[[], Any]) -> FetchedResponse:
+        """Returns the cached response of the request or fetches it (once for the concurrent callers)
+        """
+        key = fetch_key(url, params)
+        path = self._path(key)
+        if path is not None and path.exists():
+            log.debug(f"[FETCH] Cached {url} ({key})")
+            return FetchedResponse(url=url, status_code=200, content=path.read_bytes())
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+        if not leader:
+            log.debug(f"[FETCH] Joining the in-flight fetch of {url}")
+            try:
+                return future.result(timeout=params.get('timeout'))
+            except concurrent.futures.TimeoutError:
+                log.warning(f"[FETCH] Timeout waiting for the in-flight fetch of {url}, fetching")
+                return FetchedResponse.from_response(fetch())
+
+        try:
+            response = FetchedResponse.from_response(fetch())
+            if response.ok and path is not None:
+                self._store(path, response.content)
+            future.set_result(response)
+            return response
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    @staticmethod
+    def _store(path: Path, content: bytes):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(content)
+            os.replace(str(tmp), str(path))
+        except OSError as ex:
+            log.warning(f"[FETCH] Unable to store the response to {path}: {ex}")
+
+    def clear(self, urls: Iterable[str], day: str = None) -> List[str]:
+        """Removes the cached responses of the URLs (all the request params)
+        """
+        root = self.root(day)
+        if root is None:
+            return []
+        removed = []
+        for url in set(urls):
+            for path in (root / FETCH_DIR).glob(f"{url_digest(url)}-*.bin"):
+                path.unlink()
+                removed.append(str(path))
+        return removed
+
+    def document(self, content: bytes, parser: Callable[[bytes], Any], name: str = 'lxml'):
+        """Parsed document of the content - shared by the entities selecting from the same page
+        """
+        key = (name, hashlib.blake2b(content, digest_size=16).digest())
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+        document = parser(content)
+        with self._lock:
+            self._documents[key] = document
+            while len(self._documents) > DOCUMENTS_SIZE:
+                self._documents.popitem(last=False)
+        return document
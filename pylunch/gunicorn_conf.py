@@ -0,0 +1,28 @@
+"""Gunicorn config of the server - the application is preloaded by the master process and the workers
+inherit it copy-on-write, each worker recreates only the parts which do not survive the fork
+(the refresh and log threads, locks, in-flight fetches and host limits).
+
+    $ gunicorn -c python:pylunch.gunicorn_conf pylunch.web:app
+    $ gunicorn -c python:pylunch.gunicorn_conf --workers 5 --bind unix:/run/pylunch/socket pylunch.web:app
+
+The host limits (``hosts`` config value) are shared by the workers through the cache directory.
+"""
+import gc
+import os
+
+bind = os.getenv('PYLUNCH_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('PYLUNCH_WORKERS', 3))
+preload_app = True
+
+
+def when_ready(server):
+    from pylunch import web
+    web.WebApplication.preload()
+    # The preloaded objects are moved to the permanent generation - the collections in the workers
+    # do not touch them, so their memory pages stay shared
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from pylunch import web
+    web.WebApplication.get().after_fork()
@@ -0,0 +1,209 @@
+"""Append-only journal of the restaurants registry changes
+
+The changes of the restaurants (``put``, ``del``, ``set`` and ``unset`` records, one JSON line each) are appended
+to the journal next to the restaurants file (``restaurants.yaml.journal``) instead of writing the whole registry.
+The registry is loaded as the YAML file with the journal replayed on top of it, the journal is compacted back
+to the YAML file once it is larger than ``compact_size``. The processes (CLI, server workers) take the lock
+``restaurants.yaml.lock`` - shared for the load, exclusive for the append and the compaction.
+
+The records are idempotent - when the compaction is interrupted after the YAML file is written, the journal
+replayed again gives the same registry.
+
+The edit of the whole registry starts at the position of the journal (``checkout``) and the records appended
+by the other processes meanwhile are replayed on top of the edited registry when it is saved. The journal
+starts with the ``begin`` record with its random id, so the position in the compacted journal is recognized.
+"""
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import List, Mapping, MutableMapping, Any, Iterable, Optional, Tuple
+
+import yaml
+
+from pylunch import config, utils, errors
+
+log = logging.getLogger(__name__)
+
+COMPACT_SIZE = 64 * 1024
+
+# Position of the journal - (id of the journal, offset)
+Position = Tuple[Optional[str], int]
+
+
+def restaurants_of(data: MutableMapping[str, Any]) -> MutableMapping[str, Any]:
+    """The restaurants mapping of the loaded registry (wrapped in ``restaurants`` or not)
+    """
+    if 'restaurants' in data or not data:
+        if data.get('restaurants') is None:
+            data['restaurants'] = {}
+        return data['restaurants']
+    return data
+
+
+def replay(data: MutableMapping[str, Any], changes: Iterable[Mapping[str, Any]]) -> MutableMapping[str, Any]:
+    restaurants = restaurants_of(data)
+    for change in changes:
+        (op, name) = (change.get('op'), change.get('name'))
+        if op == 'put':
+            restaurants[name] = dict(change['config'])
+        elif op == 'del':
+            restaurants.pop(name, None)
+        elif op == 'begin':
+            continue
+        elif op in ('set', 'unset'):
+            restaurant = restaurants.get(name)
+            if not isinstance(restaurant, MutableMapping):
+                log.warning(f"[JOURNAL] Change of the unknown restaurant {name}: {change}")
+                continue
+            if op == 'set':
+                restaurant.update(change['values'])
+            for key in change.get('keys', ()):
+                restaurant.pop(key, None)
+        else:
+            log.warning(f"[JOURNAL] Unknown change: {change}")
+    return data
+
+
+class RegistryJournal:
+    def __init__(self, loader: config.YamlLoader, compact_size: int = COMPACT_SIZE):
+        self.loader = loader
+        self.compact_size = compact_size
+
+    @property
+    def path(self) -> Path:
+        file = self.loader.full_path
+        return file.with_name(f"{file.name}.journal")
+
+    @property
+    def lock_path(self) -> Path:
+        file = self.loader.full_path
+        return file.with_name(f"{file.name}.lock")
+
+    def load(self, snapshot_dir=None) -> MutableMapping[str, Any]:
+        """The registry - the YAML file (or its snapshot) and the journal replayed on top of it
+        """
+        with utils.FileLock(self.lock_path, shared=True):
+            return self._load(snapshot_dir=snapshot_dir)
+
+    def dump(self) -> str:
+        """The registry with the journal replayed as YAML - read without the compaction
+        """
+        return yaml.dump(self.load(), Dumper=utils.YamlSafeDumper)
+
+    def checkout(self) -> Tuple[MutableMapping[str, Any], Position]:
+        """The registry and the position of the journal - the start of the edit saved by ``save``
+        """
+        with utils.FileLock(self.lock_path, shared=True):
+            return self._load(), self._position()
+
+    def append(self, changes: List[Mapping[str, Any]]):
+        if not changes:
+            return
+        lines = "".join(json.dumps(change, default=str) + "\n" for change in changes)
+        with utils.FileLock(self.lock_path):
+            if not self._ends_with_newline():
+                # The record written partially by a crashed process stays on its own line
+                lines = "\n" + lines
+            with self.path.open('a', encoding='utf-8') as fp:
+                fp.write(lines)
+                fp.flush()
+                os.fsync(fp.fileno())
+                size = fp.tell()
+            log.info(f"[JOURNAL] Appended {len(changes)} changes to {self.path}")
+            if size >= self.compact_size:
+                self._compact()
+
+    def compact(self):
+        """Writes the registry with the journal replayed to the YAML file and truncates the journal
+        """
+        with utils.FileLock(self.lock_path):
+            self._compact()
+
+    def save(self, data: MutableMapping[str, Any], since: Position = None):
+        """Replaces the whole registry (the edited YAML), the journal is dropped - the records appended
+        after the position (the checkout of the edited registry) are replayed on top of the data
+        """
+        with utils.FileLock(self.lock_path):
+            if since is not None:
+                changes = self._read_since(since)
+                if changes:
+                    log.info(f"[JOURNAL] Replaying {len(changes)} changes appended during the edit")
+                    replay(data, changes)
+            self.loader.save(data)
+            self._truncate()
+
+    def _load(self, snapshot_dir=None) -> MutableMapping[str, Any]:
+        data = self.loader.load(snapshot_dir=snapshot_dir) or {}
+        changes = self._read()
+        if changes:
+            log.debug(f"[JOURNAL] Replaying {len(changes)} changes from {self.path}")
+            replay(data, changes)
+        return data
+
+    def _compact(self):
+        if not self.path.exists() or not self.path.stat().st_size:
+            return
+        data = self._load()
+        log.info(f"[JOURNAL] Compacting {self.path} to {self.loader.full_path}")
+        self.loader.save(data)
+        self._truncate()
+
+    def _truncate(self):
+        if self.path.exists():
+            # The new id - the positions in the previous journal are not valid
+            begin = dict(op='begin', id=uuid.uuid4().hex)
+            self.path.write_text(json.dumps(begin) + "\n", encoding='utf-8')
+
+    def _position(self) -> Position:
+        if not self.path.exists():
+            return None, 0
+        with self.path.open('rb') as fp:
+            first = fp.readline()
+            fp.seek(0, os.SEEK_END)
+            return _journal_id(first), fp.tell()
+
+    def _read_since(self, position: Position) -> List[Mapping[str, Any]]:
+        (journal_id, offset) = self._position()
+        if journal_id != position[0] or offset < position[1]:
+            raise errors.RegistryChanged(f"The registry was compacted during the edit ({self.path})")
+        if offset == position[1]:
+            return []
+        with self.path.open('rb') as fp:
+            fp.seek(position[1])
+            lines = fp.read().decode('utf-8').splitlines()
+        return _parse(lines, self.path)
+
+    def _ends_with_newline(self) -> bool:
+        if not self.path.exists() or not self.path.stat().st_size:
+            return True
+        with self.path.open('rb') as fp:
+            fp.seek(-1, os.SEEK_END)
+            return fp.read(1) == b'\n'
+
+    def _read(self) -> List[Mapping[str, Any]]:
+        if not self.path.exists():
+            return []
+        with self.path.open('r', encoding='utf-8') as fp:
+            return _parse(fp, self.path)
+
+
+def _parse(lines: Iterable[str], path: Path) -> List[Mapping[str, Any]]:
+    changes = []
+    for (number, line) in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            changes.append(json.loads(line))
+        except ValueError:
+            log.warning(f"[JOURNAL] Invalid record {path}:{number} skipped: {line!r}")
+    return changes
+
+
+def _journal_id(line: bytes) -> Optional[str]:
+    try:
+        record = json.loads(line.decode('utf-8'))
+    except ValueError:
+        return None
+    return record.get('id') if isinstance(record, dict) and record.get('op') == 'begin' else None
@@ -1,5 +1,10 @@
+import atexit
+import json
 import logging.config
+import logging.handlers
 import os
+import queue
+import threading
 from pathlib import Path
 
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING')
@@ -45,19 +50,95 @@ def load(level: str = None):
     logging.config.dictConfig(cfg)
 
 
-def for_visitor(root_path: Path, day: str) -> logging.Logger:
-    return create_logger(root_path, f'day_{day}')
+PAYLOAD_LIMIT = int(os.getenv('PYLUNCH_LOG_PAYLOAD', 512))
 
 
-def create_logger(root_path: Path, name: str, prefix: str = "pylunch.") -> logging.Logger:
-    logger = logging.getLogger(f"{prefix}{name}")
-    formatter = logging.Formatter('%(levelname)s %(asctime)s: %(message)s')
-    fd = root_path / f"{name}.log"
-    handler = logging.FileHandler(str(fd))
-    handler.setLevel(logging.DEBUG)
-    handler.setFormatter(formatter)
+class Payload:
+    """Lazily formatted log argument - the content is converted and capped only when the record is emitted
+    """
+    __slots__ = ('value', 'limit')
 
-    logger.addHandler(handler)
-    logger.setLevel(logging.DEBUG)
+    def __init__(self, value, limit: int = None):
+        self.value = value
+        self.limit = limit if limit is not None else PAYLOAD_LIMIT
 
-    return logger
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, bytes):
+            value = value[:self.limit * 4].decode('utf-8', errors='replace')
+        text = str(value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text) - self.limit} more)"
+
+    __repr__ = __str__
+
+
+class EntityAdapter(logging.LoggerAdapter):
+    """Logger adapter adding the entity name to the records - one record is routed
+    both to the module log and to the entities log
+    """
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**(kwargs.get('extra') or {}), 'entity': self.extra['entity']}
+        return msg, kwargs
+
+
+class EntityFilter(logging.Filter):
+    """Passes only the records of the entities (all of them or the selected ones)
+    """
+
+    def __init__(self, entities=None):
+        super().__init__()
+        self.entities = frozenset(entities) if entities else None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        entity = getattr(record, 'entity', None)
+        return entity is not None and (self.entities is None or entity in self.entities)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        item = dict(ts=self.formatTime(record), level=record.levelname, entity=getattr(record, 'entity', None),
+                    module=record.module, msg=record.getMessage())
+        if record.exc_info:
+            item['exc'] = self.formatException(record.exc_info)
+        return json.dumps(item, ensure_ascii=False)
+
+
+_entity_log = None
+_entity_log_lock = threading.Lock()
+
+
+def entity_log(file: Path, entities=None, logger: str = ''):
+    """Sets up the entities log (JSON lines) - one queue handler with the entity filter on the (root) logger,
+    the file is written by the listener thread. Set up once per process, the later calls are ignored.
+    """
+    global _entity_log
+    with _entity_log_lock:
+        if _entity_log is not None and _entity_log[0] == os.getpid():
+            return
+        file = Path(file)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file_handler = logging.FileHandler(str(file), encoding='utf-8', delay=True)
+        file_handler.setFormatter(JsonFormatter())
+        records = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(records)
+        handler.addFilter(EntityFilter(entities))
+        listener = logging.handlers.QueueListener(records, file_handler)
+        target = logging.getLogger(logger)
+        if _entity_log is not None:
+            # Forked process - the listener thread of the parent is not running here
+            target.removeHandler(_entity_log[1])
+        target.addHandler(handler)
+        listener.start()
+        atexit.register(listener.stop)
+        _entity_log = (os.getpid(), handler, listener, file, entities, logger)
+
+
+def after_fork():
+    """Restarts the entities log in the forked process - the listener thread of the parent is not running there
+    """
+    state = _entity_log
+    if state is not None and state[0] != os.getpid():
+        entity_log(state[3], entities=state[4], logger=state[5])
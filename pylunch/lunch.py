@@ -1,30 +1,51 @@
 import logging
-from typing import List, Optional, Tuple, Any, MutableMapping, Mapping, Union, Type, ValuesView, Dict
+from typing import List, Optional, Tuple, Any, MutableMapping, Mapping, Union, Type, ValuesView, Dict, FrozenSet, \
+    Iterable, TYPE_CHECKING
 
-import html2text
-import requests
 import yaml
 import json
+import bisect
 import datetime
 import shutil
 import collections
+import concurrent.futures
+import importlib
 import io
+import itertools
 import os
 import re
-import unidecode
-from bs4 import BeautifulSoup, Tag
-from requests import Response
-from pyzomato import Pyzomato
-
-from fuzzywuzzy import fuzz, process
+import threading
+import queue
+import types
 from pathlib import Path
 
 from .tags_evaluator import TagsEvaluator
-from .config import AppConfig
-from pylunch import utils
+from .config import AppConfig, parse_timeout
+from .deadline import Deadline
+from .errors import DeadlineExceeded
+from .metrics import Metrics
+from .popularity import Popularity
+from .fetch import FetchCache, fetch_key
+from .throttle import HostScheduler, HostBusy
+from pylunch import utils, log_config, text_engine, ocr, pdf
+from pylunch.log_config import Payload
+
+# Heavy dependencies are imported lazily on first use to keep the CLI startup fast
+if TYPE_CHECKING:
+    import requests
+    from bs4 import Tag
+    from requests import Response
+    from pyzomato import Pyzomato
 
 log = logging.getLogger(__name__)
 
+# Versions of the restaurants registries - unique across the instances, a reloaded registry
+# never gets the version of the previous one
+_registry_versions = itertools.count(1)
+
+# Modules imported lazily by the resolvers and the restaurants search
+WARM_UP_MODULES = ('requests', 'bs4', 'lxml.html', 'unidecode', 'fuzzywuzzy.process', 'fuzzywuzzy.fuzz')
+
 USER_AGENTS = [
     # Chrome
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/60.0.3112.113 Safari/537.36',
@@ -55,76 +76,133 @@ USER_AGENTS = [
 
 
 class LunchEntity(collections.abc.MutableMapping):
+    """Restaurant entity - the fields are parsed once when the entity is created or changed,
+    the raw config is kept in order to be able to serialize it back to the yaml.
+    """
+    __slots__ = ('_config', '_view', '_logger', '_name', '_url', '_selector', '_resolver', '_display_name',
+                 '_request_params', '_tags', '_tag_set', '_disabled', '_days', '_filters', '_resolvers', '_language',
+                 '_timeout', '_stale')
+
     def __init__(self, config: Mapping[str, Any]):
         self._config = {**config}
+        self._view = types.MappingProxyType(self._config)
         self._logger = None
+        self._parse()
+
+    def _parse(self):
+        config = self._config
+        self._name = config.get('name')
+        self._url = config.get('url')
+        self._selector = config.get('selector')
+        self._resolver = config.get('resolver', 'default')
+        self._display_name = config.get('display_name') or self._name
+        self._request_params = config.get('request_params', {})
+        tags = config.get('tags')
+        self._tags = tuple(tags) if tags else ()
+        self._tag_set = frozenset(self._tags)
+        self._disabled = config.get('disabled', False)
+        days = config.get('days')
+        self._days = tuple(str(day) for day in days) if days else None
+        filters = config.get('filters')
+        self._filters = tuple([filters] if isinstance(filters, str) else filters) if filters else ()
+        resolvers = config.get('resolvers')
+        self._resolvers = tuple(resolvers) if resolvers is not None else None
+        self._language = config.get('language') or 'eng'
+        self._timeout = parse_timeout(config.get('timeout'))
+        stale = config.get('stale')
+        self._stale = utils.to_bool(stale) if stale is not None else None
 
     def __getitem__(self, k):
         return self._config.get(k)
 
     def __setitem__(self, k, v):
-        self.config[k] = v
+        self._config[k] = v
+        self._parse()
 
     def __delitem__(self, k):
-        del self.config[k]
+        del self._config[k]
+        self._parse()
 
     def __iter__(self):
         return iter(self._config)
 
+    def __contains__(self, k):
+        return k in self._config
+
     def __len__(self):
-        return len(self.config)
+        return len(self._config)
 
     @property
     def config(self) -> MutableMapping['str', Any]:
         return self._config
 
+    @property
+    def view(self) -> Mapping[str, Any]:
+        """Read-only view of the config - used by the resolvers, not copied per request
+        """
+        return self._view
+
     @property
     def resolver(self) -> str:
-        return self.config.get('resolver', 'default')
+        return self._resolver
 
     @property
     def name(self) -> str:
-        return self.config.get('name')
+        return self._name
 
     @property
     def url(self) -> str:
-        return self.config.get('url')
+        return self._url
 
     @property
     def selector(self) -> str:
-        return self.config.get('selector')
+        return self._selector
 
     @property
-    def request_params(self) -> List:
-        return self.config.get('request_params', {})
+    def request_params(self) -> dict:
+        return self._request_params
 
     @property
     def display_name(self) -> str:
-        return self.config.get('display_name') or self.name
+        return self._display_name
+
+    @property
+    def tags(self) -> Tuple[str, ...]:
+        return self._tags
 
     @property
-    def tags(self) -> List[str]:
-        return self.config.get('tags')
+    def tag_set(self) -> FrozenSet[str]:
+        return self._tag_set
 
     @property
     def disabled(self) -> bool:
-        return self.config.get('disabled', False)
+        return self._disabled
 
     @property
-    def days(self) -> List[str]:
-        return self.config.get('days')
+    def days(self) -> Optional[Tuple[str, ...]]:
+        return self._days
 
     @property
-    def filters(self) -> str:
-        return self.config.get('filters')
+    def filters(self) -> Tuple[str, ...]:
+        return self._filters
 
     @property
-    def resolvers(self) -> List[MutableMapping]:
-        return self.config.get('resolvers')
+    def resolvers(self) -> Optional[Tuple[Mapping, ...]]:
+        return self._resolvers
 
     @property
     def language(self) -> str:
-        return self.config.get('language') or 'eng'
+        return self._language
+
+    @property
+    def timeout(self) -> Optional[float]:
+        return self._timeout
+
+    @property
+    def stale(self) -> Optional[bool]:
+        """Whether the stale content can be served - None means use the configuration
+        """
+        return self._stale
 
     def __str__(self) -> str:
         result = f"\"{self.name}\" -"
@@ -157,8 +235,11 @@ class LunchEntity(collections.abc.MutableMapping):
 
 
 class ResolverConfig(collections.abc.MutableMapping):
+    """Resolver config - layered over the (read-only) entity or chain step config,
+    changes are written only to the resolver's own layer, the base config is not copied.
+    """
     def __init__(self, config: Mapping[str, Any], entity: LunchEntity = None, content=None):
-        self._config = {**config}
+        self._config = collections.ChainMap({}, config)
         self._entity = entity
         self._content = content
 
@@ -215,6 +296,16 @@ class ResolverConfig(collections.abc.MutableMapping):
         from distutils import util
         return util.strtobool(text)
 
+    @property
+    def cache_suffix(self) -> Optional[str]:
+        return self.config.get('cache_suffix')
+
+    @property
+    def branch(self) -> bool:
+        """The resolver is a step of a parallel chain branch - its failure does not blacklist the entity
+        """
+        return bool(self.config.get('branch', False))
+
     @property
     def allow_cache(self) -> bool:
         return not self.no_cache
@@ -240,8 +331,7 @@ class AbstractResolver:
         self._service = service
         self._config = config
         self._log = self.service.log_factory.get_logger(self.config.entity.name)
-        log.debug(f"[RESOLV] Instance of {self.__class__.__name__} with {config}")
-        self._log.debug(f"[RESOLV] Instance of {self.__class__.__name__} with {config}")
+        self._log.debug("[RESOLV] Instance of %s with %s", self.__class__.__name__, Payload(config))
 
     @property
     def config(self) -> ResolverConfig:
@@ -255,38 +345,78 @@ class AbstractResolver:
     def service(self) -> 'LunchService':
         return self._service
 
+    def span(self, stage: str):
+        return self.service.metrics.span(stage, entity=self.entity.name, resolver=self.__class__.__name__)
+
+    @property
+    def cache_suffix(self) -> str:
+        cls = self.__class__
+        suffix = cls.CACHE_SUFFIX or cls.__name__
+        if self.config.cache_suffix:
+            suffix = f"{suffix}-{self.config.cache_suffix}"
+        return suffix
+
     def resolve(self, day=None, **kwargs) -> Any:
+        with self.span('resolve'):
+            return self._resolve_wrapped(day=day, **kwargs)
+
+    def _resolve_wrapped(self, day=None, deadline: Deadline = None, **kwargs) -> Any:
         cls = self.__class__
-        log.info(f"[RESOLV] Resolving {self.entity.name} using the {cls.__name__}.")
-        self._log.info(f"[RESOLV] Resolving {self.entity.name} using the {cls.__name__}.")
+        self._log.info("[RESOLV] Resolving %s using the %s.", self.entity.name, cls.__name__)
         try:
+            self.check_deadline(deadline, 'resolve')
             allow_cache = self.config.allow_cache and not cls.CACHE_DISABLED
-            log.debug("[RESOLV] Cache is enabled: %r", allow_cache)
             self._log.debug("[RESOLV] Cache is enabled: %r", allow_cache)
             if allow_cache:
-                return self.service.cache.wrap(
+                cached = self.service.cache.wrap(
                     entity=self.entity,
-                    func=self._resolve,
+                    func=self._resolve_serialized,
                     day=day,
                     ext=cls.CACHE_EXT,
-                    suffix=cls.CACHE_SUFFIX or cls.__name__
+                    suffix=self.cache_suffix,
+                    deadline=deadline,
+                    blacklist=not self.config.branch,
                 )
+                return self._deserialize(cached) if cached else cached
 
-            return self._resolve(day=day, **kwargs)
+            return self._resolve(day=day, deadline=deadline, **kwargs)
+        except DeadlineExceeded:
+            raise
         except Exception as ex:
-            log.error(f"[RESOLV] Resolved error {cls.__name__}: {ex}", exc_info=True)
-            self._log.error(f"[RESOLV] Resolved error {cls.__name__}: {ex}", exc_info=True)
+            if deadline is not None and deadline.expired:
+                # Timeouts of the blocking calls (request, tesseract, ...) caused by the deadline
+                raise DeadlineExceeded(f"{cls.__name__}: {ex}") from ex
+            self._log.error("[RESOLV] Resolved error %s: %s", cls.__name__, ex, exc_info=True)
             return None
 
     def resolve_text(self, **kwargs) -> str:
         content = self.resolve(**kwargs)
         return None if not content else str(content)
 
+    def check_deadline(self, deadline: Optional[Deadline], stage: str, partial=None):
+        if deadline is not None and deadline.expired:
+            self._log.warning("[RESOLV] Deadline exceeded for %s in %s", self.entity.name, stage)
+            raise DeadlineExceeded(f"{self.entity.name}:{stage}", partial=partial)
+
     def _resolve(self, **kwargs) -> Any:
         """ This method should be overriden - abstract method
         """
         return None
 
+    def _resolve_serialized(self, **kwargs) -> Optional[str]:
+        content = self._resolve(**kwargs)
+        return self._serialize(content) if content else None
+
+    def _serialize(self, content: Any) -> str:
+        """Converts the resolved content to the string stored in the cache
+        """
+        return str(content)
+
+    def _deserialize(self, content: str) -> Any:
+        """Converts the content from the cache back to the resolved content
+        """
+        return content
+
 
 
 class NoopResolver(AbstractResolver):
@@ -297,36 +427,125 @@ class NoopResolver(AbstractResolver):
 
 
 class ResolverChain(AbstractResolver):
+    """Resolves the content by the steps, each step gets the content of the previous one.
+
+    The step with the ``parallel`` list of branches (a step config or a list of them) resolves
+    the branches concurrently, the ``policy`` selects the result:
+    ``first`` - the first successful branch wins and the others are cancelled (default),
+    ``longest`` - the longest content of all the branches.
+    """
     CACHE_EXT = 'txt'
     CACHE_SUFFIX = 'chain'
+    POLICIES = ('first', 'longest')
 
     @property
     def chain(self) -> List[MutableMapping]:
         return self.entity.resolvers
 
-    def _resolve(self, **kwargs) -> Any:
-        content = None
-        log.info(f"[CHAIN] Resolving chain for {self.entity.name}")
-        for res_cfg in self.chain:
-            config = ResolverConfig(config=res_cfg, entity=self.entity, content=content)
-            resolved = self._resolve_one(config=config, content=content, **kwargs)
+    def _resolve(self, deadline: Deadline = None, **kwargs) -> Any:
+        self._log.info("[CHAIN] Resolving chain for %s", self.entity.name)
+        return self._resolve_steps(self.chain, deadline=deadline, **kwargs)
+
+    def _resolve_steps(self, steps: List[Mapping], content=None, deadline: Deadline = None,
+                       cache_suffix: str = None, **kwargs) -> Any:
+        for res_cfg in steps:
+            # Keep the text resolved by the previous steps as the partial result
+            self.check_deadline(deadline, 'chain', partial=content if isinstance(content, str) else None)
+            if 'parallel' in res_cfg:
+                name = 'parallel'
+                resolved = self._resolve_parallel(res_cfg, content=content, deadline=deadline,
+                                                  cache_suffix=cache_suffix, **kwargs)
+            else:
+                config = ResolverConfig(config=res_cfg, entity=self.entity, content=content)
+                if cache_suffix is not None:
+                    config['branch'] = True
+                    config['cache_suffix'] = config.cache_suffix or cache_suffix
+                name = config.name
+                resolved = self._resolve_one(config=config, content=content, deadline=deadline, **kwargs)
 
             if not resolved:
-                log.warning(f"[CHAIN] Resolver {config.name} for {self.entity.name}: no content")
-                self._log.warning(f"[CHAIN] Resolver {config.name} for {self.entity.name}: no content")
+                self._log.warning("[CHAIN] Resolver %s for %s: no content", name, self.entity.name)
             else:
-                log.info(f"[CHAIN] Resolver {config.name} for {self.entity.name}: {resolved}")
-                self._log.info(f"[CHAIN] Resolver {config.name} for {self.entity.name}: {resolved}")
+                self._log.info("[CHAIN] Resolver %s for %s: %s", name, self.entity.name, Payload(resolved))
             content = resolved
         return content
 
+    def _resolve_parallel(self, step: Mapping, content=None, deadline: Deadline = None,
+                          cache_suffix: str = None, **kwargs) -> Any:
+        branches = [list(branch) if isinstance(branch, (list, tuple)) else [branch] for branch in step['parallel']]
+        if not branches:
+            return None
+        policy = step.get('policy', 'first')
+        if policy not in self.POLICIES:
+            self._log.warning("[CHAIN] Unknown policy %s for %s, using 'first'", policy, self.entity.name)
+            policy = 'first'
+        budget = parse_timeout(step.get('timeout'))
+        group = deadline.within(budget) if deadline is not None else Deadline(budget)
+        # Each branch has its own deadline, so the losers can be cancelled
+        deadlines = [group.within(None) for _ in branches]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(branches),
+                                                         thread_name_prefix='pylunch-branch')
+        futures = {}
+        for (idx, steps) in enumerate(branches):
+            suffix = f"{cache_suffix}-b{idx}" if cache_suffix else f"b{idx}"
+            future = executor.submit(self._resolve_branch, steps, content, deadlines[idx], suffix, **kwargs)
+            futures[future] = idx
+        self._log.info("[CHAIN] Resolving %d branches (%s) for %s", len(branches), policy, self.entity.name)
+        best = None
+        busy = None
+        pending = set(futures)
+        try:
+            while pending and not (best is not None and policy == 'first'):
+                (done, pending) = concurrent.futures.wait(pending, timeout=group.remaining(),
+                                                          return_when=concurrent.futures.FIRST_COMPLETED)
+                if not done:
+                    self._log.warning("[CHAIN] Deadline exceeded waiting for %d branches of %s", len(pending),
+                                      self.entity.name)
+                    break
+                for future in sorted(done, key=futures.get):
+                    try:
+                        resolved = future.result()
+                    except HostBusy as ex:
+                        busy = ex
+                        continue
+                    if not resolved:
+                        continue
+                    if best is None or (policy == 'longest' and len(str(resolved)) > len(str(best[1]))):
+                        best = (futures[future], resolved)
+        finally:
+            for future in pending:
+                future.cancel()
+            for branch_deadline in deadlines:
+                branch_deadline.cancel()
+            executor.shutdown(wait=False)
+        if best is None:
+            if busy is not None:
+                # The throttled branches are not a failure of the entity
+                raise busy
+            self.check_deadline(deadline, 'parallel', partial=content if isinstance(content, str) else None)
+            return None
+        self._log.info("[CHAIN] Branch b%d of %s selected (%s)", best[0], self.entity.name, policy)
+        return best[1]
+
+    def _resolve_branch(self, steps: List[Mapping], content, deadline: Deadline, cache_suffix: str, **kwargs):
+        try:
+            return self._resolve_steps(steps, content=content, deadline=deadline, cache_suffix=cache_suffix, **kwargs)
+        except HostBusy as ex:
+            self._log.info("[CHAIN] Branch %s of %s throttled: %s", cache_suffix, self.entity.name, ex.message)
+            raise
+        except DeadlineExceeded as ex:
+            self._log.info("[CHAIN] Branch %s of %s stopped: %s", cache_suffix, self.entity.name, ex.message)
+        except Exception as ex:
+            self._log.error("[CHAIN] Branch %s of %s failed: %s", cache_suffix, self.entity.name, ex, exc_info=True)
+        return None
+
     def _resolve_one(self, config, content, **kwargs):
         resolver = self.service.resolvers.get(config.name)
         if not resolver:
-            log.warning(f"[CHAIN] Resolver {config.name} for {self.entity.name} was not found, skipping.")
-            self._log.warning(f"[CHAIN] Resolver {config.name} for {self.entity.name} was not found, skipping.")
+            self._log.warning("[CHAIN] Resolver %s for %s was not found, skipping.", config.name, self.entity.name)
             return None
-        self._log.info(f"[CHAIN] Using the resolver {config.name} for entity: {self.entity.name}: {resolver.__name__}")
+        self._log.info("[CHAIN] Using the resolver %s for entity: %s: %s", config.name, self.entity.name,
+                       resolver.__name__)
         instance: AbstractResolver = resolver(service=self.service, config=config)
         if config.text:
             resolved = instance.resolve(**kwargs)
@@ -338,6 +557,8 @@ class ResolverChain(AbstractResolver):
 class RequestResolver(AbstractResolver):
     CACHE_EXT = 'dat'
     CACHE_SUFFIX = 'raw-request'
+    # The resolved content is the response, not the text extracted from it
+    CACHE_RESPONSE = True
 
     @classmethod
     def random_useragent(cls):
@@ -348,67 +569,174 @@ class RequestResolver(AbstractResolver):
     def request_url(self) -> str:
         return self.config.content or self.config.url or self.entity.url
 
-    def get_request_params(self) -> dict:
+    def get_request_params(self, deadline: Deadline = None) -> dict:
         headers = {'User-Agent': self.__class__.random_useragent()}
         params = dict()
         if self.config.request_params:
             params.update(self.config.request_params)
             if 'headers' in params:
-                params['headers'].update(headers)
+                params['headers'] = {**params['headers'], **headers}
         else:
             params['headers'] = headers
+        timeout = self.service.config.request_timeout
+        if deadline is not None:
+            timeout = deadline.timeout(cap=timeout)
+        if timeout is not None:
+            params['timeout'] = min(params.get('timeout') or timeout, timeout)
         return params
 
-    def _resolve(self, **kwargs) -> Optional[requests.Response]:
+    def _resolve(self, deadline: Deadline = None, **kwargs) -> Optional['requests.Response']:
+        import requests
         try:
-            params = self.get_request_params()
-            response = requests.get(self.request_url, **(params))
+            params = self.get_request_params(deadline=deadline)
+            with self.span('fetch'):
+                response = self._fetch(requests, params)
+        except HostBusy as ex:
+            self._log.warning("[RES] Request of %s not sent: %s", self.entity.name, ex.message)
+            raise
         except Exception as ex:
-            log.error(f"Request error: {ex}")
+            self._log.error("[RES] Request error %s: %s", self.entity.name, ex)
+            self.check_deadline(deadline, 'fetch')
             return None
         if not response.ok:
-            log.warning(f"[LUNCH] Error[{response.status_code}] ({self.entity.name}): {response.content}")
-            print(f"Error[{response.status_code}] {self.entity.name}: ", response.content)
+            self._log.warning("[LUNCH] Error[%s] (%s): %s", response.status_code, self.entity.name,
+                              Payload(response.content))
         else:
-            log.debug(f"[RES] Response [{response.status_code}] {self.entity.name}: {response.content}")
+            self._log.debug("[RES] Response [%s] %s: %s", response.status_code, self.entity.name,
+                            Payload(response.content))
         return response
 
+    def _fetch(self, requests, params: dict):
+        url = self.request_url
+
+        def fetch():
+            with self.service.scheduler.slot(url, timeout=params.get('timeout'), entity=self.entity.name):
+                return requests.get(url, **params)
+
+        if not self.service.config.fetch_cache:
+            return fetch()
+        # One download of the page for all the entities requesting it
+        return self.service.fetcher.get(url, params, fetch=fetch)
+
     def resolve_text(self, **kwargs) -> Optional[str]:
         res = self.resolve(**kwargs)
-        if res.ok:
-            return res.content.decode('utf-8')
+        if res is not None and res.ok:
+            return decode_content(res.content)[0]
         return None
 
+    def _serialize(self, content: Any) -> str:
+        if isinstance(content, str):
+            return content
+        if not content.ok:
+            return ''
+        # The charset is stored with the text, so the cached response has the same content
+        (text, charset) = decode_content(content.content)
+        return f"{CachedResponse.CHARSET_PREFIX}{charset}\n{text}"
+
+    def _deserialize(self, content: str) -> Any:
+        if not self.CACHE_RESPONSE:
+            return content
+        return CachedResponse.from_cache(content)
+
+
+def decode_content(content: bytes) -> Tuple[str, str]:
+    """Text of the response content and its charset - declared by the document (BOM, XML or HTML meta)
+    or detected, the fetched responses do not keep the headers
+    """
+    from bs4 import UnicodeDammit
+    dammit = UnicodeDammit(content, is_html=True)
+    if dammit.unicode_markup is None:
+        return content.decode('utf-8', errors='replace'), 'utf-8'
+    return dammit.unicode_markup, dammit.original_encoding or 'utf-8'
+
+
+class CachedResponse:
+    """Response-like object for the raw response content loaded from the cache
+    """
+    CHARSET_PREFIX = 'charset='
+    status_code = 200
+    ok = True
+
+    def __init__(self, content: bytes, encoding: str = 'utf-8'):
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+    @classmethod
+    def from_cache(cls, cached: str) -> 'CachedResponse':
+        """The content encoded back by its original charset (the first line of the cached text),
+        the cached text without the charset is UTF-8
+        """
+        (first, sep, text) = cached.partition('\n')
+        if not sep or not first.startswith(cls.CHARSET_PREFIX):
+            return cls(cached.encode('utf-8'))
+        encoding = first[len(cls.CHARSET_PREFIX):]
+        try:
+            return cls(text.encode(encoding, errors='replace'), encoding=encoding)
+        except LookupError:
+            return cls(text.encode('utf-8'))
+
 
 class HtmlResolver(RequestResolver):
     CACHE_EXT = 'html'
     CACHE_SUFFIX = 'html'
-
-    def _parse_response(self, response: Response) -> List[Tag]:
-        soap = BeautifulSoup(response.content, "lxml")
-        sub = soap.select(self.config.selector) if self.config.selector else soap
-        log.debug(f"[LUNCH] Parsed[{self.entity.name}]: {sub}")
+    CACHE_RESPONSE = False
+
+    def _parse_response(self, response: 'Response') -> List['Tag']:
+        with self.span('parse'):
+            soap = self.service.fetcher.document(response.content, parse_html)
+        with self.span('select'):
+            sub = soap.select(self.config.selector) if self.config.selector else soap
+        self._log.debug("[LUNCH] Parsed[%s]: %s", self.entity.name, Payload(sub))
         return sub
 
     def resolve_text(self, **kwargs) -> Optional[str]:
         html_string = self.resolve(**kwargs)
         if html_string is None:
             return None
-        return to_text(html_string)
+        with self.span('html2text'):
+            return to_text(html_string, engine=self.service.config.text_engine)
 
     def _resolve(self, **kwargs) -> Optional[str]:
         response = super()._resolve(**kwargs)
         if response is None:
             return None
         parsed = self._parse_response(response=response)
+        if self.service.config.split_pages and response.ok:
+            self._split_page(response)
         content = self.to_string(parsed)
         if not content:
-            log.warning(f"[HTML] Content is empty for {self.entity.name} - {self.config.url} ({self.config.selector})")
+            self._log.warning("[HTML] Content is empty for %s - %s (%s)", self.entity.name, self.config.url,
+                              self.config.selector)
             return None
         else:
-            log.debug(f"[HTML] Extracted content {self.entity.name}: {content}")
+            self._log.debug("[HTML] Extracted content %s: %s", self.entity.name, Payload(content))
         return content
 
+    def _split_page(self, response: 'Response'):
+        """Selects the content of the other restaurants on the same page from the parsed document
+        and stores it to their cache, so the page is parsed once for all of them
+        """
+        cache = self.service.cache
+        if not cache.enabled:
+            return
+        siblings = self.service.page_siblings(self.request_url, self.config.request_params, exclude=self.entity)
+        if not siblings:
+            return
+        soap = self.service.fetcher.document(response.content, parse_html)
+        for sibling in siblings:
+            fragment = cache.create_fragment(sibling, suffix=self.CACHE_SUFFIX, ext=self.CACHE_EXT)
+            if (cache.cache_base / fragment).exists():
+                continue
+            with self.span('split'):
+                content = self.to_string(soap.select(sibling.selector))
+            if content:
+                self._log.debug("[HTML] Split content of %s from the page of %s", sibling.name, self.entity.name)
+                cache.store_entity(sibling, content, suffix=self.CACHE_SUFFIX, ext=self.CACHE_EXT)
+
     @classmethod
     def to_string(cls, parsed) -> str:
         if isinstance(parsed, list):
@@ -426,18 +754,22 @@ class AbstractHtmlResolver(AbstractResolver):
         html_string = self.resolve(**kwargs)
         if html_string is None:
             return None
-        return to_text(html_string)
+        with self.span('html2text'):
+            return to_text(html_string, engine=self.service.config.text_engine)
 
 
 class HtmlTagsSelectorResolver(AbstractHtmlResolver):
     CACHE_DISABLED = True
 
-    def _resolve(self, **kwargs) -> List[Tag]:
-        response: requests.Response = self.config.content
+    def _resolve(self, **kwargs) -> List['Tag']:
+        from bs4 import BeautifulSoup
+        response: 'requests.Response' = self.config.content
 
-        soap = BeautifulSoup(response.content, "lxml")
-        tags = soap.select(self.entity.selector) if self.entity.selector else soap
-        log.debug(f"[LUNCH] Parsed[{self.entity.name}]: {tags}")
+        with self.span('parse'):
+            soap = BeautifulSoup(response.content, "lxml")
+        with self.span('select'):
+            tags = soap.select(self.entity.selector) if self.entity.selector else soap
+        self._log.debug("[LUNCH] Parsed[%s]: %s", self.entity.name, Payload(tags))
         return tags
 
 
@@ -446,10 +778,10 @@ class ToStringResolver(AbstractResolver):
         string = self.config.content
         content = self.to_string(string)
         if not content:
-            log.warning(f"[STR] Content is empty for {self.entity.name}")
+            self._log.warning("[STR] Content is empty for %s", self.entity.name)
             return None
         else:
-            log.debug(f"[STR] Extracted content {self.entity.name}: {content}")
+            self._log.debug("[STR] Extracted content %s: %s", self.entity.name, Payload(content))
         return content
 
     @classmethod
@@ -463,7 +795,7 @@ class ToStringResolver(AbstractResolver):
 
 class HtmlTagsAttributeResolver(AbstractHtmlResolver):
     def _resolve(self, **kwargs):
-        tags: List[Tag] = self.config.content
+        tags: List['Tag'] = self.config.content
 
         return super()._resolve()
 
@@ -476,19 +808,35 @@ class ZomatoResolver(AbstractResolver):
     """
 
     @property
-    def zomato(self) -> Pyzomato:
+    def zomato(self) -> 'Pyzomato':
         return self.service.zomato
 
-    def make_request(self) -> dict:
-        return self.zomato.getDailyMenu(self.entity.selector)
-
-    def _resolve(self, **kwargs) -> Optional[dict]:
+    def make_request(self, deadline: Deadline = None) -> dict:
+        import requests
+        # Same request as the Pyzomato.getDailyMenu, but with the timeout
+        api = self.zomato.api
+        timeout = self.service.config.request_timeout
+        if deadline is not None:
+            timeout = deadline.timeout(cap=timeout)
+        url = f"{api.host}/dailymenu"
+        with self.span('fetch'), self.service.scheduler.slot(url, timeout=timeout, entity=self.entity.name):
+            response = requests.get(url, params=dict(res_id=self.entity.selector), headers=api.headers,
+                                    timeout=timeout)
+        return response.json()
+
+    def _resolve(self, deadline: Deadline = None, **kwargs) -> Optional[dict]:
         if self.zomato is None:
             return None
-        content = self.make_request()
-        log.debug(f"[ZOMATO] Response: {json.dumps(content, indent=2)}")
+        content = self.make_request(deadline=deadline)
+        self._log.debug("[ZOMATO] Response: %s", Payload(content))
         return content
 
+    def _serialize(self, content: Any) -> str:
+        return json.dumps(content)
+
+    def _deserialize(self, content: str) -> Any:
+        return json.loads(content)
+
     def resolve_text(self, **kwargs) -> Optional[str]:
         content = self.resolve(**kwargs)
         if content is None:
@@ -510,67 +858,93 @@ class ZomatoResolver(AbstractResolver):
 class PDFResolver(RequestResolver):
     CACHE_EXT = 'pdf'
     CACHE_SUFFIX = 'pdf'
+    CACHE_RESPONSE = False
 
     def _resolve(self, **kwargs):
         response = super()._resolve(**kwargs)
         if not response or not response.ok:
-            log.error(f"Unnable to get response from: {self.url}")
+            self._log.error("Unnable to get response from: %s", self.request_url)
             return None
-        text = self._resolve_text_from_content(io.BytesIO(response.content))
-        log.info(f"[PDF] Resolved text: {text}")
+        with self.span('pdf'):
+            text = self._resolve_text_from_content(io.BytesIO(response.content), deadline=kwargs.get('deadline'))
+        self._log.info("[PDF] Resolved text: %s", Payload(text))
         return text
 
     def resolve_text(self, **kwargs) -> str:
         text = self.resolve(**kwargs)
         return f"PDF is available at: {self.entity.url}\n\n{text}"
 
-    def _resolve_text_from_content(self, stream: io.BytesIO):
-        from pdfminer import high_level
-        import pdfminer.layout
+    def _resolve_text_from_content(self, stream: io.BytesIO, deadline: Deadline = None):
+        engine = self.config['pdf_engine'] or self.service.config.pdf_engine
 
-        out = io.BytesIO()
-        laparams = pdfminer.layout.LAParams()
-        for param in ("all_texts", "detect_vertical", "word_margin", "char_margin", "line_margin", "boxes_flow"):
-            paramv = locals().get(param, None)
-            if paramv is not None:
-                setattr(laparams, param, paramv)
+        def check(partial: str):
+            # The deadline is checked before each page
+            self.check_deadline(deadline, 'pdf', partial=partial or None)
 
-        high_level.extract_text_to_fp(stream, outfp=out, laparams=laparams)
-        return out.getvalue().decode('utf-8')
+        timeout = deadline.timeout() if deadline is not None else None
+        return pdf.extract_text(stream.getvalue(), engine=engine, check=check, timeout=timeout)
 
 
 class OcrImgRawResolver(RequestResolver):
     CACHE_EXT = 'img'
     CACHE_SUFFIX = 'img-ocr'
+    CACHE_RESPONSE = False
+
+    @property
+    def ocr_today(self) -> bool:
+        return utils.to_bool(self.config['ocr_today'])
+
+    @property
+    def cache_suffix(self) -> str:
+        # The recognition stopped after today's section is not the full content of the image
+        return f"{super().cache_suffix}-today" if self.ocr_today else super().cache_suffix
 
     def _resolve(self, **kwargs):
         response = super()._resolve(**kwargs)
         if not response or not response.ok:
-            log.error(f"Unnable to get response from: {self.url}")
+            self._log.error("Unnable to get response from: %s", self.request_url)
             return None
-        text = self._resolve_text_from_content(io.BytesIO(response.content))
-        log.info(f"[IMG] Resolved image: {text}")
+        with self.span('ocr'):
+            text = self._resolve_text_from_content(io.BytesIO(response.content), deadline=kwargs.get('deadline'))
+        self._log.info("[IMG] Resolved image: %s", Payload(text))
         return text
 
     def resolve_text(self, **kwargs) -> str:
         text = self.resolve(**kwargs)
         return f"PDF is available at: {self.entity.url}\n\n{text}"
 
-    def _resolve_text_from_content(self, stream: io.BytesIO):
-        import pytesseract
+    def _resolve_text_from_content(self, stream: io.BytesIO, deadline: Deadline = None):
         from PIL import Image
         img = Image.open(stream)
-        return pytesseract.image_to_string(img, lang=self.entity.language)
+        # The recognition is cancelled after the timeout
+        timeout = deadline.timeout() if deadline is not None else None
+        config = self.service.config
+        if not config.ocr_tiles:
+            return ocr.image_to_string(img, lang=self.entity.language, timeout=timeout, engine=config.ocr_engine,
+                                       pool_size=config.ocr_workers)
+        return ocr.image_to_string_tiled(img, lang=self.entity.language, timeout=timeout, engine=config.ocr_engine,
+                                         pool_size=config.ocr_workers, band_height=config.ocr_band_height,
+                                         stop=self._today_found if self.ocr_today else None)
+
+    def _today_found(self, text: str) -> bool:
+        """The text contains the today's section (the next day header follows it) - the rest is not needed
+        """
+        today = datetime.date.today().weekday()
+        days = DayResolveFilter(self.service, self.entity).split_week(text)
+        return today in days and today + 1 in days
 
 
 class OCRHeavyResolver(RequestResolver):
     CACHE_EXT = 'html'
     CACHE_SUFFIX = 'html-img'
-
-    def _parse_response(self, response: Response) -> List[Tag]:
-        soap = BeautifulSoup(response.content, "lxml")
-        sub = soap.select(self.entity.selector) if self.entity.selector else soap
-        log.debug(f"[LUNCH] Parsed[{self.entity.name}]: {sub}")
+    CACHE_RESPONSE = False
+
+    def _parse_response(self, response: 'Response') -> List['Tag']:
+        with self.span('parse'):
+            soap = self.service.fetcher.document(response.content, parse_html)
+        with self.span('select'):
+            sub = soap.select(self.entity.selector) if self.entity.selector else soap
+        self._log.debug("[LUNCH] Parsed[%s]: %s", self.entity.name, Payload(sub))
         return sub
 
     def _resolve(self, **kwargs) -> Optional[str]:
@@ -581,8 +955,8 @@ class OCRHeavyResolver(RequestResolver):
         if not parsed:
             return None
         url = parsed[0]['src']
-        log.info(f"[OCR] Got an URL for [{self.entity.name}]: {url}")
-        config = ResolverConfig(entity=self.entity, config=self.entity.config, content=url)
+        self._log.info("[OCR] Got an URL for [%s]: %s", self.entity.name, url)
+        config = ResolverConfig(entity=self.entity, config=self.entity.view, content=url)
 
         return OcrImgRawResolver(self.service, config=config).resolve(**kwargs)
 
@@ -618,12 +992,13 @@ class CutFilter(LunchContentFilter):
     def _find_pos(self, content: str, sub: str, diacritics=False, shift: int = 0) -> Optional[int]:
         if sub is None or content is None:
             return None
+        import unidecode
         text = unidecode.unidecode(content) if not diacritics else content
         dec_sub = unidecode.unidecode(sub) if not diacritics else sub
 
         text = text if shift is None or shift == 0 or len(text) <= shift else text[shift:]
 
-        log.debug(f"[CUT] Matching \"{dec_sub}\" in {text}, text-shift={shift}")
+        log.debug("[CUT] Matching \"%s\" in %s, text-shift=%s", dec_sub, Payload(text), shift)
         pos: re.Match = re.search(dec_sub, text, re.IGNORECASE)
         if pos is None:
             log.warning(f"[CUT] Not found position of {sub} in the content for {self.entity.name}.")
@@ -705,6 +1080,55 @@ class DayResolveFilter(CutFilter):
 
         return content[beg:end]
 
+    def split_week(self, content: str, diacritics=False) -> Dict[int, str]:
+        """Splits the content to the sections of the week days (0 - Monday), the same sections
+        as the filter returns for each day - only the days with a delimiter found are included.
+        The content is normalized and searched for all the delimiters once.
+        """
+        if not content:
+            return {}
+        markers = self._day_markers(content, diacritics=diacritics)
+        result = {}
+        for day in range(len(self.DAYS[0])):
+            beg = self._find_marker(markers, day, diacritics=diacritics)
+            if beg is None:
+                continue
+            end = self._find_marker(markers, day + 1, after=beg, diacritics=diacritics)
+            result[day] = content[beg:end if end is not None else len(content)]
+        return result
+
+    def _day_markers(self, content: str, diacritics=False) -> Dict[str, List[int]]:
+        """Positions of all the day delimiters in the (normalized) content
+        """
+        import unidecode
+        text = unidecode.unidecode(content) if not diacritics else content
+        groups = {}
+        for day in range(len(self.DAYS[0])):
+            for opt in self.options(day) or ():
+                pattern = unidecode.unidecode(opt) if not diacritics else opt
+                if pattern and pattern not in groups:
+                    groups[pattern] = f"d{len(groups)}"
+        positions = {pattern: [] for pattern in groups}
+        if not groups:
+            return positions
+        names = {name: pattern for (pattern, name) in groups.items()}
+        regex = re.compile("|".join(f"(?P<{name}>{pattern})" for (pattern, name) in groups.items()), re.IGNORECASE)
+        for match in regex.finditer(text):
+            positions[names[match.lastgroup]].append(match.start())
+        return positions
+
+    def _find_marker(self, markers: Dict[str, List[int]], day: int, after: int = 0,
+                     diacritics=False) -> Optional[int]:
+        import unidecode
+        for opt in self.options(day) or ():
+            found = markers.get(unidecode.unidecode(opt) if not diacritics else opt)
+            if not found:
+                continue
+            idx = bisect.bisect_left(found, after)
+            if idx < len(found):
+                return found[idx]
+        return None
+
 
 class LunchCollection(collections.abc.MutableMapping):
     def __init__(self, cls_wrap=None, **kwargs):
@@ -730,15 +1154,33 @@ class LunchCollection(collections.abc.MutableMapping):
         return len(self.collection)
 
 
-class Resolvers(LunchCollection):
-    def register(self, name: str, cls: type):
+class LazyCollection(LunchCollection):
+    """Collection of classes registered either directly or by the import path (``module:Class``),
+    the import paths are imported on the first use.
+    """
+
+    def load(self, name: str) -> Optional[type]:
+        item = self._collection.get(name)
+        if isinstance(item, str):
+            log.debug(f"[LOAD] Importing [{name}]: {item}")
+            item = utils.import_object(item)
+            self._collection[name] = item
+        return item
+
+    @classmethod
+    def _item_name(cls, item: Union[type, str]) -> str:
+        return item if isinstance(item, str) else item.__name__
+
+
+class Resolvers(LazyCollection):
+    def register(self, name: str, cls: Union[type, str]):
         if name is None or cls is None:
             return
-        log.info(f"[ADD] Resolver [{name}]: {cls.__name__}")
+        log.info(f"[ADD] Resolver [{name}]: {self._item_name(cls)}")
         self._collection[name] = cls
 
     def get(self, name: str) -> type:
-        return self._collection.get(name, HtmlResolver)
+        return self.load(name) or HtmlResolver
 
     def for_entity(self, entity: LunchEntity) -> Union[Type[ResolverChain], type]:
         if entity.resolvers is not None or entity.resolver == 'chain':
@@ -747,23 +1189,32 @@ class Resolvers(LunchCollection):
         return self.get(entity.resolver)
 
 
-class Filters(LunchCollection):
-    def register(self, name: str, cls: type):
-        log.info(f"[ADD] Filter [{name}]: {cls.__name__}")
+class Filters(LazyCollection):
+    def register(self, name: str, cls: Union[type, str]):
+        log.info(f"[ADD] Filter [{name}]: {self._item_name(cls)}")
         self._collection[name] = cls
 
     def get(self, name: str) -> type:
-        return self._collection.get(name, LunchContentFilter)
+        return self.load(name) or LunchContentFilter
 
     def for_entity(self, entity: LunchEntity) -> List[type]:
         log.debug(f"[FILTER] Filters for entity {entity.name} ~> {entity.filters}")
-        return [self.get(flt) for flt in (entity.filters or [])]
+        return [self.get(flt) for flt in entity.filters]
 
 
 class Entities(LunchCollection):
     def __init__(self, entities: dict, updated: datetime.datetime = None):
         super().__init__(cls_wrap=LunchEntity, **entities)
         self._updated = updated
+        self._version = next(_registry_versions)
+        # Changes not saved yet - the records of the registry journal
+        self._changes: List[Dict[str, Any]] = []
+
+    @property
+    def version(self) -> int:
+        """Version of the registry - changed when a restaurant is registered or removed
+        """
+        return self._version
 
     @property
     def collection(self) -> MutableMapping[str, Any]:
@@ -775,10 +1226,14 @@ class Entities(LunchCollection):
     def entities(self) -> MutableMapping[str, LunchEntity]:
         return self.collection
 
+    def __contains__(self, name) -> bool:
+        # The mapping lookup returns None for the missing restaurant, it does not raise the KeyError
+        return name in self.entities
+
     def __getitem__(self, name) -> Optional[LunchEntity]:
         if name in self.entities.keys():
             instance = self.entities[name]
-            log.info(f"[LUNCH] Found in entities {name}: {instance}")
+            log.info("[LUNCH] Found in entities %s: %s", name, instance)
             return instance
         else:
             log.warning(f"[LUNCH] Not found in entities {name}")
@@ -789,6 +1244,35 @@ class Entities(LunchCollection):
             return
         self.register(name=name, **config)
 
+    def __delitem__(self, name):
+        del self.entities[name]
+        self._changed(op='del', name=name)
+
+    def update(self, name: str, **values):
+        """Sets the config values of the restaurant
+        """
+        entity = self.entities[name]
+        for (key, value) in values.items():
+            entity[key] = value
+        self._changed(op='set', name=name, values=values)
+
+    def unset(self, name: str, *keys: str):
+        """Removes the config values of the restaurant
+        """
+        entity = self.entities[name]
+        for key in keys:
+            if key in entity:
+                del entity[key]
+        self._changed(op='unset', name=name, keys=list(keys))
+
+    def pop_changes(self) -> List[Dict[str, Any]]:
+        (changes, self._changes) = (self._changes, [])
+        return changes
+
+    def _changed(self, **change):
+        self._changes.append(change)
+        self._version = next(_registry_versions)
+
     def find_one(self, name: str) -> LunchEntity:
         return self.get(name) or self.fuz_find_one(name)[0]
 
@@ -799,12 +1283,14 @@ class Entities(LunchCollection):
         return [i[0] for i in self.fuz_find(name, limit)]
 
     def fuz_find(self, name: str, limit=10) -> List[Tuple]:
+        from fuzzywuzzy import fuzz, process
         return process.extract(name, self.entities,
                                processor=lambda x: x if isinstance(x, str) else x.name,
                                scorer=fuzz.token_sort_ratio,
                                limit=limit)
 
     def fuz_find_one(self, name: str) -> Tuple:
+        from fuzzywuzzy import fuzz, process
         return process.extractOne(name, self.entities,
                                   processor=lambda x: x if isinstance(x, str) else x.name,
                                   scorer=fuzz.token_sort_ratio)
@@ -824,18 +1310,19 @@ class Entities(LunchCollection):
         instance = LunchEntity(config)
         log.info(f"[REG] Register [{name}]: {instance}")
         self.entities[name] = instance
+        self._changed(op='put', name=name, config=instance.config)
 
     def all_tags(self) -> List[str]:
         accumulator = set()
         for entity in self.entities.values():
             if entity.tags:
                 accumulator.update(entity.tags)
-        return list(accumulator)
+        return sorted(accumulator)
 
     def find_by_tags(self, expression: str):
         tags = TagsEvaluator(expression, self.all_tags())
-        result = [entity for entity in self.entities.values() if tags.evaluate(entity.tags)]
-        log.info(f"[FIND] Found by tags {expression}: {result}")
+        result = [entity for entity in self.entities.values() if tags.evaluate(entity.tag_set)]
+        log.info("[FIND] Found by tags %s: %s", expression, Payload(result))
         return result
 
     def to_dict(self) -> dict:
@@ -916,33 +1403,63 @@ class RemoteSources(utils.CollectionWrapper):
 
 
 class LunchService:
-    def __init__(self, config: AppConfig, entities: Entities):
+    def __init__(self, config: AppConfig, entities: Entities, metrics: Metrics = None,
+                 popularity: Popularity = None):
         self._entities: Entities = entities
         self._resolvers: Resolvers = Resolvers(
-            default=HtmlResolver,
-            url_only=NoopResolver,
-            zomato=ZomatoResolver,
-            ocr_img=OCRHeavyResolver,
-            ocr_raw=OcrImgRawResolver,
-            pdf=PDFResolver,
-            request=RequestResolver,
-            chain=ResolverChain,
-            html_tags=HtmlTagsSelectorResolver,
-            html=HtmlResolver,
-            html_attr=HtmlTagsAttributeResolver,
+            default='pylunch.lunch:HtmlResolver',
+            url_only='pylunch.lunch:NoopResolver',
+            zomato='pylunch.lunch:ZomatoResolver',
+            ocr_img='pylunch.lunch:OCRHeavyResolver',
+            ocr_raw='pylunch.lunch:OcrImgRawResolver',
+            pdf='pylunch.lunch:PDFResolver',
+            request='pylunch.lunch:RequestResolver',
+            chain='pylunch.lunch:ResolverChain',
+            html_tags='pylunch.lunch:HtmlTagsSelectorResolver',
+            html='pylunch.lunch:HtmlResolver',
+            html_attr='pylunch.lunch:HtmlTagsAttributeResolver',
         )
         self._filters: Filters = Filters(
-            raw=LunchContentFilter,
-            day=DayResolveFilter,
-            nl=NewLinesFilter,
-            cut=CutFilter
+            raw='pylunch.lunch:LunchContentFilter',
+            day='pylunch.lunch:DayResolveFilter',
+            nl='pylunch.lunch:NewLinesFilter',
+            cut='pylunch.lunch:CutFilter'
         )
         self._config: AppConfig = config
-        self._zomato: Optional[Pyzomato] = None
+        self._zomato: Optional['Pyzomato'] = None
+        # Index of the html resolved restaurants by the page - (registry version, fetch key -> restaurants)
+        self._pages: Tuple[int, Mapping[str, List[LunchEntity]]] = (0, {})
         self._cache: LunchCache = LunchCache(self)
         self._blacklist: EntityBlacklist = EntityBlacklist(self)
         self._sources = RemoteSources(self)
         self._log_factory = LunchLoggerFactory(self.cache)
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._popularity = popularity if popularity is not None else self._create_popularity()
+        self._refresher = LunchRefresher(self)
+        self._fetcher = FetchCache(root=self._fetch_root)
+        self._scheduler = self._create_scheduler()
+
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
+    @property
+    def popularity(self) -> Popularity:
+        return self._popularity
+
+    def _create_scheduler(self) -> HostScheduler:
+        # The host budgets are shared by the processes (server workers, CLI) using the same cache directory
+        state_dir = self.cache.cache_base / '_hosts' if self.cache.enabled else None
+        return HostScheduler(self.config.hosts, metrics=self._metrics, state_dir=state_dir)
+
+    def _create_popularity(self) -> Popularity:
+        path = self.cache.cache_base / 'popularity.json' if self.cache.enabled else None
+        return Popularity(path=path, half_life=self.config.popularity_half_life * 3600)
+
+    def rank(self, entities: Iterable[LunchEntity]) -> List[LunchEntity]:
+        """Orders the entities by their popularity - the most requested first
+        """
+        return self.popularity.rank(entities)
 
     @property
     def log_factory(self) -> 'LunchLoggerFactory':
@@ -957,11 +1474,81 @@ class LunchService:
         return self._blacklist
 
     @property
-    def zomato(self) -> Optional[Pyzomato]:
+    def refresher(self) -> 'LunchRefresher':
+        return self._refresher
+
+    @property
+    def fetcher(self) -> FetchCache:
+        return self._fetcher
+
+    @property
+    def scheduler(self) -> HostScheduler:
+        return self._scheduler
+
+    def warm_up(self):
+        """Loads what the requests load lazily - the resolvers and filters of the entities, their modules
+        the text engine and the PDF engine (e.g. in the server master process before the workers are forked)
+        """
+        for entity in self.instances.values():
+            self.resolvers.for_entity(entity)
+            self.filters.for_entity(entity)
+        self.instances.all_tags()
+        text_engine.get_engine(self.config.text_engine)
+        if self.config.pdf_engine == pdf.AUTO:
+            pdf.select_engine()
+        for module in WARM_UP_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError as ex:
+                log.debug(f"[WARM] Module not available {module}: {ex}")
+
+    def after_fork(self):
+        """Recreates the parts which do not survive the fork - the threads, locks and in-flight state
+        """
+        self._refresher = LunchRefresher(self)
+        self._fetcher = FetchCache(root=self._fetch_root)
+        self._scheduler = self._create_scheduler()
+        self._popularity.after_fork()
+        self._metrics.reset()
+        log_config.after_fork()
+
+    def _fetch_root(self, day: str = None) -> Optional[Path]:
+        return self.cache.cache_base / self.cache.for_day(day) if self.cache.enabled else None
+
+    def page_siblings(self, url: str, request_params: Mapping = None,
+                      exclude: LunchEntity = None) -> List[LunchEntity]:
+        """Enabled restaurants resolved by the html resolver from the same page (URL and request params)
+        """
+        pages = self._page_index()
+        return [entity for entity in pages.get(fetch_key(url, request_params), ()) if entity is not exclude]
+
+    def _page_index(self) -> Mapping[str, List[LunchEntity]]:
+        """The restaurants by the fetch key of their page (the key includes the normalized URL),
+        built once per the registry version
+        """
+        instances = self.instances
+        (version, pages) = self._pages
+        if version == instances.version:
+            return pages
+        pages = {}
+        for entity in instances.values():
+            if entity.disabled or not entity.selector or not entity.url or entity.resolvers is not None:
+                continue
+            if self.resolvers.for_entity(entity) is not HtmlResolver:
+                continue
+            pages.setdefault(fetch_key(entity.url, entity.request_params), []).append(entity)
+        self._pages = (instances.version, pages)
+        return pages
+
+    @property
+    def zomato(self) -> Optional['Pyzomato']:
         if self._zomato is None:
             if self.config.zomato_key is None:
                 return None
+            from pyzomato import Pyzomato
             self._zomato = Pyzomato(self.config.zomato_key)
+            if self.config.zomato_url:
+                self._zomato.api.host = self.config.zomato_url
         return self._zomato
 
     @property
@@ -991,14 +1578,15 @@ class LunchService:
             self._import_restaurants(restaurants, override=override)
 
     def import_string(self, string: str, override=False):
-        log.info(f"[IMPORT] Importing content: {string}")
+        log.info("[IMPORT] Importing content: %s", Payload(string))
         restaurants = yaml.safe_load(string)
         self._import_restaurants(restaurants, override=override)
 
     def import_url(self, url: str, override=False):
+        import requests
         res = requests.get(url=url)
         if not res.ok:
-            log.error(f"[IMPORT] Unable to get from \"{url}\"[{res.status_code}]: {res.content}")
+            log.error("[IMPORT] Unable to get from \"%s\"[%s]: %s", url, res.status_code, Payload(res.content))
             return
         self.import_string(res.content, override=override)
 
@@ -1020,7 +1608,7 @@ class LunchService:
 
         try:
             content = f"Restaurant: \"{name}\" - {instance.url}\n" + instance.invoke()
-            log.debug(f"Content: {content}")
+            log.debug("Content: %s", Payload(content))
             return content
         except Exception as ex:
             return "ERR: {ex}"
@@ -1034,8 +1622,68 @@ class LunchService:
             result += f" - {restaurant.name} - {restaurant.url}\n"
         return result
 
-    def resolve_text(self, entity: LunchEntity, **kwargs) -> str:
-        return self.cache.wrap(entity, func=self._resolve_text, ext='txt', **kwargs)
+    def resolve_text(self, entity: LunchEntity, deadline: Deadline = None, **kwargs) -> str:
+        if not kwargs and self.allow_stale(entity):
+            stale = self._resolve_stale(entity)
+            if stale is not None:
+                return stale
+        deadline = self.deadline_for(entity, deadline)
+        with self.metrics.span('resolve_text', entity=entity.name):
+            try:
+                return self.cache.wrap(entity, func=self._resolve_text, ext='txt', deadline=deadline, **kwargs)
+            except DeadlineExceeded as ex:
+                log.warning(f"[SERVICE] {ex.message} - {entity.name}, using the fallback content")
+                return self._deadline_fallback(entity, ex)
+
+    def deadline_for(self, entity: LunchEntity, deadline: Deadline = None) -> Deadline:
+        """Deadline for the entity resolution - the entity budget (or the default one)
+        limited by the deadline of the caller
+        """
+        budget = entity.timeout if entity.timeout is not None else self.config.resolve_timeout
+        return deadline.within(budget) if deadline is not None else Deadline(budget)
+
+    def allow_stale(self, entity: LunchEntity) -> bool:
+        if self.cache.disabled:
+            return False
+        return entity.stale if entity.stale is not None else self.config.stale_while_revalidate
+
+    def _resolve_stale(self, entity: LunchEntity) -> Optional[str]:
+        """Returns today's cached content or the stale one - then the content is refreshed in the background,
+        None if there is nothing to serve
+        """
+        cached = self.cache.get_entity(entity, ext='txt')
+        if cached:
+            return cached
+        stale = self.cache.get_stale(entity, max_age=self.config.stale_days)
+        if stale is None:
+            return None
+        log.info(f"[SERVICE] Serving the stale content of {entity.name} from {stale.day}")
+        if not self.blacklist.is_blacklisted(entity):
+            self.refresher.schedule(entity)
+        return stale
+
+    def refresh(self, entity: LunchEntity) -> Optional[str]:
+        """Resolves the content of the entity bypassing the stale content
+        """
+        deadline = self.deadline_for(entity)
+        with self.metrics.span('refresh', entity=entity.name):
+            try:
+                return self.cache.wrap(entity, func=self._resolve_text, ext='txt', deadline=deadline)
+            except DeadlineExceeded as ex:
+                log.warning(f"[SERVICE] Refresh of {entity.name} failed: {ex.message}")
+                return None
+
+    def _deadline_fallback(self, entity: LunchEntity, ex: DeadlineExceeded) -> str:
+        if self.cache.enabled:
+            stale = self.cache.get_stale(entity, max_age=self.config.stale_days)
+            if stale is not None:
+                return stale
+        # The fallback content is not cached, next request tries to resolve the menu again
+        config = ResolverConfig(config=entity.view, entity=entity, content=None)
+        link = NoopResolver(service=self, config=config).resolve_text()
+        if ex.partial:
+            return f"{link}\n\n{ex.partial}".strip()
+        return link
 
     def _resolve(self, entity, **kwargs):
         if entity.disabled:
@@ -1066,21 +1714,75 @@ class LunchService:
 
     def _get_resolver(self, entity) -> AbstractResolver:
         resolver = self.resolvers.for_entity(entity)
-        log.debug(f"[RESOLVER] Using the resolver for {entity.name}: {resolver.__name__}")
-        config = ResolverConfig(config=entity.config, entity=entity, content=None)
+        log.debug("[RESOLVER] Using the resolver for %s: %s", entity.name, resolver.__name__)
+        config = ResolverConfig(config=entity.view, entity=entity, content=None)
 
         return resolver(service=self, config=config)
 
-    def _apply_filters(self, entity: 'LunchEntity', content: str, **kwargs):
+    def _apply_filters(self, entity: 'LunchEntity', content: str, deadline: Deadline = None, **kwargs):
         filters = self.filters.for_entity(entity)
+        if kwargs.get('full') and DayResolveFilter in filters:
+            log.info("[FILTER] Skip the 'day' filter since full content expected.")
+            filters = [flt for flt in filters if flt != DayResolveFilter]
+        return self._run_filters(entity, content, filters, deadline=deadline)
+
+    def _run_filters(self, entity: 'LunchEntity', content: str, filters: List[type], deadline: Deadline = None):
         for flt in filters:
-            if flt == DayResolveFilter and kwargs.get('full'):
-                log.info("[FILTER] Skip the 'day' filter since full content expected.")
-                continue
-            log.debug(f"[FILTER] Using the text filter: {flt.__name__}")
-            content = flt(self, entity).filter(content)
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded(f"{entity.name}:filter:{flt.__name__}", partial=content)
+            log.debug("[FILTER] Using the text filter: %s", flt.__name__)
+            with self.metrics.span(f"filter:{flt.__name__}", entity=entity.name):
+                content = flt(self, entity).filter(content)
         return content
 
+    def resolve_week(self, entity: LunchEntity, deadline: Deadline = None) -> Optional[Mapping[str, Any]]:
+        """Menu of the whole week - the sections of the days (0 - Monday) and the content without the day filter.
+        The content is resolved and split once, the week is cached for the day.
+        """
+        deadline = self.deadline_for(entity, deadline)
+        with self.metrics.span('resolve_week', entity=entity.name):
+            try:
+                content = self.cache.wrap(entity, func=self._resolve_week, ext='json', suffix='week',
+                                          deadline=deadline)
+            except DeadlineExceeded as ex:
+                log.warning(f"[SERVICE] {ex.message} - {entity.name}, no week content")
+                return None
+        if not content:
+            return None
+        week = json.loads(content)
+        return dict(content=week['content'], days={int(day): text for (day, text) in week['days'].items()})
+
+    def resolve_day(self, entity: LunchEntity, day: int, deadline: Deadline = None) -> Optional[str]:
+        """Menu for the day of the week (0 - Monday) - the content without the day filter
+        if the day is not found in the menu
+        """
+        week = self.resolve_week(entity, deadline=deadline)
+        if week is None:
+            return None
+        return week['days'].get(day) or week['content']
+
+    def _resolve_week(self, entity: LunchEntity, deadline: Deadline = None, **kwargs) -> Optional[str]:
+        if entity.disabled:
+            return None
+
+        content = self._get_resolver(entity).resolve_text(deadline=deadline, **kwargs)
+        if not content:
+            log.warning(f"[SERVICE] No content for {entity.name}")
+            return None
+
+        # The filters before the day filter are applied once, the ones after it to each day
+        filters = self.filters.for_entity(entity)
+        pos = filters.index(DayResolveFilter) if DayResolveFilter in filters else len(filters)
+        content = self._run_filters(entity, content, filters[:pos], deadline=deadline)
+        days = DayResolveFilter(self, entity).split_week(content) if pos < len(filters) else {}
+        after = filters[pos + 1:]
+        week = dict(
+            content=(self._run_filters(entity, content, after, deadline=deadline) or '').strip(),
+            days={day: (self._run_filters(entity, text, after, deadline=deadline) or '').strip()
+                  for (day, text) in days.items()},
+        )
+        return json.dumps(week) if week['content'] else None
+
 
 class EntityBlacklist:
     def __init__(self, service: LunchService):
@@ -1168,6 +1870,71 @@ class EntityBlacklist:
         self.save(blacklist)
 
 
+class StaleContent(str):
+    """Content cached on an earlier day - served while the current content is being refreshed
+    """
+    day: str = None
+
+    def __new__(cls, content: str, day: str):
+        instance = super().__new__(cls, content)
+        instance.day = day
+        return instance
+
+
+class LunchRefresher:
+    """Refreshes the entities content in the background - one worker thread,
+    the entity is scheduled at most once until its refresh is done, the most popular entities are refreshed first
+    """
+
+    def __init__(self, service: 'LunchService'):
+        self._service = service
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._seq = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def service(self) -> 'LunchService':
+        return self._service
+
+    @property
+    def pending(self) -> FrozenSet[str]:
+        with self._lock:
+            return frozenset(self._pending)
+
+    def schedule(self, entity: LunchEntity) -> bool:
+        with self._lock:
+            if entity.name in self._pending:
+                return False
+            self._pending.add(entity.name)
+            self._seq += 1
+            seq = self._seq
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='pylunch-refresh', daemon=True)
+                self._thread.start()
+        score = self.service.popularity.score(entity.name)
+        log.info(f"[REFRESH] Scheduled refresh of {entity.name} (popularity {score:.2f})")
+        self._queue.put((-score, seq, entity))
+        return True
+
+    def join(self):
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            (_, _, entity) = self._queue.get()
+            try:
+                content = self.service.refresh(entity)
+                log.info(f"[REFRESH] Refreshed {entity.name}: {'ok' if content else 'no content'}")
+            except Exception as ex:
+                log.error(f"[REFRESH] Refresh of {entity.name} failed: {ex}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._pending.discard(entity.name)
+                self._queue.task_done()
+
+
 class LunchCache:
     def __init__(self, service: 'LunchService'):
         self.service = service
@@ -1197,7 +1964,7 @@ class LunchCache:
         if content is None:
             log.warning(f"[CACHE] No content provided - not saving: {path}")
 
-        log.info(f"[CACHE] Writing content to cache: {path}")
+        log.info("[CACHE] Writing content to cache: %s", path)
         fp: Path = self._cache_path(path)
         self._create_dir(fp.parent)
         fp.write_text(str(content), encoding='utf-8')
@@ -1262,20 +2029,38 @@ class LunchCache:
         return self.for_day(day) / f'{file_name}.{ext}'
 
     def store_entity(self, entity: LunchEntity, content: str, suffix=None, day=None, ext='txt'):
-        fragment = self.create_fragment(entity, day=day, suffix=None, ext=ext)
-        self.save(fragment, content)
+        fragment = self.create_fragment(entity, day=day, suffix=suffix, ext=ext)
+        with self.service.metrics.span('cache_write', entity=entity.name, resolver=suffix):
+            self.save(fragment, content)
 
     def get_entity(self, entity: LunchEntity, day=None, suffix=None, ext='txt'):
         if self.disabled:
             log.info("[CACHE] Cache is not enabled.")
             return None
         fragment = self.create_fragment(entity, day=day, suffix=suffix, ext=ext)
-        log.info(f"[CACHE] Cache for entity {entity.name}: {fragment}")
-        content = self.get(fragment)
+        log.info("[CACHE] Cache for entity %s: %s", entity.name, fragment)
+        with self.service.metrics.span('cache_read', entity=entity.name, resolver=suffix):
+            content = self.get(fragment)
         if not content:
-            log.debug(f"[CACHE] No content for {entity.name} - {fragment}")
+            log.debug("[CACHE] No content for %s - %s", entity.name, fragment)
         return content if content else None
 
+    def get_stale(self, entity: LunchEntity, max_age: int = 7, suffix=None, ext='txt') -> Optional[StaleContent]:
+        """Finds the most recent content cached before today, at most max_age days old
+        """
+        if self.disabled:
+            return None
+        today = datetime.date.today()
+        for age in range(1, max_age + 1):
+            day = (today - datetime.timedelta(days=age)).strftime('%Y-%m-%d')
+            fp = self.cache_base / self.create_fragment(entity, day=day, suffix=suffix, ext=ext)
+            if fp.exists():
+                content = fp.read_text(encoding='utf-8')
+                if content:
+                    log.debug(f"[CACHE] Stale content for {entity.name} found: {fp}")
+                    return StaleContent(content, day=day)
+        return None
+
     def paths_for_entity(self, entity: LunchEntity, day=None, relative=False):
         if self.disabled:
             log.info("[CACHE] Cache is not enabled.")
@@ -1306,6 +2091,10 @@ class LunchCache:
             for file in files:
                 result.append(str(file))
                 file.unlink()
+        # The downloaded pages of the restaurants, so they are fetched again
+        urls = [inst.url for inst in instances if inst.url]
+        urls += [step['url'] for inst in instances for step in (inst.resolvers or ()) if step.get('url')]
+        result.extend(self.service.fetcher.clear(urls, day=day))
         return result
 
     def wrap(self, entity: LunchEntity, func, day=None, ext=None, suffix=None, **kwargs) -> str:
@@ -1321,14 +2110,14 @@ class LunchCache:
             self.store_entity(entity, content=content, ext=ext, suffix=suffix)
         return content
 
-    def _execute_func(self, entity: LunchEntity, func, **kwargs):
+    def _execute_func(self, entity: LunchEntity, func, blacklist: bool = True, **kwargs):
         metadata = self.service.blacklist.get(entity)
         if metadata and self.service.blacklist.metadata_blacklisted(metadata):
             log.debug(
                 f"[CACHE] Entity {entity.name} is blaclisted until {datetime.datetime.fromtimestamp(metadata['timestamp'])}.")
             return None
         result = func(entity=entity, **kwargs)
-        if not result:
+        if not result and blacklist:
             log.info(f"[CACHE] Blaclisting {entity.name} for 15 minutes.")
             self.service.blacklist.blacklist(entity)
         return result
@@ -1344,38 +2133,29 @@ class LunchCache:
 
 
 class LunchLoggerFactory:
+    """Entity loggers - adapters of the module logger tagging the records with the entity name,
+    the records of the entities are written by one queue-backed handler to the ``entities.log``
+    """
+
     def __init__(self, cache: 'LunchCache'):
         self._cache = cache
         self._loggers = {}
-
-    def get_logger(self, name: str) -> logging.Logger:
-        if name in self._loggers:
-            return self._loggers[name]
-        logger = self.create_logger(name)
-        self._loggers[name] = logger
+        config = cache.service.config
+        if cache.enabled and config.entity_log:
+            log_config.entity_log(cache.cache_base / 'entities.log', entities=config.log_entities)
+
+    def get_logger(self, name: str) -> logging.LoggerAdapter:
+        logger = self._loggers.get(name)
+        if logger is None:
+            logger = log_config.EntityAdapter(log, dict(entity=name))
+            self._loggers[name] = logger
         return logger
 
-    def create_logger(self, name:str) -> logging.Logger:
-        logger = logging.getLogger(f"_ent_{name}")
-        formatter = logging.Formatter('%(levelname)s %(asctime)s - %(module)s: %(message)s')
-        if self._cache.enabled:
-            fd = self._cache.cache_path(f"{name}.log")
-            handler = logging.FileHandler(str(fd))
-        else:
-            handler = logging.StreamHandler()
-
-        handler.setLevel(logging.DEBUG)
 
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        logger.setLevel(logging.DEBUG)
-        return logger
+def to_text(content, engine: str = None):
+    return text_engine.to_text(content, engine=engine)
 
 
-def to_text(content):
-    h = html2text.HTML2Text()
-    h.ignore_links = True
-    h.ignore_images = True
-    h.ignore_tables = True
-    h.ignore_emphasis = True
-    return h.handle(str(content)).strip()
+def parse_html(content: bytes):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(content, "lxml")
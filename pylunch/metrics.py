@@ -0,0 +1,117 @@
+import contextlib
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Iterator, Sequence
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_NAME = 'pylunch_stage_duration_seconds'
+
+# (stage, entity, resolver)
+SpanKey = Tuple[str, str, str]
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for (idx, bound) in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+                break
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        result = []
+        total = 0
+        for (bound, count) in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """In-process timing metrics - durations of the resolve stages (fetch, parse, filters, ...)
+    aggregated into histograms keyed by the stage, entity and resolver.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms: Dict[SpanKey, Histogram] = {}
+
+    @contextlib.contextmanager
+    def span(self, stage: str, entity: str = None, resolver: str = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, entity=entity, resolver=resolver)
+
+    def observe(self, stage: str, duration: float, entity: str = None, resolver: str = None):
+        key = (stage, entity or '', resolver or '')
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(self._buckets)
+                self._histograms[key] = histogram
+            histogram.observe(duration)
+        log.debug("[METRICS] %s (%s, %s): %.4fs", stage, entity, resolver, duration)
+
+    def histograms(self) -> Dict[SpanKey, Histogram]:
+        with self._lock:
+            return dict(self._histograms)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def summary(self, entity: Optional[str] = None) -> List[dict]:
+        rows = []
+        for ((stage, ent, resolver), hist) in sorted(self.histograms().items()):
+            if entity is not None and ent != entity:
+                continue
+            rows.append(dict(stage=stage, entity=ent, resolver=resolver, count=hist.count,
+                             total=hist.sum, mean=hist.mean))
+        return rows
+
+    def to_text(self) -> str:
+        rows = self.summary()
+        if not rows:
+            return "No timings recorded"
+        lines = [f"{'ENTITY':<20} {'RESOLVER':<24} {'STAGE':<28} {'COUNT':>6} {'TOTAL ms':>10} {'MEAN ms':>10}"]
+        for row in sorted(rows, key=lambda x: x['total'], reverse=True):
+            lines.append(f"{row['entity']:<20} {row['resolver']:<24} {row['stage']:<28} {row['count']:>6} "
+                         f"{row['total'] * 1000:>10.1f} {row['mean'] * 1000:>10.1f}")
+        return "\n".join(lines)
+
+    def to_prometheus(self) -> str:
+        lines = [
+            f"# HELP {METRIC_NAME} Duration of the resolve stages per entity and resolver",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        for ((stage, entity, resolver), hist) in sorted(self.histograms().items()):
+            labels = f'stage="{_escape(stage)}",entity="{_escape(entity)}",resolver="{_escape(resolver)}"'
+            for (bound, count) in hist.cumulative():
+                lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{METRIC_NAME}_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f'{METRIC_NAME}_sum{{{labels}}} {hist.sum}')
+            lines.append(f'{METRIC_NAME}_count{{{labels}}} {hist.count}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,275 @@
+"""OCR engines of the image resolvers
+
+The ``tesserocr`` engine keeps the pool of the resident tesseract instances (the C++ API through the tesserocr
+binding) per language, so the traineddata are loaded once and the images are recognized in the process,
+the recognition releases the GIL, so the instances of the pool work in parallel. The ``pytesseract`` engine
+runs the tesseract process for each image - it is used when tesserocr is not installed.
+
+The large images (weekly menu scans) are split to the horizontal bands - cut at the blank rows between
+the text lines, or overlapping when there are none - the bands are recognized in parallel and the text
+is stitched back in the reading order.
+"""
+import atexit
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Mapping, Type, Dict, List, Tuple, Optional, Callable, Sequence
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ENGINE = 'tesserocr'
+DEFAULT_LANG = 'eng'
+POOL_SIZE = 2
+BAND_HEIGHT = 800
+BAND_OVERLAP = 40
+# The image is split only when it is higher than the bands by this factor
+MIN_TILED_RATIO = 1.5
+
+Band = Tuple[int, int]
+
+
+class OcrTimeout(RuntimeError):
+    pass
+
+
+class OcrEngine:
+    name: str = None
+
+    def image_to_string(self, image: 'Image.Image', lang: str = None, timeout: float = None) -> str:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PytesseractEngine(OcrEngine):
+    """The tesseract process per image (writes the image to the temp file and loads the traineddata each time)
+    """
+    name = 'pytesseract'
+
+    def __init__(self, pool_size: int = None):
+        import pytesseract
+        self._pytesseract = pytesseract
+
+    def image_to_string(self, image: 'Image.Image', lang: str = None, timeout: float = None) -> str:
+        # Tesseract process is killed after the timeout, zero means no timeout
+        timeout = max(timeout, 0.01) if timeout is not None else 0
+        return self._pytesseract.image_to_string(image, lang=lang or DEFAULT_LANG, timeout=timeout)
+
+
+class TesserocrEngine(OcrEngine):
+    """Pools of the resident tesseract API instances per language - an instance is used by one thread at a time
+    """
+    name = 'tesserocr'
+
+    def __init__(self, pool_size: int = None):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.pool_size = pool_size or POOL_SIZE
+        self._lock = threading.Lock()
+        self._pools: Dict[str, queue.LifoQueue] = {}
+        self._created: Dict[str, int] = {}
+        self._apis: List['tesserocr.PyTessBaseAPI'] = []
+        self._pid = os.getpid()
+        atexit.register(self.close)
+
+    def _acquire(self, lang: str, timeout: float = None) -> Tuple['tesserocr.PyTessBaseAPI', queue.LifoQueue]:
+        with self._lock:
+            if self._pid != os.getpid():
+                # The instances of the parent process are not shared with the forked worker
+                self._pools, self._created, self._apis = {}, {}, []
+                self._pid = os.getpid()
+            pool = self._pools.setdefault(lang, queue.LifoQueue())
+            try:
+                return pool.get_nowait(), pool
+            except queue.Empty:
+                create = self._created.get(lang, 0) < self.pool_size
+                if create:
+                    self._created[lang] = self._created.get(lang, 0) + 1
+        if create:
+            log.info(f"[OCR] Loading the tesseract instance for {lang}")
+            try:
+                api = self._tesserocr.PyTessBaseAPI(lang=lang)
+            except Exception:
+                with self._lock:
+                    self._created[lang] -= 1
+                raise
+            with self._lock:
+                self._apis.append(api)
+            return api, pool
+        try:
+            return pool.get(timeout=timeout), pool
+        except queue.Empty:
+            raise OcrTimeout(f"No tesseract instance for {lang} available in {timeout}s")
+
+    def image_to_string(self, image: 'Image.Image', lang: str = None, timeout: float = None) -> str:
+        lang = lang or DEFAULT_LANG
+        (api, pool) = self._acquire(lang, timeout=timeout)
+        try:
+            api.SetImage(image)
+            # The recognition is cancelled after the timeout (milliseconds), zero means no timeout
+            if not api.Recognize(timeout=int(max(timeout, 0.01) * 1000) if timeout is not None else 0):
+                raise OcrTimeout(f"Tesseract recognition exceeded {timeout}s")
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+            pool.put(api)
+
+    def close(self):
+        with self._lock:
+            (apis, self._apis) = (self._apis, [])
+            self._pools, self._created = {}, {}
+        for api in apis:
+            api.End()
+
+
+ENGINES: Mapping[str, Type[OcrEngine]] = {
+    TesserocrEngine.name: TesserocrEngine,
+    PytesseractEngine.name: PytesseractEngine,
+}
+
+_engines = {}
+_lock = threading.Lock()
+
+
+def get_engine(name: str = None, pool_size: int = None) -> OcrEngine:
+    """Engine instance by the name, the pytesseract engine if the engine is not available
+    """
+    name = name or DEFAULT_ENGINE
+    with _lock:
+        engine = _engines.get(name)
+        if engine is not None:
+            return engine
+        try:
+            engine = ENGINES[name](pool_size=pool_size)
+        except (KeyError, ImportError) as ex:
+            log.warning(f"[OCR] OCR engine {name} is not available ({ex}), using pytesseract")
+            engine = _engines.get(PytesseractEngine.name) or PytesseractEngine()
+            _engines[PytesseractEngine.name] = engine
+        _engines[name] = engine
+        return engine
+
+
+def image_to_string(image: 'Image.Image', lang: str = None, timeout: float = None, engine: str = None,
+                    pool_size: int = None) -> str:
+    return get_engine(engine, pool_size=pool_size).image_to_string(image, lang=lang, timeout=timeout)
+
+
+def blank_rows(image: 'Image.Image') -> List[bool]:
+    """Rows of the image without any ink (darker than the middle of the image brightness range)
+    """
+    from PIL import Image
+    gray = image.convert('L')
+    (low, high) = gray.getextrema()
+    cutoff = (low + high) // 2
+    # The mean of the binarized row is 255 only if there is no dark pixel in it
+    means = gray.point(lambda px: 255 if px > cutoff else 0).convert('F').resize((1, gray.height), Image.BOX)
+    return [value > 254.99 for value in means.getdata()]
+
+
+def split_bands(image: 'Image.Image', band_height: int = BAND_HEIGHT, overlap: int = BAND_OVERLAP) -> List[Band]:
+    """Horizontal bands (top, bottom) of the image - cut in the middle of the blank rows closest to the band
+    boundaries, when there are no blank rows near the boundary the bands overlap
+    """
+    height = image.height
+    if height <= band_height * MIN_TILED_RATIO:
+        return [(0, height)]
+    blank = blank_rows(image)
+    window = band_height // 4
+    bands = []
+    top = 0
+    while height - top > band_height * MIN_TILED_RATIO:
+        target = top + band_height
+        cut = _blank_cut(blank, target - window, target + window, target)
+        if cut is not None:
+            bands.append((top, cut))
+            top = cut
+        else:
+            bands.append((top, min(height, target + overlap // 2)))
+            top = target - overlap // 2
+    bands.append((top, height))
+    return bands
+
+
+def _blank_cut(blank: List[bool], start: int, end: int, target: int) -> Optional[int]:
+    """Middle of the blank rows run closest to the target row in the window
+    """
+    best = None
+    row = max(0, start)
+    end = min(len(blank), end)
+    while row < end:
+        if not blank[row]:
+            row += 1
+            continue
+        run = row
+        while row < len(blank) and blank[row]:
+            row += 1
+        middle = (run + row) // 2
+        if best is None or abs(middle - target) < abs(best - target):
+            best = middle
+    return best
+
+
+def stitch(texts: Sequence[str], overlapping: Sequence[bool] = None) -> str:
+    """Joins the texts of the bands - the lines repeated by the overlapping bands are dropped
+    """
+    lines: List[str] = []
+    for (idx, text) in enumerate(texts):
+        band_lines = text.rstrip().splitlines()
+        if idx and overlapping is not None and overlapping[idx - 1]:
+            band_lines = band_lines[_repeated(lines, band_lines):]
+        lines.extend(band_lines)
+    return "\n".join(lines) + "\n" if lines else ''
+
+
+def _repeated(previous: List[str], lines: List[str], max_lines: int = 3) -> int:
+    """Number of the leading lines which repeat the trailing lines of the previous band
+    """
+    tail = [line.strip() for line in previous[-max_lines:] if line.strip()]
+    count = 0
+    for line in lines[:max_lines + 2]:
+        if line.strip() and line.strip() not in tail:
+            break
+        count += 1
+    return count
+
+
+def image_to_string_tiled(image: 'Image.Image', lang: str = None, timeout: float = None, engine: str = None,
+                          pool_size: int = None, workers: int = None, band_height: int = BAND_HEIGHT,
+                          overlap: int = BAND_OVERLAP, stop: Callable[[str], bool] = None) -> str:
+    """Recognizes the bands of the image in parallel and stitches the text in the reading order.
+    The ``stop`` is called with the text recognized so far (in the reading order), when it returns true
+    the remaining bands are not recognized.
+    """
+    bands = split_bands(image, band_height=band_height, overlap=overlap)
+    workers = workers or pool_size or POOL_SIZE
+    if len(bands) == 1 or (workers == 1 and stop is None):
+        return image_to_string(image, lang=lang, timeout=timeout, engine=engine, pool_size=pool_size)
+    log.debug(f"[OCR] Recognizing {len(bands)} bands by {workers} workers: {bands}")
+    ocr_engine = get_engine(engine, pool_size=pool_size)
+    overlapping = [bands[idx][1] > bands[idx + 1][0] for idx in range(len(bands) - 1)]
+    end = time.monotonic() + timeout if timeout is not None else None
+
+    def recognize(band: Band) -> str:
+        remaining = max(end - time.monotonic(), 0.01) if end is not None else None
+        return ocr_engine.image_to_string(image.crop((0, band[0], image.width, band[1])), lang=lang,
+                                          timeout=remaining)
+
+    texts = []
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(bands)),
+                                                     thread_name_prefix='pylunch-ocr')
+    futures = [executor.submit(recognize, band) for band in bands]
+    try:
+        for future in futures:
+            texts.append(future.result())
+            if stop is not None and len(texts) < len(bands) and stop(stitch(texts, overlapping)):
+                log.debug(f"[OCR] Stopped after {len(texts)} of {len(bands)} bands")
+                break
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+    return stitch(texts, overlapping)
@@ -0,0 +1,245 @@
+"""PDF text extraction engines of the PDF resolver
+
+ - ``pdfminer`` - the pure-Python extractor (the default dependency)
+ - ``pdfium`` - the PDFium library (pypdfium2)
+ - ``pymupdf`` - the MuPDF library (PyMuPDF)
+ - ``pdftotext`` - the poppler ``pdftotext`` tool
+
+The text of each page is followed by the form feed, the same as pdfminer writes it, so the day/cut filters
+work the same for all the engines. The ``auto`` engine is selected by the benchmark (``select_engine``) - the fastest
+engine with the output similar enough to the pdfminer output. The benchmark runs once per process on the bundled
+sample document (not on the extracted one) - when the server is preloaded (``LunchService.warm_up``, the workers
+inherit the selection) or on the first extraction otherwise.
+"""
+import io
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Mapping, Type, List, Callable, Tuple
+
+log = logging.getLogger(__name__)
+
+AUTO = 'auto'
+REFERENCE_ENGINE = 'pdfminer'
+# Minimal similarity of the output to the pdfminer output for the automatically selected engine
+MIN_SIMILARITY = 0.9
+# The document of the benchmark of the automatic selection
+SAMPLE = Path(__file__).parent / 'resources' / 'sample.pdf'
+PAGE_BREAK = '\x0c'
+
+# Called with the text extracted so far before each page - raises to stop the extraction
+PageCheck = Callable[[str], None]
+
+
+class PdfEngine:
+    name: str = None
+
+    def extract_pages(self, data: bytes, check: PageCheck = None, timeout: float = None) -> List[str]:
+        raise NotImplementedError
+
+    def extract(self, data: bytes, check: PageCheck = None, timeout: float = None) -> str:
+        return "".join(page + PAGE_BREAK for page in self.extract_pages(data, check=check, timeout=timeout))
+
+
+def _check(check: Optional[PageCheck], pages: List[str]):
+    if check is not None:
+        check("".join(page + PAGE_BREAK for page in pages))
+
+
+class PdfminerEngine(PdfEngine):
+    name = 'pdfminer'
+
+    def __init__(self):
+        import pdfminer.layout
+        self._layout = pdfminer.layout
+
+    def extract_pages(self, data: bytes, check: PageCheck = None, timeout: float = None) -> List[str]:
+        from pdfminer.converter import TextConverter
+        from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+        from pdfminer.pdfpage import PDFPage
+
+        # Same as the pdfminer's extract_text_to_fp, page by page
+        out = io.StringIO()
+        rsrcmgr = PDFResourceManager()
+        device = TextConverter(rsrcmgr, out, laparams=self._layout.LAParams())
+        pages = []
+        try:
+            interpreter = PDFPageInterpreter(rsrcmgr, device)
+            for page in PDFPage.get_pages(io.BytesIO(data)):
+                _check(check, pages)
+                interpreter.process_page(page)
+                pages.append(out.getvalue().rstrip(PAGE_BREAK))
+                out.seek(0)
+                out.truncate()
+        finally:
+            device.close()
+        return pages
+
+
+class PdfiumEngine(PdfEngine):
+    name = 'pdfium'
+
+    def __init__(self):
+        import pypdfium2
+        self._pdfium = pypdfium2
+
+    def extract_pages(self, data: bytes, check: PageCheck = None, timeout: float = None) -> List[str]:
+        document = self._pdfium.PdfDocument(data)
+        pages = []
+        try:
+            for idx in range(len(document)):
+                _check(check, pages)
+                page = document[idx]
+                textpage = page.get_textpage()
+                pages.append(textpage.get_text_range().replace('\r\n', '\n'))
+                textpage.close()
+                page.close()
+        finally:
+            document.close()
+        return pages
+
+
+class PymupdfEngine(PdfEngine):
+    name = 'pymupdf'
+
+    def __init__(self):
+        import fitz
+        self._fitz = fitz
+
+    def extract_pages(self, data: bytes, check: PageCheck = None, timeout: float = None) -> List[str]:
+        pages = []
+        with self._fitz.open(stream=data, filetype='pdf') as document:
+            for page in document:
+                _check(check, pages)
+                pages.append(page.get_text('text', sort=True))
+        return pages
+
+
+class PdftotextEngine(PdfEngine):
+    """The poppler tool - the whole document is extracted at once, the process is killed after the timeout
+    """
+    name = 'pdftotext'
+
+    def __init__(self):
+        self._executable = shutil.which('pdftotext')
+        if self._executable is None:
+            raise ImportError("pdftotext executable not found")
+
+    def extract_pages(self, data: bytes, check: PageCheck = None, timeout: float = None) -> List[str]:
+        import subprocess
+        _check(check, [])
+        with tempfile.TemporaryDirectory(prefix='pylunch-pdf') as tmp:
+            file = Path(tmp) / 'document.pdf'
+            file.write_bytes(data)
+            result = subprocess.run([self._executable, '-enc', 'UTF-8', str(file), '-'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, timeout=timeout, check=True)
+        pages = result.stdout.decode('utf-8', errors='replace').split(PAGE_BREAK)
+        # The text of the last page is followed by the form feed as well
+        return pages[:-1] if len(pages) > 1 and not pages[-1].strip() else pages
+
+
+ENGINES: Mapping[str, Type[PdfEngine]] = {
+    PdfminerEngine.name: PdfminerEngine,
+    PdfiumEngine.name: PdfiumEngine,
+    PymupdfEngine.name: PymupdfEngine,
+    PdftotextEngine.name: PdftotextEngine,
+}
+
+_engines = {}
+_lock = threading.Lock()
+_selected: Optional[str] = None
+# The concurrent first extractions wait for one selection
+_select_lock = threading.Lock()
+
+
+def available_engines() -> List[str]:
+    return [name for name in ENGINES if get_engine(name, fallback=False) is not None]
+
+
+def get_engine(name: str = None, fallback: bool = True) -> Optional[PdfEngine]:
+    """Engine instance by the name, the pdfminer engine (or None without the fallback) if it is not available
+    """
+    name = name or REFERENCE_ENGINE
+    with _lock:
+        if name not in _engines:
+            try:
+                _engines[name] = ENGINES[name]()
+            except (KeyError, ImportError) as ex:
+                log.warning(f"[PDF] PDF engine {name} is not available ({ex})")
+                _engines[name] = None
+        engine = _engines[name]
+    if engine is None and fallback:
+        return get_engine(REFERENCE_ENGINE, fallback=False)
+    return engine
+
+
+def normalize(text: str) -> List[str]:
+    return text.split()
+
+
+def similarity(text: str, reference: str) -> float:
+    """Similarity of the texts words (1.0 for the same words in the same order)
+    """
+    import difflib
+    (words, ref_words) = (normalize(text), normalize(reference))
+    if not words and not ref_words:
+        return 1.0
+    return difflib.SequenceMatcher(None, words, ref_words, autojunk=False).ratio()
+
+
+def benchmark(data: bytes, engines: List[str] = None) -> List[Tuple[str, float, float]]:
+    """Extracts the document by the engines - (name, duration, similarity to the pdfminer output)
+    """
+    results = []
+    reference = None
+    for name in [REFERENCE_ENGINE] + [name for name in (engines or available_engines()) if name != REFERENCE_ENGINE]:
+        engine = get_engine(name, fallback=False)
+        if engine is None:
+            continue
+        start = time.perf_counter()
+        try:
+            text = engine.extract(data)
+        except Exception as ex:
+            log.warning(f"[PDF] Engine {name} failed to extract the document: {ex}")
+            continue
+        duration = time.perf_counter() - start
+        if reference is None:
+            reference = text
+        results.append((name, duration, similarity(text, reference)))
+    return results
+
+
+def select_engine(data: bytes = None) -> str:
+    """The fastest engine with the output similar to the pdfminer output on the document (the sample document
+    by default) - selected once per process, the forked workers inherit the selection of the master
+    """
+    global _selected
+    if _selected is not None:
+        return _selected
+    if available_engines() == [REFERENCE_ENGINE]:
+        _selected = REFERENCE_ENGINE
+        return _selected
+    results = benchmark(data if data is not None else SAMPLE.read_bytes())
+    candidates = sorted((duration, name) for (name, duration, ratio) in results if ratio >= MIN_SIMILARITY)
+    selected = candidates[0][1] if candidates else REFERENCE_ENGINE
+    log.info(f"[PDF] Selected the PDF engine {selected}: {results}")
+    _selected = selected
+    return selected
+
+
+def selected_engine() -> str:
+    """The automatically selected engine - selected on the sample document by the first call
+    """
+    if _selected is not None:
+        return _selected
+    with _select_lock:
+        return select_engine()
+
+
+def extract_text(data: bytes, engine: str = None, check: PageCheck = None, timeout: float = None) -> str:
+    if engine == AUTO:
+        engine = selected_engine()
+    return get_engine(engine).extract(data, check=check, timeout=timeout)
@@ -0,0 +1,132 @@
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Tuple, Optional, List, Iterable, TypeVar
+
+from pylunch import utils
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HALF_LIFE = 72 * 3600
+SAVE_INTERVAL = 30
+# The counters decayed below the score are dropped when saved
+PRUNE_SCORE = 0.01
+
+T = TypeVar('T')
+Counter = Tuple[float, float]
+
+
+def _decayed(counter: Counter, now: float, half_life: float) -> float:
+    (score, ts) = counter
+    return score * math.pow(0.5, max(0.0, now - ts) / half_life)
+
+
+class Popularity:
+    """Decaying request counter of the entities - the score of an entity is the number
+    of its requests, halved every half-life.
+
+    The counters are shared by the processes through the file - each process keeps the hits
+    since the last save and adds them to the counters in the file (under the file lock).
+    The counters decayed below ``prune_score`` are removed from the file.
+    """
+
+    def __init__(self, path: Optional[Path] = None, half_life: float = DEFAULT_HALF_LIFE,
+                 save_interval: float = SAVE_INTERVAL, prune_score: float = PRUNE_SCORE):
+        self.path = Path(path) if path is not None else None
+        self.half_life = half_life
+        self.save_interval = save_interval
+        self.prune_score = prune_score
+        self._lock = threading.Lock()
+        self._saved: Dict[str, Counter] = {}
+        self._pending: Dict[str, Counter] = {}
+        self._last_save = time.time()
+        if self.path is not None:
+            self._saved = self._read()
+            atexit.register(self.save)
+
+    def after_fork(self):
+        """The forked process starts with the new lock and without the hits of the parent
+        """
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def hit(self, name: str, weight: float = 1.0, now: float = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            counter = self._pending.get(name)
+            score = _decayed(counter, now, self.half_life) if counter is not None else 0.0
+            self._pending[name] = (score + weight, now)
+            save = self.path is not None and now - self._last_save >= self.save_interval
+        if save:
+            self.save()
+
+    def score(self, name: str, now: float = None) -> float:
+        now = time.time() if now is None else now
+        with self._lock:
+            return sum(_decayed(counters[name], now, self.half_life)
+                       for counters in (self._saved, self._pending) if name in counters)
+
+    def ranking(self, now: float = None) -> List[Tuple[str, float]]:
+        now = time.time() if now is None else now
+        with self._lock:
+            names = set(self._saved) | set(self._pending)
+        scores = [(name, self.score(name, now=now)) for name in names]
+        return sorted(scores, key=lambda item: (-item[1], item[0]))
+
+    def rank(self, items: Iterable[T], key=lambda item: item.name) -> List[T]:
+        """Orders the items (entities) by the score - the most popular first, the stable order otherwise
+        """
+        now = time.time()
+        return sorted(items, key=lambda item: -self.score(key(item), now=now))
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._last_save = time.time()
+        if not pending:
+            return
+        now = time.time()
+        try:
+            with utils.FileLock(self.path.with_suffix('.lock')):
+                saved = self._read()
+                for (name, counter) in pending.items():
+                    score = _decayed(counter, now, self.half_life)
+                    if name in saved:
+                        score += _decayed(saved[name], now, self.half_life)
+                    saved[name] = (score, now)
+                saved = {name: counter for (name, counter) in saved.items()
+                         if _decayed(counter, now, self.half_life) >= self.prune_score}
+                tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                tmp.write_text(json.dumps({name: list(counter) for (name, counter) in saved.items()}),
+                               encoding='utf-8')
+                os.replace(str(tmp), str(self.path))
+        except OSError as ex:
+            log.warning(f"[POPULARITY] Unable to save the counters to {self.path}: {ex}")
+            with self._lock:
+                for (name, counter) in pending.items():
+                    current = self._pending.get(name)
+                    score = _decayed(counter, now, self.half_life)
+                    if current is not None:
+                        score += _decayed(current, now, self.half_life)
+                    self._pending[name] = (score, now)
+            return
+        with self._lock:
+            self._saved = saved
+
+    def _read(self) -> Dict[str, Counter]:
+        if self.path is None or not self.path.exists():
+            return {}
+        try:
+            content = json.loads(self.path.read_text(encoding='utf-8'))
+            return {name: (float(score), float(ts)) for (name, (score, ts)) in content.items()}
+        except (OSError, ValueError, TypeError) as ex:
+            log.warning(f"[POPULARITY] Unable to read the counters from {self.path}: {ex}")
+            return {}
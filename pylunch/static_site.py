@@ -0,0 +1,272 @@
+"""Static site of the daily menus - the pages and the API payloads of the server rendered to the files,
+so they are served by nginx without the application:
+
+ - ``index.html`` and ``restaurants/<name>.html``
+ - ``api/restaurants.json``, ``api/tags.json``, ``api/restaurants/<name>.json``
+   and ``api/restaurants/<name>/menu.json``
+ - ``static/`` - the assets of the pages
+
+The site of each day is built to its own directory (``<root>/<YYYY-MM-DD>``, nginx selects the directory
+by the current date), so the menus of the previous day are never served - the directories of the previous days
+are removed by the build. The build is incremental - ``manifest.json`` of the day keeps the digest of the content
+of each restaurant and only the restaurants with a changed menu (or config) are rendered again. The restaurants
+without today's menu (not resolved, fallback or stale content) are not written, their requests are left
+to the server.
+
+The menu page (``/menu``) is not built - it records the visitor and sets the visitor cookie, so it is always
+served by the application. The requests of the restaurant pages and menus served by nginx are counted
+to the popularity from the nginx access log (see ``count_hits``) when the site is built.
+"""
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import urllib.parse
+from pathlib import Path
+from typing import List, Mapping, Optional, Any, Tuple
+
+import flask
+
+from pylunch import lunch, utils, web, __version__
+from pylunch.throttle import interleave_hosts
+
+log = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+ACCESS_LOG_STATE = 'access-log.json'
+DAY_DIR = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# The requests counted by the server to the popularity of the restaurant (the ``pylunch_static`` log format)
+ACCESS_LOG_LINE = re.compile(r'^(?P<ts>\d+(?:\.\d+)?) (?P<status>\d{3}) GET (?P<uri>\S+)$')
+ACCESS_LOG_URIS = [re.compile(r'^/restaurants/(?P<name>[^/]+)$'),
+                   re.compile(r'^/api/restaurants/(?P<name>[^/]+)/menu$')]
+
+
+class BuildReport:
+    def __init__(self):
+        self.written: List[str] = []
+        self.removed: List[str] = []
+        self.unchanged: List[str] = []
+        self.failed: List[str] = []
+
+    def to_dict(self) -> Mapping[str, List[str]]:
+        return dict(written=self.written, removed=self.removed, unchanged=self.unchanged, failed=self.failed)
+
+
+class StaticSite:
+    def __init__(self, service: lunch.LunchService, root: Path, workers: int = 4):
+        self.service = service
+        self.root = Path(root).absolute()
+        self.workers = workers
+        self.context = web.PageContext()
+        self.day = datetime.date.today()
+
+    @property
+    def site_dir(self) -> Path:
+        """Directory of the site of the day
+        """
+        return self.root / self.day.isoformat()
+
+    @property
+    def manifest_file(self) -> Path:
+        return self.site_dir / MANIFEST
+
+    def load_manifest(self) -> Mapping[str, Any]:
+        if not self.manifest_file.exists():
+            return dict(restaurants={}, files=[])
+        try:
+            manifest = json.loads(self.manifest_file.read_text(encoding='utf-8'))
+        except ValueError as ex:
+            log.warning(f"[STATIC] Invalid manifest {self.manifest_file}, building the whole site: {ex}")
+            return dict(restaurants={}, files=[])
+        if manifest.get('day') != self.day.isoformat():
+            log.warning(f"[STATIC] Manifest {self.manifest_file} of another day, building the whole site")
+            return dict(restaurants={}, files=[])
+        return manifest
+
+    def build(self, force: bool = False) -> BuildReport:
+        """Resolves the enabled restaurants and renders the changed pages and payloads
+        """
+        report = BuildReport()
+        self.day = datetime.date.today()
+        previous = dict(restaurants={}, files=[]) if force else self.load_manifest()
+        instances = [instance for instance in self.service.instances.all() if not instance.disabled]
+        menus = self.resolve(instances)
+        manifest = dict(version=__version__, day=self.day.isoformat(),
+                        built=datetime.datetime.now().isoformat(), restaurants={}, files=[])
+
+        with web.app.test_request_context('/'):
+            analytics = self.context.analytics()
+            manifest['site'] = self._site_digest(analytics)
+            site_changed = manifest['site'] != previous.get('site')
+            manifest['files'] = self._build_site(previous if not site_changed else None, report)
+            for instance in instances:
+                content = menus.get(instance.name)
+                if not self._is_final(instance, content):
+                    log.info(f"[STATIC] No menu of {instance.name} for today, left to the server")
+                    report.failed.append(instance.name)
+                    continue
+                digest = _digest(instance.config, content, manifest['site'])
+                built = previous['restaurants'].get(instance.name)
+                if built and built['digest'] == digest and self._exist(built['files']):
+                    manifest['restaurants'][instance.name] = built
+                    report.unchanged.append(instance.name)
+                    continue
+                files = self._build_restaurant(instance, content, report)
+                manifest['restaurants'][instance.name] = dict(digest=digest, files=files)
+
+        self._remove_outdated(previous, manifest, report)
+        self._write(MANIFEST, json.dumps(manifest, indent=2))
+        self._remove_previous_days()
+        return report
+
+    def count_hits(self, log_file: Path) -> int:
+        """Counts the requests of the restaurants served by nginx (its access log) to the popularity
+
+        Only the lines appended since the last call are read - the offset is kept in the site directory
+        and the log is read from the start again when it was rotated.
+        """
+        log_file = Path(log_file)
+        if not log_file.exists():
+            log.warning(f"[STATIC] Access log {log_file} does not exist")
+            return 0
+        state_file = self.root / ACCESS_LOG_STATE
+        state = json.loads(state_file.read_text(encoding='utf-8')) if state_file.exists() else {}
+        stat = log_file.stat()
+        offset = state.get('offset', 0)
+        if state.get('inode') != stat.st_ino or stat.st_size < offset:
+            offset = 0
+        with log_file.open('rb') as fp:
+            fp.seek(offset)
+            data = fp.read()
+        # The line being written by nginx is read next time
+        data = data[:data.rfind(b'\n') + 1]
+        hits = 0
+        for line in data.decode('utf-8', errors='replace').splitlines():
+            hit = _access_log_hit(line)
+            if hit is None or hit[0] not in self.service.instances.entities:
+                continue
+            (name, ts) = hit
+            self.service.popularity.hit(name, now=min(ts, time.time()))
+            hits += 1
+        self.service.popularity.save()
+        state = dict(inode=stat.st_ino, offset=offset + len(data))
+        self._write(ACCESS_LOG_STATE, json.dumps(state), root=self.root)
+        log.info(f"[STATIC] Counted {hits} requests from {log_file}")
+        return hits
+
+    def resolve(self, instances: List[lunch.LunchEntity]) -> Mapping[str, Optional[str]]:
+        # The workers are spread over the hosts, the throttled host does not occupy all of them
+        instances = interleave_hosts(instances, url=lambda instance: instance.url)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [(instance, executor.submit(self.service.resolve_text, instance)) for instance in instances]
+            result = {}
+            for (instance, future) in futures:
+                try:
+                    result[instance.name] = future.result()
+                except Exception as ex:
+                    log.warning(f"[STATIC] Unable to resolve {instance.name}: {ex}")
+                    result[instance.name] = None
+            return result
+
+    def _is_final(self, instance: lunch.LunchEntity, content: Optional[str]) -> bool:
+        if not content or isinstance(content, lunch.StaleContent):
+            return False
+        # The deadline fallback (the link to the restaurant page) is not cached - it is not today's menu
+        return self.service.cache.disabled or self.service.cache.get_entity(instance, ext='txt') is not None
+
+    def _site_digest(self, analytics: Optional[str]) -> str:
+        configs = {instance.name: instance.config for instance in self.service.instances.all()}
+        assets = [(name, file.stat().st_size, file.stat().st_mtime) for (name, file) in _static_files()]
+        return _digest(__version__, analytics, configs, assets)
+
+    def _build_site(self, previous: Optional[Mapping[str, Any]], report: BuildReport) -> List[str]:
+        files = ['index.html', 'api/restaurants.json', 'api/tags.json']
+        assets = [f"static/{name}" for (name, _) in _static_files()]
+        if previous is not None and self._exist(files + assets):
+            return files + assets
+        context = self.context.get(self.service)
+        self._write('index.html', flask.render_template('index.html', **context), report)
+        restaurants = {item.name: item.config for item in self.service.instances.all() if item}
+        self._write('api/restaurants.json', _json(restaurants), report)
+        self._write('api/tags.json', _json(self.service.instances.all_tags()), report)
+        for (name, file) in _static_files():
+            self._write(f"static/{name}", file.read_bytes(), report)
+        return files + assets
+
+    def _build_restaurant(self, instance: lunch.LunchEntity, content: str, report: BuildReport) -> List[str]:
+        files = [f"restaurants/{instance.name}.html", f"api/restaurants/{instance.name}.json",
+                 f"api/restaurants/{instance.name}/menu.json"]
+        context = self.context.get(self.service, entity=instance, menu=content)
+        self._write(files[0], flask.render_template('restaurant.html', **context), report)
+        self._write(files[1], _json(instance.config), report)
+        self._write(files[2], _json(web.menu_json(instance, content)), report)
+        return files
+
+    def _remove_outdated(self, previous: Mapping[str, Any], manifest: Mapping[str, Any], report: BuildReport):
+        current = set(_manifest_files(manifest))
+        for name in _manifest_files(previous):
+            path = self.site_dir / name
+            if name not in current and path.exists():
+                path.unlink()
+                report.removed.append(name)
+
+    def _remove_previous_days(self):
+        for path in self.root.iterdir():
+            if path.is_dir() and DAY_DIR.match(path.name) and path.name < self.day.isoformat():
+                log.info(f"[STATIC] Removing the site of the previous day: {path}")
+                shutil.rmtree(str(path), ignore_errors=True)
+
+    def _exist(self, files: List[str]) -> bool:
+        return all((self.site_dir / name).exists() for name in files)
+
+    def _write(self, name: str, content, report: BuildReport = None, root: Path = None):
+        root = root if root is not None else self.site_dir
+        path = root / name
+        if not utils.is_forward_path(root, path):
+            raise ValueError(f"Path outside of the site directory: {name}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        # Written atomically - nginx never serves a partially written file
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(str(tmp), str(path))
+        if report is not None:
+            report.written.append(name)
+
+
+def _json(payload: Any) -> str:
+    # The same serialization as the API responses of the server (flask.jsonify)
+    return flask.json.dumps(payload) + "\n"
+
+
+def _digest(*values) -> str:
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _static_files() -> List[Tuple[str, Path]]:
+    base = Path(web.static_dir)
+    return [(file.relative_to(base).as_posix(), file) for file in sorted(base.glob('**/*')) if file.is_file()]
+
+
+def _access_log_hit(line: str) -> Optional[Tuple[str, float]]:
+    match = ACCESS_LOG_LINE.match(line.strip())
+    if match is None or match.group('status') not in ('200', '304'):
+        return None
+    for pattern in ACCESS_LOG_URIS:
+        uri = pattern.match(match.group('uri'))
+        if uri is not None:
+            return urllib.parse.unquote(uri.group('name')), float(match.group('ts'))
+    return None
+
+
+def _manifest_files(manifest: Mapping[str, Any]) -> List[str]:
+    files = list(manifest.get('files', []))
+    for built in manifest.get('restaurants', {}).values():
+        files.extend(built['files'])
+    return files
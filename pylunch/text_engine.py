@@ -0,0 +1,492 @@
+"""HTML to text conversion engines
+
+The ``lxml`` engine walks the element tree parsed by lxml and emits the text the same way as html2text
+does with the links, images, tables and emphasis ignored (the converter used by the resolvers), the ``html2text``
+engine is the pure-Python converter - it is used when lxml is not available or the content cannot be parsed.
+The converted text is memoized by the content hash, so the raw HTML cache hits are not converted again.
+
+lxml resolves the entity references while parsing, but html2text treats them on their own - an entity is replaced
+by its ``html2text.config.UNIFIABLE`` text (``&copy;`` is ``(C)``), it is not escaped and it splits the text
+around it to the separately escaped parts. So the references are marked in the content before it is parsed
+and the marked parts of the text are written the same way.
+
+The engines convert the HTML string - the selected fragment is what the resolvers cache (the cache hits have
+only the string), and the selection is done by BeautifulSoup (soupsieve selectors) whose tags cannot be walked
+by lxml. The fragment is parsed once per content thanks to the memo, ``LxmlTextEngine.element_to_text``
+converts an already parsed lxml element without the serialization.
+"""
+import collections
+import hashlib
+import html.entities
+import logging
+import re
+import textwrap
+import threading
+from typing import List, Mapping, Type
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ENGINE = 'lxml'
+MEMO_SIZE = 256
+
+# Markdown escapes of html2text (html2text.config)
+RE_MD_DOT = re.compile(r"^(\s*\d+)(\.)(?=\s)", re.MULTILINE)
+RE_MD_PLUS = re.compile(r"^(\s*)(\+)(?=\s)", re.MULTILINE)
+RE_MD_DASH = re.compile(r"^(\s*)(-)(?=\s|\-)", re.MULTILINE)
+RE_MD_BACKSLASH = re.compile(r"(\\)(?=[\\`*_{}\[\]()#+\-.!])")
+RE_MD_LINE = re.compile(r"^\s*(\d|\+|-)", re.MULTILINE)
+RE_LINK = re.compile(r"(\[.*?\] ?\(.*?\))|(\[.*?\]:.*?)")
+RE_TABLE = re.compile(r" \| ")
+RE_ORDERED_LIST = re.compile(r"\d+\.\s")
+RE_UNORDERED_LIST = re.compile(r"[-\*\+]\s")
+RE_SPACE = re.compile(r"\s\+")
+RE_WHITESPACE = re.compile(r"\s+")
+
+# References split by the html2text parser (html.parser.HTMLParser with convert_charrefs=False) - the character
+# and entity references, the ampersands and the less-than signs not starting a tag or a comment
+RE_REFERENCE = re.compile(r"&#(?:([0-9]+)|[xX]([0-9a-fA-F]+))(?![0-9a-fA-F]);?"
+                          r"|&([a-zA-Z][-.a-zA-Z0-9]*);?|&|<(?![a-zA-Z/!?])")
+# The marked reference in the parsed text (the private use characters)
+MARK_START = '\ue000'
+MARK_END = '\ue001'
+RE_MARK = re.compile(f"{MARK_START}([^{MARK_END}]*){MARK_END}")
+# html2text writes the &nbsp; entities as the placeholder - it is replaced by the space before the text is wrapped
+NBSP_PLACEHOLDER = '&nbsp_place_holder;'
+
+BODY_WIDTH = 78
+# Whitespace other than the space - wrapped by textwrap
+RE_WRAP_SPACE = re.compile(r"[^\S ]")
+RE_CHUNK = re.compile(r" +|[^ ]+")
+HEADINGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+
+
+class TextEngine:
+    name: str = None
+
+    def to_text(self, content: str) -> str:
+        raise NotImplementedError
+
+
+class Html2TextEngine(TextEngine):
+    """The html2text converter - the converter keeps the state of the parsed document,
+    so a new instance is created for each conversion (it is cheap, the conversion is not)
+    """
+    name = 'html2text'
+
+    def to_text(self, content: str) -> str:
+        import html2text
+        h = html2text.HTML2Text()
+        h.ignore_links = True
+        h.ignore_images = True
+        h.ignore_tables = True
+        h.ignore_emphasis = True
+        return h.handle(content).strip()
+
+
+class _TextWriter:
+    """Output state of the html2text converter (html2text.HTML2Text.o and friends)
+    for the links, images, tables and emphasis ignored
+    """
+
+    def __init__(self):
+        self.out: List[str] = []
+        self.last_nl = False
+        self.quiet = 0
+        self.p_p = 0
+        self.start = True
+        self.space = False
+        self.br_toggle = ''
+        self.blockquote = 0
+        self.pre = False
+        self.startpre = False
+        self.pre_indent = ''
+        self.code = False
+        self.quote = False
+        self.list: List[list] = []
+        self.list_code_indent = ''
+        self.last_was_list = False
+
+    def _out(self, text: str):
+        self.out.append(text)
+        if text:
+            self.last_nl = text[-1] == '\n'
+
+    def p(self):
+        self.p_p = 2
+
+    def pbr(self):
+        if self.p_p == 0:
+            self.p_p = 1
+
+    def soft_br(self):
+        self.pbr()
+        self.br_toggle = '  '
+
+    def o(self, data: str, puredata: bool = False, force=False):
+        if self.quiet:
+            return
+        if puredata and not self.pre:
+            data = RE_WHITESPACE.sub(' ', data)
+            if data and data[0] == ' ':
+                self.space = True
+                data = data[1:]
+        if not data and not force:
+            return
+        if self.startpre and not data.startswith('\n') and not data.startswith('\r\n'):
+            data = '\n' + data
+        bq = '>' * self.blockquote
+        if not (force and data and data[0] == '>') and self.blockquote:
+            bq += ' '
+        if self.pre:
+            if self.list:
+                bq += self.list_code_indent
+            bq += '    '
+            data = data.replace('\n', '\n' + bq)
+            self.pre_indent = bq
+        if self.startpre:
+            self.startpre = False
+            if self.list:
+                data = data.lstrip('\n' + self.pre_indent)
+        if self.start:
+            self.space = False
+            self.p_p = 0
+            self.start = False
+        if force == 'end':
+            self.p_p = 0
+            self._out('\n')
+            self.space = False
+        if self.p_p:
+            self._out((self.br_toggle + '\n' + bq) * self.p_p)
+            self.space = False
+            self.br_toggle = ''
+        if self.space:
+            if not self.last_nl:
+                self._out(' ')
+            self.space = False
+        self.p_p = 0
+        self._out(data)
+
+    def data(self, data: str):
+        if not data:
+            return
+        if MARK_START not in data:
+            self._data(data)
+            return
+        # The parts between the references are handled separately, the references are not escaped
+        for (i, part) in enumerate(RE_MARK.split(data)):
+            if i % 2 == 0:
+                self._data(part)
+            elif part:
+                self.o(part, puredata=True)
+
+    def _data(self, data: str):
+        if not data:
+            return
+        if not self.code and not self.pre:
+            if not data.strip():
+                # Most of the data between the tags - only a space separates the next text
+                if not self.quiet:
+                    self.space = True
+                return
+            if '\\' in data:
+                data = RE_MD_BACKSLASH.sub(r"\\\1", data)
+            if RE_MD_LINE.search(data):
+                data = RE_MD_DOT.sub(r"\1\\\2", data)
+                data = RE_MD_PLUS.sub(r"\1\\\2", data)
+                data = RE_MD_DASH.sub(r"\1\\\2", data)
+        self.o(data, puredata=True)
+
+    def tag(self, tag: str, attrs: Mapping[str, str], start: bool):
+        if tag in HEADINGS:
+            self.p()
+            if not start:
+                return
+            self.o('#' * HEADINGS[tag] + ' ')
+        if tag in ('p', 'div'):
+            self.p()
+        if tag == 'br' and start:
+            self.o('  \n> ' if self.blockquote > 0 else '  \n')
+        if tag == 'hr' and start:
+            self.p()
+            self.o('* * *')
+            self.p()
+        if tag in ('head', 'style', 'script'):
+            self.quiet += 1 if start else -1
+        if tag == 'body':
+            self.quiet = 0
+        if tag == 'blockquote':
+            if start:
+                self.p()
+                self.o('> ', force=True)
+                self.start = True
+                self.blockquote += 1
+            else:
+                self.blockquote -= 1
+                self.p()
+        if tag in ('del', 'strike', 's'):
+            self.o('~~')
+        if tag in ('kbd', 'code', 'tt') and not self.pre:
+            self.o('`')
+            self.code = not self.code
+        if tag == 'q':
+            self.o('"')
+            self.quote = not self.quote
+        if tag == 'dl' and start:
+            self.p()
+        if tag in ('dt', 'dd') and not start:
+            self.pbr()
+        if tag == 'dd' and start:
+            self.o('    ')
+        if tag in ('ol', 'ul'):
+            if not self.list and not self.last_was_list:
+                self.p()
+            if start:
+                self.list.append([tag, _list_start(attrs)])
+            elif self.list:
+                self.list.pop()
+                if not self.list:
+                    self.o('\n')
+            self.last_was_list = True
+        else:
+            self.last_was_list = False
+        if tag == 'li':
+            self.list_code_indent = ''
+            self.pbr()
+            if start:
+                item = self.list[-1] if self.list else ['ul', 0]
+                parent = None
+                for (name, _) in self.list:
+                    self.list_code_indent += '   ' if parent == 'ol' else '  '
+                    parent = name
+                self.o(self.list_code_indent)
+                if item[0] == 'ul':
+                    self.o('* ')
+                else:
+                    item[1] += 1
+                    self.o(f"{item[1]}. ")
+                self.start = True
+        if tag == 'tr' and not start:
+            self.soft_br()
+        if tag == 'pre':
+            if start:
+                self.startpre = True
+                self.pre = True
+                self.pre_indent = ''
+            else:
+                self.pre = False
+            self.p()
+
+    def finish(self) -> str:
+        self.pbr()
+        self.o('', force='end')
+        return _optwrap(''.join(self.out).replace(NBSP_PLACEHOLDER, ' '))
+
+
+def _list_start(attrs: Mapping[str, str]) -> int:
+    try:
+        return int(attrs.get('start')) - 1
+    except (TypeError, ValueError):
+        return 0
+
+
+def _skipwrap(para: str) -> bool:
+    if RE_LINK.search(para):
+        return True
+    if para[0:4] == '    ' or para[0] == '\t':
+        return True
+    stripped = para.lstrip()
+    if stripped[0:2] == '--' and len(stripped) > 2 and stripped[2] != '-':
+        return False
+    if stripped[0:1] in ('-', '*') and not stripped[0:2] == '**':
+        return True
+    if RE_TABLE.search(para):
+        return True
+    return bool(RE_ORDERED_LIST.match(stripped) or RE_UNORDERED_LIST.match(stripped))
+
+
+def _wrap(para: str, indent: str) -> List[str]:
+    """textwrap.wrap(para, BODY_WIDTH, break_long_words=False, subsequent_indent=indent) - the paragraphs
+    without the hyphens and special whitespace are wrapped at the spaces directly
+    """
+    if '-' in para or RE_WRAP_SPACE.search(para):
+        return textwrap.wrap(para, BODY_WIDTH, break_long_words=False, subsequent_indent=indent)
+    if len(para) <= BODY_WIDTH:
+        # Nothing to wrap, only the trailing spaces are dropped
+        line = para.rstrip(' ')
+        return [line] if line.strip() else []
+    chunks = RE_CHUNK.findall(para)
+    chunks.reverse()
+    lines = []
+    while chunks:
+        line_indent = indent if lines else ''
+        width = BODY_WIDTH - len(line_indent)
+        if lines and not chunks[-1].strip():
+            del chunks[-1]
+        (line, length) = ([], 0)
+        while chunks and length + len(chunks[-1]) <= width:
+            length += len(chunks[-1])
+            line.append(chunks.pop())
+        if chunks and not line and len(chunks[-1]) > width:
+            line.append(chunks.pop())
+        if line and not line[-1].strip():
+            del line[-1]
+        if line:
+            lines.append(line_indent + ''.join(line))
+    return lines
+
+
+def _optwrap(text: str) -> str:
+    """Wraps the paragraphs (html2text.HTML2Text.optwrap)
+    """
+    result = []
+    newlines = 0
+    for para in text.split('\n'):
+        if para:
+            if not _skipwrap(para):
+                indent = ''
+                if para.startswith('  *'):
+                    indent = '    '
+                elif para.startswith('> '):
+                    indent = '> '
+                result.append('\n'.join(_wrap(para, indent)))
+                if para.endswith('  '):
+                    result.append('  \n')
+                    newlines = 1
+                elif indent:
+                    result.append('\n')
+                    newlines = 1
+                else:
+                    result.append('\n\n')
+                    newlines = 2
+            elif not RE_SPACE.match(para):
+                result.append(para + '\n')
+                newlines = 1
+        elif newlines < 2:
+            result.append('\n')
+            newlines += 1
+    return ''.join(result)
+
+
+class LxmlTextEngine(TextEngine):
+    """Converts the element tree parsed by lxml (the parser is reused per thread)
+    """
+    name = 'lxml'
+
+    def __init__(self):
+        import lxml.html
+        from html2text import config, utils
+        self._local = threading.local()
+        self._unifiable: Mapping[str, str] = dict(config.UNIFIABLE, nbsp=NBSP_PLACEHOLDER)
+        self._unifiable_n: Mapping[int, str] = utils.unifiable_n
+        self._control_characters: Mapping[int, int] = utils.control_character_replacements
+
+    @property
+    def parser(self):
+        parser = getattr(self._local, 'parser', None)
+        if parser is None:
+            import lxml.html
+            parser = lxml.html.HTMLParser(remove_comments=True, remove_pis=True)
+            self._local.parser = parser
+        return parser
+
+    def to_text(self, content: str) -> str:
+        """Parses the HTML fragment (serialized selection of the resolver) and walks its tree
+        """
+        import lxml.html
+        if not content or not content.strip():
+            return ''
+        root = lxml.html.document_fromstring(RE_REFERENCE.sub(self._mark_reference, content), parser=self.parser)
+        return self.element_to_text(root)
+
+    def element_to_text(self, element) -> str:
+        """Converts the parsed element - its entity references are already resolved by lxml,
+        so they are not unified
+        """
+        writer = _TextWriter()
+        self._walk(writer, element)
+        return writer.finish().strip()
+
+    def _mark_reference(self, match) -> str:
+        """The reference replaced by its text the same way as html2text (HTML2Text.charref and entityref)
+        """
+        (decimal, hexadecimal, name) = match.groups()
+        if name is not None:
+            text = self._unifiable.get(name)
+            if text is None:
+                text = html.entities.html5.get(name + ';', '&' + name + ';')
+        elif decimal is not None or hexadecimal is not None:
+            code = int(decimal) if decimal is not None else int(hexadecimal, 16)
+            if not 0 < code < 0x110000 or 0xD800 <= code < 0xE000:
+                code = 0xFFFD
+            code = self._control_characters.get(code, code)
+            text = self._unifiable_n.get(code)
+            if text is None:
+                text = chr(code)
+        else:
+            text = match.group()
+        return MARK_START + html.escape(text, quote=False) + MARK_END
+
+    def _walk(self, writer: _TextWriter, element):
+        tag = element.tag
+        if not isinstance(tag, str):
+            # Comments, processing instructions and entities
+            writer.data(element.tail)
+            return
+        tag = tag.lower()
+        writer.tag(tag, element.attrib, start=True)
+        writer.data(element.text)
+        for child in element:
+            self._walk(writer, child)
+            writer.data(child.tail)
+        writer.tag(tag, element.attrib, start=False)
+
+
+ENGINES: Mapping[str, Type[TextEngine]] = {
+    LxmlTextEngine.name: LxmlTextEngine,
+    Html2TextEngine.name: Html2TextEngine,
+}
+
+_engines = {}
+_memo: 'collections.OrderedDict[tuple, str]' = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def get_engine(name: str = None) -> TextEngine:
+    """Engine instance by the name, the html2text engine if the engine is not available
+    """
+    name = name or DEFAULT_ENGINE
+    engine = _engines.get(name)
+    if engine is not None:
+        return engine
+    try:
+        engine = ENGINES[name]()
+    except (KeyError, ImportError) as ex:
+        log.warning(f"[TEXT] Text engine {name} is not available ({ex}), using html2text")
+        engine = Html2TextEngine()
+    _engines[name] = engine
+    return engine
+
+
+def to_text(content, engine: str = None) -> str:
+    """Converts the HTML content to the text, the result is memoized by the content hash
+    """
+    content = str(content)
+    engine = get_engine(engine)
+    key = (engine.name, hashlib.blake2b(content.encode('utf-8', errors='surrogatepass'), digest_size=16).digest())
+    with _lock:
+        text = _memo.get(key)
+        if text is not None:
+            _memo.move_to_end(key)
+            return text
+    try:
+        text = engine.to_text(content)
+    except Exception as ex:
+        if isinstance(engine, Html2TextEngine):
+            raise
+        log.warning(f"[TEXT] Unable to convert the content by {engine.name}: {ex}, using html2text")
+        text = get_engine(Html2TextEngine.name).to_text(content)
+    with _lock:
+        _memo[key] = text
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return text
@@ -0,0 +1,325 @@
+"""Per-host politeness of the fetches - each host has its token bucket (requests per second with a burst)
+and the limit of the requests in flight. The waiting requests of a host are served in the FIFO order,
+the hosts are independent, so a throttled host never holds the requests of the others.
+
+    hosts:
+      default:
+        max_in_flight: 4
+      www.menicka.cz:
+        rate: 1
+        burst: 2
+        max_in_flight: 1
+
+The host config applies to its subdomains as well, the ``default`` to the hosts not listed.
+
+With the state directory the budget of the host is shared by the processes (server workers, CLI) - a request
+holds one of the ``max_in_flight`` slot files of the host locked and the tokens of the bucket are kept
+in the state file of the host. The processes poll for the shared budget, the threads of a process still
+wait in the FIFO order.
+"""
+import collections
+import contextlib
+import json
+import logging
+import re
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Optional, Mapping, Any, Dict, Iterator, Iterable, List, TypeVar, Callable
+
+from pylunch.errors import DeadlineExceeded
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_IN_FLIGHT = 4
+
+T = TypeVar('T')
+
+
+class HostBusy(DeadlineExceeded):
+    """The slot of the host was not acquired in time - handled as the exceeded deadline (the stale content
+    or the fallback is served), so the throttled entity is neither cached nor blacklisted
+    """
+
+    def __init__(self, host: str, waited: float):
+        super().__init__(f"host {host} is busy, waited {waited:.2f}s")
+        self.host = host
+        self.waited = waited
+
+
+class HostLimits:
+    """Budget of the host - rate (requests per second, None is unlimited), burst and max requests in flight
+    """
+    __slots__ = ('rate', 'burst', 'max_in_flight')
+
+    def __init__(self, rate: float = None, burst: float = None, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.rate = float(rate) if rate else None
+        self.burst = max(1.0, float(burst)) if burst else max(1.0, self.rate or 1.0)
+        self.max_in_flight = int(max_in_flight) if max_in_flight else None
+
+    @classmethod
+    def from_config(cls, config: Optional[Mapping[str, Any]], default: 'HostLimits' = None) -> 'HostLimits':
+        base = default or cls()
+        config = config or {}
+        return cls(rate=config.get('rate', base.rate), burst=config.get('burst', base.burst if base.rate else None),
+                   max_in_flight=config.get('max_in_flight', base.max_in_flight))
+
+    def __repr__(self) -> str:
+        return f"HostLimits(rate={self.rate}, burst={self.burst}, max_in_flight={self.max_in_flight})"
+
+
+class HostThrottle:
+    def __init__(self, host: str, limits: HostLimits):
+        self.host = host
+        self.limits = limits
+        self._cond = threading.Condition()
+        self._tokens = limits.burst
+        self._refilled = time.monotonic()
+        self._in_flight = 0
+        self._waiters: 'collections.deque[object]' = collections.deque()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _refill(self, now: float):
+        if self.limits.rate is None:
+            return
+        self._tokens = min(self.limits.burst, self._tokens + (now - self._refilled) * self.limits.rate)
+        self._refilled = now
+
+    def _wait_time(self, now: float) -> Optional[float]:
+        """Time until the head of the queue can go - zero if it can go now, None if it waits for a release
+        """
+        if self.limits.max_in_flight is not None and self._in_flight >= self.limits.max_in_flight:
+            return None
+        if self.limits.rate is None:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self._tokens >= 1.0 else (1.0 - self._tokens) / self.limits.rate
+
+    def acquire(self, timeout: float = None) -> float:
+        """Waits for the request slot of the host, returns the waiting time
+        """
+        start = time.monotonic()
+        end = start + timeout if timeout is not None else None
+        ticket = object()
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(now) if self._waiters[0] is ticket else None
+                    if wait == 0.0:
+                        break
+                    if end is not None:
+                        if now >= end:
+                            raise HostBusy(self.host, now - start)
+                        wait = end - now if wait is None else min(wait, end - now)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(ticket)
+                # The next waiter may be able to go as well
+                self._cond.notify_all()
+            if self.limits.rate is not None:
+                self._tokens -= 1.0
+            self._in_flight += 1
+        return time.monotonic() - start
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+
+class SharedHostBudget:
+    """Budget of the host shared by the processes - the slot files (``<host>.<n>.slot``) locked by the requests
+    in flight and the token bucket in the state file (``<host>.bucket``), both under ``fcntl`` locks
+    """
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, state_dir: Path, host: str, limits: HostLimits):
+        self.state_dir = Path(state_dir)
+        self.host = host
+        self.limits = limits
+        self._name = re.sub(r'[^a-z0-9.-]', '_', host) or '_'
+
+    def acquire(self, timeout: float = None) -> Optional[Any]:
+        """Waits for a free slot and a token of the host, returns the held slot (the open locked file)
+        """
+        start = time.monotonic()
+        end = start + timeout if timeout is not None else None
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        slot = self._acquire_slot(start, end)
+        try:
+            self._take_token(start, end)
+        except BaseException:
+            self.release(slot)
+            raise
+        return slot
+
+    def release(self, slot: Optional[Any]):
+        if slot is not None:
+            fcntl.flock(slot.fileno(), fcntl.LOCK_UN)
+            slot.close()
+
+    def _sleep(self, start: float, end: Optional[float], wait: float = None):
+        now = time.monotonic()
+        if end is not None and now >= end:
+            raise HostBusy(self.host, now - start)
+        wait = self.POLL_INTERVAL if wait is None else max(wait, 0.001)
+        time.sleep(min(wait, end - now) if end is not None else wait)
+
+    def _acquire_slot(self, start: float, end: Optional[float]) -> Optional[Any]:
+        if self.limits.max_in_flight is None:
+            return None
+        while True:
+            for idx in range(self.limits.max_in_flight):
+                slot = (self.state_dir / f"{self._name}.{idx}.slot").open('a')
+                try:
+                    fcntl.flock(slot.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot
+                except OSError:
+                    slot.close()
+            self._sleep(start, end)
+
+    def _take_token(self, start: float, end: Optional[float]):
+        if self.limits.rate is None:
+            return
+        while True:
+            wait = self._try_token()
+            if wait == 0.0:
+                return
+            self._sleep(start, end, wait)
+
+    def _try_token(self) -> float:
+        """Takes the token if there is one (returns zero), otherwise returns the time until the next token
+        """
+        with (self.state_dir / f"{self._name}.bucket").open('a+') as fp:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            try:
+                fp.seek(0)
+                try:
+                    state = json.loads(fp.read() or '{}')
+                except ValueError:
+                    state = {}
+                now = time.time()
+                tokens = state.get('tokens', self.limits.burst)
+                tokens = min(self.limits.burst, tokens + (now - state.get('refilled', now)) * self.limits.rate)
+                wait = 0.0 if tokens >= 1.0 else (1.0 - tokens) / self.limits.rate
+                if wait == 0.0:
+                    tokens -= 1.0
+                fp.seek(0)
+                fp.truncate()
+                fp.write(json.dumps(dict(tokens=tokens, refilled=now)))
+                fp.flush()
+            finally:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+        return wait
+
+
+class HostScheduler:
+    def __init__(self, hosts: Mapping[str, Mapping[str, Any]] = None, metrics=None, state_dir: Path = None):
+        hosts = dict(hosts or {})
+        self.default = HostLimits.from_config(hosts.pop('default', None))
+        self.limits: Dict[str, HostLimits] = {host.lower().lstrip('.'): HostLimits.from_config(cfg, self.default)
+                                              for (host, cfg) in hosts.items()}
+        self.metrics = metrics
+        # The budgets are shared by the processes only where the file locks are available
+        self.state_dir = Path(state_dir) if state_dir is not None and fcntl is not None else None
+        self._lock = threading.Lock()
+        self._throttles: Dict[str, HostThrottle] = {}
+        self._shared: Dict[str, SharedHostBudget] = {}
+
+    def limits_for(self, host: str) -> HostLimits:
+        parts = host.split('.')
+        for idx in range(len(parts)):
+            limits = self.limits.get('.'.join(parts[idx:]))
+            if limits is not None:
+                return limits
+        return self.default
+
+    def throttle(self, url: str) -> HostThrottle:
+        host = host_of(url)
+        with self._lock:
+            throttle = self._throttles.get(host)
+            if throttle is None:
+                throttle = HostThrottle(host, self.limits_for(host))
+                self._throttles[host] = throttle
+            return throttle
+
+    def shared(self, throttle: HostThrottle) -> Optional[SharedHostBudget]:
+        if self.state_dir is None:
+            return None
+        with self._lock:
+            budget = self._shared.get(throttle.host)
+            if budget is None:
+                budget = SharedHostBudget(self.state_dir, throttle.host, throttle.limits)
+                self._shared[throttle.host] = budget
+            return budget
+
+    @contextlib.contextmanager
+    def slot(self, url: str, timeout: float = None, entity: str = None) -> Iterator[HostThrottle]:
+        """Holds the request slot of the URL's host for the request
+        """
+        throttle = self.throttle(url)
+        shared = self.shared(throttle)
+        start = time.monotonic()
+        try:
+            waited = throttle.acquire(timeout=timeout)
+        except HostBusy as ex:
+            self._observe(ex.waited, throttle.host, entity)
+            raise
+        held = None
+        if shared is not None:
+            try:
+                held = shared.acquire(timeout=max(0.0, timeout - waited) if timeout is not None else None)
+            except BaseException as ex:
+                throttle.release()
+                if isinstance(ex, HostBusy):
+                    self._observe(time.monotonic() - start, throttle.host, entity)
+                raise
+            waited = time.monotonic() - start
+        self._observe(waited, throttle.host, entity)
+        if waited > 0.01:
+            log.debug(f"[THROTTLE] Waited {waited:.3f}s for {throttle.host} ({entity})")
+        try:
+            yield throttle
+        finally:
+            if shared is not None:
+                shared.release(held)
+            throttle.release()
+
+    def _observe(self, waited: float, host: str, entity: str = None):
+        if self.metrics is not None:
+            self.metrics.observe('queue_wait', waited, entity=entity, resolver=host)
+
+
+def host_of(url: str) -> str:
+    return (urllib.parse.urlsplit(url).hostname or '').lower()
+
+
+def interleave_hosts(items: Iterable[T], url: Callable[[T], Optional[str]]) -> List[T]:
+    """Round-robin of the items over their hosts - keeps the order of the items of each host,
+    so the concurrent workers are spread over the hosts instead of queueing at one of them
+    """
+    queues: 'collections.OrderedDict[str, collections.deque]' = collections.OrderedDict()
+    for item in items:
+        queues.setdefault(host_of(url(item) or ''), collections.deque()).append(item)
+    result = []
+    while queues:
+        for host in list(queues):
+            result.append(queues[host].popleft())
+            if not queues[host]:
+                del queues[host]
+    return result
@@ -6,9 +6,20 @@ import yaml
 from typing import List, Optional, Mapping, Union, MutableMapping, Any
 import os.path
 import collections.abc
+import importlib
 
 log = logging.getLogger(__name__)
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from yaml import CSafeLoader as YamlSafeLoader, CSafeDumper as YamlSafeDumper
+except ImportError:
+    from yaml import SafeLoader as YamlSafeLoader, SafeDumper as YamlSafeDumper
+
 
 def load_yaml(file: Union[Path, str]) -> MutableMapping[str, Any]:
     file = Path(file)
@@ -17,7 +28,7 @@ def load_yaml(file: Union[Path, str]) -> MutableMapping[str, Any]:
         log.warning(f"[LOAD] Config file not exists: {file}")
         return {}
     with file.open("r") as fp:
-        return yaml.safe_load(fp)
+        return yaml.load(fp, Loader=YamlSafeLoader)
 
 
 def save_yaml(file: Union[Path, str], content: dict):
@@ -27,7 +38,7 @@ def save_yaml(file: Union[Path, str], content: dict):
         log.warning(f"[SAFE] Unnable to safe config file (directory not exists): {file}")
         return
     with file.open("w") as fp:
-        yaml.safe_dump(content, fp)
+        yaml.dump(content, fp, Dumper=YamlSafeDumper)
 
 
 def write_instances(instances, transform=None, writer=None):
@@ -109,6 +120,65 @@ def is_forward_path(root: AnyPath, path: AnyPath) -> bool:
         return False
 
 
+def import_object(path: str) -> Any:
+    """Imports an object by its path in the format ``package.module:attribute``
+    """
+    (module_name, _, attr) = path.partition(':')
+    module = importlib.import_module(module_name)
+    return getattr(module, attr) if attr else module
+
+
+class FileLock:
+    """Exclusive (or shared) lock of the file shared by the processes (server workers) - the lock is
+    not taken on the platforms without fcntl
+    """
+
+    def __init__(self, path: Union[Path, str], shared: bool = False):
+        self.path = Path(path)
+        self.shared = shared
+        self._fp = None
+
+    def __enter__(self) -> 'FileLock':
+        if not self.path.parent.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fp = self.path.open('a')
+        if fcntl is not None:
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+        self._fp.close()
+        self._fp = None
+
+
+def to_bool(value: Any) -> bool:
+    """Converts the config value (bool or string like "yes", "off") to bool
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ('y', 'yes', 't', 'true', 'on', '1')
+    return bool(value)
+
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def parse_weekday(value: Union[str, int, None]) -> Optional[int]:
+    """Converts the day of the week (number 0 - Monday, or the name like "mon", "friday") to the number,
+    raises ValueError for an invalid day
+    """
+    if value is None or value == '':
+        return None
+    text = str(value).strip().lower()
+    if text.isdigit() and int(text) < len(WEEKDAYS):
+        return int(text)
+    for (num, name) in enumerate(WEEKDAYS):
+        if len(text) >= 3 and name.startswith(text):
+            return num
+    raise ValueError(f"Invalid day of the week: {value}")
+
+
 def random_string(length: int =16, charset=None) -> str:
     if charset is None:
         charset = string.ascii_letters + string.digits
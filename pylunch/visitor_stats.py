@@ -0,0 +1,209 @@
+"""Visitor analytics - the visitor day files are ingested incrementally to the SQLite database
+and aggregated there (unique visitors per day, restaurants and tags queries, peak minutes).
+"""
+import contextlib
+import datetime
+import json
+import logging
+import re
+import sqlite3
+import urllib.parse
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, List, Mapping, Any
+
+log = logging.getLogger(__name__)
+
+DB_FILE = 'visitors.sqlite'
+BATCH_SIZE = 5000
+
+# Lines of the day_YYYY_MM_DD.log files written before the JSON lines format
+LEGACY_LINE = re.compile(r'^\w+ (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?:,\d+)?: id: (.*?); ip: (.*?); q: (.*?); ua: (.*)$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS visits (
+    ts INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    visitor TEXT,
+    ip TEXT,
+    query TEXT
+);
+CREATE INDEX IF NOT EXISTS visits_day ON visits(day);
+CREATE TABLE IF NOT EXISTS visit_targets (
+    ts INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS visit_targets_day ON visit_targets(day, kind);
+CREATE TABLE IF NOT EXISTS ingested (
+    file TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL
+);
+"""
+
+Record = Tuple[datetime.datetime, str, str, str]
+
+
+def parse_json_line(line: str) -> Optional[Record]:
+    item = json.loads(line)
+    return datetime.datetime.fromisoformat(item['ts']), item.get('id'), item.get('ip'), item.get('q') or ''
+
+
+def parse_legacy_line(line: str) -> Optional[Record]:
+    match = LEGACY_LINE.match(line)
+    if match is None:
+        return None
+    (ts, vid, ip, query, _) = match.groups()
+    return datetime.datetime.strptime(ts, '%Y-%m-%d %H:%M:%S'), vid, ip, query
+
+
+def query_targets(query: str) -> Iterator[Tuple[str, str]]:
+    """Restaurants (r) and tags (t) from the query string of the menu page
+    """
+    params = urllib.parse.parse_qs(query)
+    for kind in ('r', 't'):
+        for name in params.get(kind, ()):
+            if name:
+                yield kind, name
+
+
+class VisitorStats:
+    def __init__(self, root: Path, db_file: Path = None):
+        self.root = Path(root)
+        self.db_file = Path(db_file) if db_file is not None else self.root / DB_FILE
+
+    def connect(self) -> sqlite3.Connection:
+        if not self.db_file.parent.exists():
+            self.db_file.parent.mkdir(parents=True)
+        conn = sqlite3.connect(str(self.db_file))
+        conn.executescript(SCHEMA)
+        return conn
+
+    def ingest(self) -> int:
+        """Ingests the new records of the visitor files - each file is read from the position
+        where the previous ingest stopped
+        """
+        if not self.root.exists():
+            return 0
+        total = 0
+        # The connection context commits the transaction, it does not close the connection
+        with contextlib.closing(self.connect()) as conn, conn:
+            offsets = dict(conn.execute("SELECT file, offset FROM ingested"))
+            for file in sorted(self.root.glob('day_*.jsonl')):
+                total += self._ingest_file(conn, file, parse_json_line, offsets.get(file.name, 0))
+            for file in sorted(self.root.glob('day_*.log')):
+                total += self._ingest_file(conn, file, parse_legacy_line, offsets.get(file.name, 0),
+                                           legacy=True)
+        log.info(f"[VISITORS] Ingested {total} records to {self.db_file}")
+        return total
+
+    def _ingest_file(self, conn: sqlite3.Connection, file: Path, parser, offset: int, legacy: bool = False) -> int:
+        """Ingests the lines after the offset - each line is ingested once (the offset is stored
+        with the records in one transaction), the identical records are distinct visits
+        """
+        if file.stat().st_size <= offset:
+            return 0
+        count = 0
+        visits = []
+        targets = []
+        previous = None
+        with file.open('rb') as fp:
+            fp.seek(offset)
+            for raw in fp:
+                if not raw.endswith(b'\n'):
+                    # The line is still being written - ingested next time
+                    break
+                offset += len(raw)
+                line = raw.decode('utf-8', errors='replace').rstrip('\n')
+                if not line:
+                    continue
+                # The legacy files contain the line repeated right after itself by the duplicated handlers
+                # (the same millisecond timestamp), the JSON lines are written once
+                if legacy and line == previous:
+                    continue
+                previous = line
+                try:
+                    record = parser(line)
+                except (ValueError, KeyError) as ex:
+                    log.debug(f"[VISITORS] Invalid line in {file.name}: {ex}")
+                    record = None
+                if record is None:
+                    continue
+                (ts, vid, ip, query) = record
+                epoch = int(ts.timestamp())
+                (day, hour) = (ts.strftime('%Y-%m-%d'), ts.hour)
+                visits.append((epoch, day, hour, vid, ip, query))
+                targets.extend((epoch, day, hour, kind, name) for (kind, name) in query_targets(query))
+                count += 1
+                if len(visits) >= BATCH_SIZE:
+                    self._insert(conn, visits, targets)
+                    (visits, targets) = ([], [])
+        self._insert(conn, visits, targets)
+        conn.execute("INSERT OR REPLACE INTO ingested(file, offset) VALUES (?, ?)", (file.name, offset))
+        log.debug(f"[VISITORS] Ingested {count} records from {file.name}")
+        return count
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, visits: list, targets: list):
+        if visits:
+            conn.executemany("INSERT INTO visits(ts, day, hour, visitor, ip, query) VALUES (?, ?, ?, ?, ?, ?)",
+                             visits)
+        if targets:
+            conn.executemany("INSERT INTO visit_targets(ts, day, hour, kind, name) VALUES (?, ?, ?, ?, ?)",
+                             targets)
+
+    def stats(self, since: str = None, until: str = None, hours: Tuple[int, int] = None,
+              top: int = 20) -> Mapping[str, Any]:
+        """Aggregates the visits in the days range (YYYY-MM-DD, inclusive) and optionally in the hours range
+        """
+        where = ["day >= ?", "day <= ?"]
+        params: List[Any] = [since or '0000-00-00', until or '9999-99-99']
+        if hours is not None:
+            where.append("hour >= ? AND hour <= ?")
+            params.extend(hours)
+        cond = " AND ".join(where)
+        with contextlib.closing(self.connect()) as conn:
+            peak_minutes = dict(conn.execute(f"""
+                SELECT day, MAX(c) FROM (
+                    SELECT day, ts / 60 AS minute, COUNT(*) AS c FROM visits WHERE {cond} GROUP BY day, minute
+                ) GROUP BY day""", params))
+            days = [dict(day=day, visits=visits, visitors=visitors, peak_minute=peak_minutes.get(day, 0))
+                    for (day, visits, visitors) in conn.execute(f"""
+                SELECT day, COUNT(*), COUNT(DISTINCT visitor) FROM visits WHERE {cond}
+                GROUP BY day ORDER BY day""", params)]
+            peaks = [dict(minute=datetime.datetime.fromtimestamp(minute * 60).isoformat(timespec='minutes'),
+                          visits=count) for (minute, count) in conn.execute(f"""
+                SELECT ts / 60 AS minute, COUNT(*) AS c FROM visits WHERE {cond}
+                GROUP BY minute ORDER BY c DESC, minute LIMIT ?""", params + [top])]
+            result = dict(days=days, peaks=peaks)
+            for (kind, key) in (('r', 'restaurants'), ('t', 'tags')):
+                totals = {}
+                for (name, hour, count) in conn.execute(f"""
+                        SELECT name, hour, COUNT(*) FROM visit_targets WHERE kind = ? AND {cond}
+                        GROUP BY name, hour""", [kind] + params):
+                    item = totals.setdefault(name, dict(name=name, queries=0, peak_hour=hour, _peak=0))
+                    item['queries'] += count
+                    if count > item['_peak']:
+                        (item['peak_hour'], item['_peak']) = (hour, count)
+                ranked = sorted(totals.values(), key=lambda x: (-x['queries'], x['name']))[:top]
+                result[key] = [dict(name=x['name'], queries=x['queries'], peak_hour=x['peak_hour']) for x in ranked]
+        return result
+
+
+def stats_to_text(stats: Mapping[str, Any]) -> str:
+    lines = [f"{'DAY':<12} {'VISITS':>8} {'VISITORS':>9} {'PEAK/MIN':>9}"]
+    for item in stats['days']:
+        lines.append(f"{item['day']:<12} {item['visits']:>8} {item['visitors']:>9} {item['peak_minute']:>9}")
+    for (key, title) in (('restaurants', 'RESTAURANT'), ('tags', 'TAG')):
+        lines.append('')
+        lines.append(f"{title:<32} {'QUERIES':>8} {'PEAK HOUR':>10}")
+        for item in stats[key]:
+            hour = f"{item['peak_hour']:02d}:00" if item['peak_hour'] is not None else '-'
+            lines.append(f"{item['name']:<32} {item['queries']:>8} {hour:>10}")
+    lines.append('')
+    lines.append(f"{'PEAK MINUTE':<32} {'VISITS':>8}")
+    for item in stats['peaks']:
+        lines.append(f"{item['minute']:<32} {item['visits']:>8}")
+    return "\n".join(lines)
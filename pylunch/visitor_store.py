@@ -1,35 +1,178 @@
+import atexit
 import datetime
 import json
+import logging
+import os
+import queue
+import threading
 from pathlib import Path
+from typing import Optional, List, BinaryIO
 
-from pylunch import log_config
+log = logging.getLogger(__name__)
+
+VISITORS_FORMAT = 2
 
 
 class VisitorInfo:
-    def __init__(self, id: str, ua: str, ip: str, query: str = ""):
-        self.v = 1
+    __slots__ = ('id', 'ua', 'ip', 'query', 'ts')
+
+    def __init__(self, id: str, ua: str, ip: str, query: str = "", ts: datetime.datetime = None):
         self.id: str = id
         self.ua: str = ua
         self.ip: str = ip
         self.query: str = query or ''
+        self.ts: datetime.datetime = ts or datetime.datetime.now()
+
+    @property
+    def day(self) -> str:
+        return self.ts.strftime("%Y_%m_%d")
+
+    def to_dict(self) -> dict:
+        return dict(v=VISITORS_FORMAT, ts=self.ts.isoformat(timespec='seconds'), id=self.id, ip=self.ip,
+                    q=self.query, ua=self.ua)
 
     def dump_json(self) -> str:
-        return json.dumps(self.__dict__, indent=2)
+        return json.dumps(self.to_dict(), indent=2)
+
+    def dump_compact(self) -> str:
+        """One line record of the visitors file
+        """
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'))
 
     def dump(self) -> str:
         return f"id: {self.id}; ip: {self.ip}; q: {self.query}; ua: {self.ua}"
 
 
+class VisitorSink:
+    """Buffered writer of the visitor records - the records are queued by the request and written
+    by the writer thread in batches to the day file (``day_YYYY_MM_DD.jsonl``), one open file at a time.
+    The queue is bounded, records are dropped rather than blocking the request when the writer falls behind.
+    """
+    BATCH_SIZE = 256
+    FLUSH_INTERVAL = 1.0
+    QUEUE_SIZE = 10000
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._dropped = 0
+        self._day: Optional[str] = None
+        self._fp: Optional[BinaryIO] = None
+        atexit.register(self.close)
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    def file_for_day(self, day: str) -> Path:
+        return self.root / f"day_{day}.jsonl"
+
+    def put(self, info: VisitorInfo) -> bool:
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(info)
+            return True
+        except queue.Full:
+            self._dropped += 1
+            return False
+
+    def close(self, timeout: float = 5.0):
+        """Writes the queued records and stops the writer
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None or self._pid != os.getpid():
+                return
+            self._queue.put(None)
+            self._thread = None
+        thread.join(timeout)
+
+    def _writer_alive(self) -> bool:
+        # The writer thread does not survive the fork of the (pre-loaded) server worker
+        thread = self._thread
+        return thread is not None and self._pid == os.getpid() and thread.is_alive()
+
+    def _ensure_writer(self):
+        if self._writer_alive():
+            return
+        with self._lock:
+            if self._writer_alive():
+                return
+            if self._thread is not None and self._pid == os.getpid():
+                # The writer stopped by an unexpected error - the queued records are written by the new one
+                log.warning("[VISITORS] Writer thread has stopped, restarting it")
+                self._close_file()
+            else:
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+                self._fp = None
+                self._day = None
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), name='pylunch-visitors',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self, records: queue.Queue):
+        stop = False
+        while not stop:
+            batch: List[VisitorInfo] = []
+            try:
+                item = records.get(timeout=self.FLUSH_INTERVAL)
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= self.BATCH_SIZE:
+                        break
+                    item = records.get_nowait()
+                stop = item is None
+            except queue.Empty:
+                pass
+            if batch:
+                self._write(batch)
+        self._close_file()
+
+    def _write(self, batch: List[VisitorInfo]):
+        try:
+            lines = []
+            for info in batch:
+                if info.day != self._day:
+                    self._flush_lines(lines)
+                    lines = []
+                    self._rotate(info.day)
+                lines.append(info.dump_compact() + '\n')
+            self._flush_lines(lines)
+        except OSError as ex:
+            log.error(f"[VISITORS] Unable to write {len(batch)} records: {ex}")
+            self._close_file()
+
+    def _flush_lines(self, lines: List[str]):
+        if lines:
+            # Unbuffered append - one write per batch, so the records of the workers are not interleaved
+            self._fp.write(''.join(lines).encode('utf-8'))
+
+    def _rotate(self, day: str):
+        self._close_file()
+        if not self.root.exists():
+            self.root.mkdir(parents=True)
+        self._fp = self.file_for_day(day).open('ab', buffering=0)
+        self._day = day
+        log.debug(f"[VISITORS] Writing visitors to: {self.file_for_day(day)}")
+
+    def _close_file(self):
+        if self._fp is not None:
+            self._fp.close()
+        self._fp = None
+        self._day = None
+
+
 class VisitorService:
     def __init__(self, base: Path) -> None:
         self.root: Path = base / 'visitors'
+        self.sink = VisitorSink(self.root)
 
     def store(self, vid: str, info: 'VisitorInfo') -> None:
+        self.sink.put(info)
 
-        if not self.root.exists():
-            self.root.mkdir(parents=True)
-
-        now = datetime.datetime.now()
-        day = now.strftime("%Y_%m_%d")
-        log = log_config.for_visitor(self.root, day)
-        log.info(info.dump())
+    def close(self):
+        self.sink.close()
@@ -7,8 +7,13 @@ import click
 import datetime
 
 from pathlib import Path
-from typing import List, Mapping, Optional, Union
+from typing import List, Mapping, Optional, Union, Any, Tuple
 from pylunch import config, lunch, utils, __version__, log_config, errors
+from pylunch.deadline import Deadline
+from pylunch.journal import RegistryJournal
+from pylunch.metrics import Metrics
+from pylunch.popularity import Popularity
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from flask_jwt_extended import (
@@ -29,7 +34,7 @@ base_dir = Path(__file__).parent.parent
 RESOURCES = base_dir / 'resources'
 INTERNAL = base_dir / 'internal'
 APP_NAME = 'PyLunch'
-CONFIG_DIR = click.get_app_dir(APP_NAME.lower())
+CONFIG_DIR = os.getenv('PYLUNCH_CONFIG_DIR', click.get_app_dir(APP_NAME.lower()))
 tmpl_dir = os.path.join(os.path.dirname(
     os.path.abspath(__file__)), "templates")
 static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
@@ -116,6 +121,57 @@ def page_not_found(e: Exception):
     return flask.render_template('error.html', **context), 404
 
 
+class PageContext:
+    """Common context of the page templates - computed once per version of the restaurants registry,
+    together with the rendered fragments (the restaurants and tags lists). The analytics snippet
+    is read again only when the file is modified.
+    """
+    FRAGMENTS = dict(restaurants_fragment='fragments/restaurants.html', tags_fragment='fragments/tags.html')
+
+    def __init__(self, analytics_path: Path = None):
+        self.analytics_path = Path(analytics_path) if analytics_path is not None else INTERNAL / 'analytics.html'
+        # Replaced as a whole - (registry version, context) and (mtime, content)
+        self._common: Optional[tuple] = None
+        self._analytics: Optional[tuple] = None
+
+    def analytics(self) -> Optional[str]:
+        try:
+            mtime = self.analytics_path.stat().st_mtime_ns
+        except OSError:
+            if self._analytics is not None:
+                log.info(f"[INIT] Analytics removed: {self.analytics_path}")
+            self._analytics = None
+            return None
+        cached = self._analytics
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        content = self.analytics_path.read_text(encoding='utf-8')
+        log.info(f"[INIT] Analytics loaded: {self.analytics_path}")
+        self._analytics = (mtime, content)
+        return content
+
+    def common(self, service: lunch.LunchService) -> Mapping[str, Any]:
+        version = service.instances.version
+        cached = self._common
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        log.debug(f"[CONTEXT] Rendering the common context of the registry version {version}")
+        context = dict(
+            version=__version__,
+            all_tags=service.instances.all_tags(),
+            all_restaurants=list(service.instances.all()),
+        )
+        for (name, template) in self.FRAGMENTS.items():
+            context[name] = Markup(flask.render_template(template, **context))
+        self._common = (version, context)
+        return context
+
+    def get(self, service: lunch.LunchService, **kwargs) -> dict:
+        """Context of the page - the common part and the per request values
+        """
+        return {**self.common(service), 'analytics': self.analytics(), **kwargs}
+
+
 class WebApplication:
     INSTANCE = None
 
@@ -151,11 +207,22 @@ class WebApplication:
         config_dir = config_dir if config_dir is not None else CONFIG_DIR
         self.config_loader = config.YamlLoader(config_dir, 'config.yaml')
         self.restaurants_loader = config.YamlLoader(config_dir, 'restaurants.yaml')
+        self.restaurants_journal = RegistryJournal(self.restaurants_loader)
         self.users = AdminUsers()
         self._timestamp = None
+        # Modification times of the registry files (the YAML file and the journal) of the loaded restaurants
+        self._registry_mtimes = None
         self._config = None
         self._users_file: Optional[Path] = None
         self._visitors: VisitorService = None
+        # Metrics and popularity are kept across the restaurants reloads
+        self._metrics = Metrics()
+        self._popularity: Optional[Popularity] = None
+        self._context = PageContext()
+
+    @property
+    def config(self) -> config.AppConfig:
+        return self._config
 
     @property
     def request(self) -> flask.Request:
@@ -163,8 +230,10 @@ class WebApplication:
 
     @property
     def service(self) -> lunch.LunchService:
-        if self._service is None or ((self._timestamp + datetime.timedelta(minutes=10)) < datetime.datetime.now()):
+        if self._service is None:
             self.reload_restaurants()
+        elif (self._timestamp + datetime.timedelta(minutes=10)) < datetime.datetime.now():
+            self.reload_if_changed()
         return self._service
 
     def init(self, **kwargs) -> 'WebApplication':
@@ -172,6 +241,8 @@ class WebApplication:
         if not self.config_loader.base_dir.exists():
             self._first_run()
         cfg_dict = {**self.config_loader.load(), **kwargs}
+        # The server is long running - stale content can be refreshed in the background
+        cfg_dict.setdefault('stale_while_revalidate', True)
         self._config = config.AppConfig(**cfg_dict)
         self._users_file = Path(
             os.getenv('PYLUNCH_USERS', RESOURCES / 'users.yml'))
@@ -179,8 +250,24 @@ class WebApplication:
         self._visitors = VisitorService(self._config.visitors)
         return self
 
+    def reload_if_changed(self) -> bool:
+        """Reloads the restaurants if the registry files were changed since the load (by the CLI or other process)
+        """
+        if self._registry_mtimes == self._read_registry_mtimes():
+            self._timestamp = datetime.datetime.now()
+            return False
+        log.info("[INIT] Restaurants registry changed, reloading")
+        self.reload_restaurants()
+        return True
+
+    def _read_registry_mtimes(self) -> Tuple[Optional[int], ...]:
+        files = (self.restaurants_loader.full_path, self.restaurants_journal.path)
+        return tuple(file.stat().st_mtime_ns if file.exists() else None for file in files)
+
     def reload_restaurants(self):
-        loaded = self.restaurants_loader.load() or dict(restaurants={})
+        # Read before the load - the change written meanwhile is loaded by the next check
+        self._registry_mtimes = self._read_registry_mtimes()
+        loaded = self.restaurants_journal.load(snapshot_dir=self._config.snapshot_dir) or dict(restaurants={})
         unwrapped = loaded.get('restaurants') or loaded
         log.info(f"[INIT] Loaded: {[name for name in unwrapped.keys()]}")
         upsdated_str = loaded.get('updated')
@@ -188,7 +275,8 @@ class WebApplication:
             upsdated_str) if upsdated_str is not None else None
         ent = lunch.Entities(unwrapped, updated=updated)
         self._timestamp = datetime.datetime.now()
-        self._service = lunch.LunchService(self._config, ent)
+        self._service = lunch.LunchService(self._config, ent, metrics=self._metrics, popularity=self._popularity)
+        self._popularity = self._service.popularity
 
     def _first_run(self):
         log.info(
@@ -198,31 +286,15 @@ class WebApplication:
         self.restaurants_loader.save(data={})
 
     def save_restaurants(self):
-        log.info("Saving restaurants")
-        self.restaurants_loader.save(self.service.instances.to_dict())
+        changes = self.service.instances.pop_changes()
+        log.info(f"[SAVE] Saving restaurants changes: {len(changes)}")
+        self.restaurants_journal.append(changes)
 
     def select_instances(self, selectors, fuzzy=False, tags=False, with_disabled=True) -> List[lunch.LunchEntity]:
         return self.service.instances.select(selectors, fuzzy=fuzzy, tags=tags, with_disabled=with_disabled)
 
     def gen_context(self, **kwargs):
-        tags = self.service.instances.all_tags()
-        restaurants = self.service.instances.all()
-        analytics = self._load_analytics()
-        return dict(
-            version=__version__,
-            all_tags=tags,
-            all_restaurants=restaurants,
-            analytics=analytics,
-            **kwargs)
-
-    def _load_analytics(self):
-        analytics_path: Path = INTERNAL / 'analytics.html'
-        if not analytics_path.exists():
-            log.debug(f"[INIT] Analytics not loaded: {analytics_path}")
-            return None
-
-        log.info(f"[INIT] Analytics loaded: {analytics_path}")
-        return analytics_path.read_text(encoding='utf-8')
+        return self._context.get(self.service, **kwargs)
 
     @classmethod
     def get(cls) -> 'WebApplication':
@@ -231,6 +303,30 @@ class WebApplication:
             cls.INSTANCE.init()
         return cls.INSTANCE
 
+    @classmethod
+    def preload(cls) -> 'WebApplication':
+        """Builds the application before the server workers are forked (gunicorn --preload),
+        the workers inherit the loaded config, users, restaurants, modules and templates
+        """
+        web_app = cls.get()
+        web_app.service.warm_up()
+        for template in app.jinja_env.list_templates():
+            app.jinja_env.get_template(template)
+        with app.app_context():
+            web_app.gen_context()
+        log.info(f"[INIT] Preloaded {len(web_app.service.instances)} restaurants in the process {os.getpid()}")
+        return web_app
+
+    def after_fork(self):
+        """The worker keeps the preloaded service unless the registry was changed since the preload
+        (the worker forked later by the master), the age of the preloaded service does not matter
+        """
+        if self._service is None:
+            return
+        # The metrics and popularity shared with the reloaded service are reset too
+        self._service.after_fork()
+        self.reload_if_changed()
+
     def parse_request(self):
         rq = flask.request
         args = rq.args
@@ -256,6 +352,9 @@ class WebApplication:
         result = _inner()
         return roll_filter(result, roll)
 
+    def request_deadline(self) -> Deadline:
+        return Deadline(self.config.page_timeout)
+
     def save_users(self):
         log.info(f"[SAVE] Saving users to: {self._users_file}")
         self.users.export_users(self._users_file)
@@ -265,6 +364,12 @@ class WebApplication:
         if not visitorId:
             visitorId = utils.random_string(32)
 
+        # Restaurants selected explicitly by the visitor - only the exact names of the existing ones,
+        # the typos are not credited to the fuzzy matched restaurants
+        for name in self.request.args.getlist('r'):
+            if name in self.service.instances:
+                self.service.popularity.hit(name)
+
         self._visitors.store(visitorId, VisitorInfo(
             id=visitorId,
             ua=self.request.user_agent.string,
@@ -321,7 +426,8 @@ def index():
 def restaurant(name):
     web_app: WebApplication = WebApplication.get()
     entity = web_app.service.instances.find_one(name)
-    menu = web_app.service.resolve_text(entity)
+    web_app.service.popularity.hit(entity.name)
+    menu = web_app.service.resolve_text(entity, deadline=web_app.request_deadline())
     context = web_app.gen_context(entity=entity, menu=menu)
     return flask.render_template('restaurant.html', **context)
 
@@ -354,6 +460,13 @@ def route_api_restaurants():
     return flask.jsonify({item.name: item.config for item in instances if item})
 
 
+@api.route("/metrics")
+def route_api_metrics():
+    web_app = WebApplication.get()
+    content = web_app.service.metrics.to_prometheus()
+    return flask.Response(content, mimetype='text/plain; version=0.0.4')
+
+
 @api.route("/tags")
 def route_api_tags():
     web_app = WebApplication.get()
@@ -372,14 +485,30 @@ def route_api_restaurants_get(name):
 def route_api_restaurants_get_menu(name):
     web_app = WebApplication.get()
     instance = web_app.service.instances.find_one(name)
-    content = web_app.service.resolve_text(instance)
+    web_app.service.popularity.hit(instance.name)
+    day = request_weekday()
+    if day is not None:
+        content = web_app.service.resolve_day(instance, day, deadline=web_app.request_deadline())
+    else:
+        content = web_app.service.resolve_text(instance, deadline=web_app.request_deadline())
     if content:
-        result = {**instance.config, 'content': content}
-        return flask.jsonify(result)
+        return flask.jsonify(menu_json(instance, content))
     else:
         return flask.jsonify(errors.UnableToLoadContent(name, url=instance.url).to_json()), 400
 
 
+@api.route("/restaurants/<name>/week")
+def route_api_restaurants_get_week(name):
+    web_app = WebApplication.get()
+    instance = web_app.service.instances.find_one(name)
+    web_app.service.popularity.hit(instance.name)
+    week = web_app.service.resolve_week(instance, deadline=web_app.request_deadline())
+    if week is None:
+        return flask.jsonify(errors.UnableToLoadContent(name, url=instance.url).to_json()), 400
+    days = {utils.WEEKDAYS[day]: content for (day, content) in week['days'].items()}
+    return flask.jsonify({**instance.config, 'content': week['content'], 'days': days})
+
+
 @api.route("/restaurants/<name>/cache")
 def route_api_restaurants_get_cache(name):
     web_app = WebApplication.get()
@@ -520,7 +649,7 @@ def admin_cache_invalidate():
 @admin.route('/config/restaurants', methods=['GET'])
 def admin_config_restaurants_get():
     web_app = WebApplication.get()
-    return flask.jsonify(dict(content=web_app.restaurants_loader.full_path.read_text(encoding='utf-8')))
+    return flask.jsonify(dict(content=web_app.restaurants_journal.dump()))
 
 
 @jwt_required()
@@ -541,7 +670,7 @@ def admin_config_restaurants_post():
     elif url:
         web_app.service.import_url(url, override=True)
 
-    web_app.restaurants_loader.save(web_app.service.instances.to_dict())
+    web_app.save_restaurants()
     return flask.jsonify(dict(content=web_app.service.instances.to_dict()))
 
 
@@ -558,6 +687,23 @@ def resolve_menu(service: lunch.LunchService, instance):
     return result
 
 
+def request_weekday(args=None) -> Optional[int]:
+    """The day of the week requested by the ``day`` query parameter
+    """
+    args = args if args is not None else flask.request.args
+    try:
+        return utils.parse_weekday(args.get('day'))
+    except ValueError as ex:
+        raise errors.PyLunchApiError(str(ex), code=400)
+
+
+def menu_json(instance: lunch.LunchEntity, content: str) -> dict:
+    result = {**instance.config, 'content': content}
+    if isinstance(content, lunch.StaleContent):
+        result['stale'] = content.day
+    return result
+
+
 def _generate_menu_header(instance):
     name_str = f"{instance.display_name} ({instance.name})"
     tags_str = "Tags: " + (", ".join(instance.tags) if instance.tags else '')
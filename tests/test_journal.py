@@ -0,0 +1,161 @@
+import json
+
+import pytest
+
+from pylunch import config, errors, lunch
+from pylunch.journal import RegistryJournal, replay
+
+
+@pytest.fixture
+def loader(tmp_path) -> config.YamlLoader:
+    loader = config.YamlLoader(tmp_path, 'restaurants.yaml')
+    loader.save(dict(restaurants=dict(
+        first=dict(name='first', url='http://first.example', tags=['a']),
+        second=dict(name='second', url='http://second.example'),
+    )))
+    return loader
+
+
+def _records(journal: RegistryJournal) -> list:
+    lines = journal.path.read_text(encoding='utf-8').splitlines()
+    return [record for record in map(json.loads, lines) if record['op'] != 'begin']
+
+
+def test_replay_put_set_unset_del():
+    data = dict(restaurants=dict(old=dict(name='old', url='http://old.example')))
+    replay(data, [
+        dict(op='put', name='new', config=dict(name='new', url='http://new.example')),
+        dict(op='set', name='new', values=dict(disabled=True, selector='div')),
+        dict(op='unset', name='new', keys=['disabled']),
+        dict(op='del', name='old'),
+    ])
+    assert data == dict(restaurants=dict(new=dict(name='new', url='http://new.example', selector='div')))
+
+
+def test_replay_unwrapped_and_unknown_changes():
+    data = dict(first=dict(name='first'))
+    replay(data, [
+        dict(op='set', name='missing', values=dict(disabled=True)),
+        dict(op='del', name='missing'),
+        dict(op='rename', name='first'),
+        dict(op='set', name='first', values=dict(disabled=True)),
+    ])
+    assert data == dict(first=dict(name='first', disabled=True))
+
+
+def test_append_and_load(loader):
+    journal = RegistryJournal(loader)
+    journal.append([
+        dict(op='put', name='third', config=dict(name='third', url='http://third.example')),
+        dict(op='set', name='first', values=dict(disabled=True)),
+        dict(op='unset', name='first', keys=['tags']),
+        dict(op='del', name='second'),
+    ])
+    restaurants = journal.load()['restaurants']
+    assert restaurants == dict(
+        first=dict(name='first', url='http://first.example', disabled=True),
+        third=dict(name='third', url='http://third.example'),
+    )
+    # The YAML file is not written until the compaction
+    assert set(loader.load()['restaurants']) == {'first', 'second'}
+
+
+def test_entities_changes(loader):
+    journal = RegistryJournal(loader)
+    entities = lunch.Entities(journal.load()['restaurants'])
+    entities.register('third', url='http://third.example')
+    entities.update('first', disabled=True)
+    entities.unset('first', 'disabled')
+    del entities['second']
+    journal.append(entities.pop_changes())
+    assert entities.pop_changes() == []
+    restaurants = journal.load()['restaurants']
+    assert set(restaurants) == {'first', 'third'}
+    assert 'disabled' not in restaurants['first']
+    assert restaurants['third']['url'] == 'http://third.example'
+
+
+def test_compact(loader):
+    journal = RegistryJournal(loader)
+    journal.append([dict(op='set', name='first', values=dict(disabled=True)), dict(op='del', name='second')])
+    expected = journal.load()
+    journal.compact()
+    assert _records(journal) == []
+    assert loader.load() == expected
+    assert journal.load() == expected
+
+
+def test_compact_after_size(loader):
+    journal = RegistryJournal(loader, compact_size=1)
+    journal.append([dict(op='del', name='second')])
+    assert _records(journal) == []
+    assert set(loader.load()['restaurants']) == {'first'}
+
+
+def test_compaction_replay_is_idempotent(loader):
+    journal = RegistryJournal(loader)
+    journal.append([dict(op='put', name='third', config=dict(name='third', url='http://third.example')),
+                    dict(op='set', name='first', values=dict(disabled=True))])
+    expected = journal.load()
+    # The compaction interrupted after the YAML file is written - the journal is replayed again
+    loader.save(expected)
+    assert journal.load() == expected
+
+
+def test_save_drops_journal(loader):
+    journal = RegistryJournal(loader)
+    journal.append([dict(op='del', name='second')])
+    journal.save(dict(restaurants=dict(edited=dict(name='edited', url='http://edited.example'))))
+    assert _records(journal) == []
+    assert set(journal.load()['restaurants']) == {'edited'}
+
+
+def test_partial_line(loader):
+    journal = RegistryJournal(loader)
+    journal.append([dict(op='set', name='first', values=dict(disabled=True))])
+    # The record written partially by a crashed process
+    with journal.path.open('a', encoding='utf-8') as fp:
+        fp.write('{"op": "del", "na')
+    assert set(journal.load()['restaurants']) == {'first', 'second'}
+
+    journal.append([dict(op='del', name='second')])
+    lines = journal.path.read_text(encoding='utf-8').splitlines()
+    assert lines[1] == '{"op": "del", "na'
+    assert json.loads(lines[2]) == dict(op='del', name='second')
+    restaurants = journal.load()['restaurants']
+    assert set(restaurants) == {'first'}
+    assert restaurants['first']['disabled'] is True
+
+
+def test_save_replays_changes_appended_during_edit(loader):
+    journal = RegistryJournal(loader)
+    journal.append([dict(op='set', name='first', values=dict(disabled=True))])
+    (data, position) = journal.checkout()
+    assert data['restaurants']['first']['disabled'] is True
+    # Appended by a server worker while the registry is edited
+    journal.append([dict(op='put', name='third', config=dict(name='third', url='http://third.example')),
+                    dict(op='del', name='second')])
+    data['restaurants']['first']['selector'] = 'div'
+    journal.save(data, since=position)
+    assert _records(journal) == []
+    restaurants = journal.load()['restaurants']
+    assert set(restaurants) == {'first', 'third'}
+    assert restaurants['first']['selector'] == 'div'
+    assert restaurants['first']['disabled'] is True
+
+
+def test_save_after_compaction_during_edit(loader):
+    journal = RegistryJournal(loader)
+    (data, position) = journal.checkout()
+    journal.append([dict(op='del', name='second')])
+    journal.compact()
+    data['restaurants']['first']['disabled'] = True
+    with pytest.raises(errors.RegistryChanged):
+        journal.save(data, since=position)
+    assert set(journal.load()['restaurants']) == {'first'}
+
+    # The position in the compacted journal is valid
+    (data, position) = journal.checkout()
+    journal.append([dict(op='set', name='first', values=dict(disabled=True))])
+    journal.save(data, since=position)
+    assert journal.load()['restaurants']['first']['disabled'] is True